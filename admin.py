@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Porta de administração do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Servidor HTTP local, em uma thread à parte, com as rotas de diagnóstico do
+servidor (ex.: /metrics no formato de texto do Prometheus, traces e profiler)
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict
+from urllib.parse import parse_qs, urlsplit
+
+import tracing
+
+ADMIN_HOST = '127.0.0.1'  # só conexões locais
+JSON_TYPE = 'application/json; charset=utf-8'
+TEXT_TYPE = 'text/plain; charset=utf-8'
+MAX_PROFILE_SECONDS = 300
+
+class AdminServer:
+    """Servidor HTTP de administração. Cada rota recebe os parâmetros da URL e
+    retorna (content-type, corpo)"""
+    
+    def __init__(self, host: str, port: int):
+        self.routes: Dict[str, Callable] = {'/': self.index}
+        admin = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                admin.handle(self)
+            
+            def log_message(self, format, *args):
+                pass  # sem uma linha de log por requisição
+        
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+    
+    def route(self, path: str, handler: Callable):
+        """Registra uma rota: handler(parâmetros) -> (content-type, corpo)"""
+        self.routes[path] = handler
+    
+    def start(self):
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+    
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+    
+    def index(self, query: dict):
+        return TEXT_TYPE, '\n'.join(sorted(self.routes)) + '\n'
+    
+    def add_tracing_routes(self):
+        """Rotas dos traces por requisição e do profiler por amostragem"""
+        self.route('/trace', trace_status)
+        self.route('/trace/dump', trace_dump)
+        self.route('/profile', profile_status)
+        self.route('/profile/start', profile_start)
+        self.route('/profile/stop', profile_stop)
+    
+    def handle(self, request: BaseHTTPRequestHandler):
+        url = urlsplit(request.path)
+        handler = self.routes.get(url.path)
+        status = 200
+        if handler is None:
+            status, content_type, body = 404, TEXT_TYPE, 'Rota desconhecida\n'
+        else:
+            try:
+                content_type, body = handler(parse_qs(url.query))
+            except ValueError as e:  # parâmetro inválido
+                status, content_type, body = 400, TEXT_TYPE, f'Parâmetro inválido: {e}\n'
+            except Exception as e:
+                status, content_type, body = 500, TEXT_TYPE, f'Erro: {e}\n'
+        
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        try:
+            request.send_response(status)
+            request.send_header('Content-Type', content_type)
+            request.send_header('Content-Length', str(len(data)))
+            request.end_headers()
+            request.wfile.write(data)
+        except OSError:
+            pass  # o cliente desistiu da resposta
+
+def param(query: dict, name: str, default, kind=str):
+    """Valor de um parâmetro da URL (o último, se repetido) convertido para `kind`"""
+    values = query.get(name)
+    return kind(values[-1]) if values else default
+
+def json_body(value):
+    return JSON_TYPE, json.dumps(value, ensure_ascii=False, indent=1) + '\n'
+
+def trace_status(query: dict):
+    """/trace?enable=1|0&buffer=N: liga/desliga o rastreamento e mostra o estado"""
+    enable = param(query, 'enable', None)
+    size = param(query, 'buffer', None, int)
+    if enable is not None or size is not None:
+        enabled = tracing.TRACER.enabled if enable is None else enable not in ('0', 'false', 'off')
+        tracing.TRACER.configure(enabled, size)
+    return json_body(tracing.TRACER.status())
+
+def trace_dump(query: dict):
+    """/trace/dump?limit=100&min_us=0&type=...: traces mais recentes primeiro"""
+    return json_body(tracing.TRACER.dump(param(query, 'limit', 100, int), param(query, 'min_us', 0, float),
+                                         param(query, 'type', None)))
+
+def profile_status(query: dict):
+    """/profile?seconds=N: coleta por N segundos e devolve as pilhas; sem parâmetros, o estado"""
+    seconds = param(query, 'seconds', None, float)
+    if seconds is None:
+        return json_body(tracing.PROFILER.status())
+    if not tracing.PROFILER.start(param(query, 'interval', tracing.DEFAULT_PROFILE_INTERVAL, float)):
+        return json_body({'error': 'Já existe uma coleta em andamento'})
+    time.sleep(min(max(seconds, 0), MAX_PROFILE_SECONDS))
+    return TEXT_TYPE, tracing.PROFILER.stop()
+
+def profile_start(query: dict):
+    """/profile/start?interval=0.01: liga o profiler até /profile/stop"""
+    tracing.PROFILER.start(param(query, 'interval', tracing.DEFAULT_PROFILE_INTERVAL, float))
+    return json_body(tracing.PROFILER.status())
+
+def profile_stop(query: dict):
+    """/profile/stop: desliga o profiler e devolve as pilhas no formato dos flame graphs"""
+    return TEXT_TYPE, tracing.PROFILER.stop()
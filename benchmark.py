@@ -0,0 +1,704 @@
+#!/usr/bin/env python3
+"""
+Benchmarks do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Mede o custo de CPU dos caminhos críticos do servidor, sem rede
+
+Uso: python benchmark.py [nome ...]   (sem nomes executa todos)
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from protocol import CODEC_BINARY, CODEC_JSON, HEADER_SIZE, FrameCompressor, FrameDecoder, encode_message, decode_message
+from outbound import FileRegion, OutboundQueue, TransportQueue
+from transfer import CHUNK_SIZE, FileStream
+
+class NullQueue:
+    """Fila de saída que só guarda o último frame (isola o custo do fan-out)"""
+    
+    codec = CODEC_JSON
+    
+    def __init__(self):
+        self.last = None
+    
+    def put(self, frame: bytes) -> bool:
+        self.last = frame
+        return True
+
+def cpu_time(function, repeat: int) -> float:
+    """Tempo médio de CPU (ms) de uma chamada"""
+    start = time.process_time()
+    for _ in range(repeat):
+        function()
+    return (time.process_time() - start) * 1000 / repeat
+
+def drain(sock: socket.socket):
+    """Lê e descarta tudo o que chega no socket até ele fechar"""
+    buffer = bytearray(1024 * 1024)
+    while sock.recv_into(buffer):
+        pass
+
+def bench_fanout():
+    """Fan-out de grupo: serializar por membro vs. serializar uma vez"""
+    payloads = {
+        'texto 100 B': {'content': 'x' * 100},
+        'arquivo 256 KB': {'file_data': base64.b64encode(os.urandom(256 * 1024)).decode('ascii')}
+    }
+    
+    print("\n== fan-out de grupo (ms de CPU por broadcast) ==")
+    print(f"{'payload':<16}{'membros':>8}{'por membro':>14}{'uma vez':>12}{'ganho':>8}")
+    for label, fields in payloads.items():
+        notification = {
+            'type': 'group_message_received',
+            'sender': 'alice',
+            'group_name': 'trabalho',
+            'timestamp': '12:00:00',
+            **fields
+        }
+        for members in (10, 100, 1000):
+            queues = [NullQueue() for _ in range(members)]
+            repeat = max(1, 2000 // members) if 'arquivo' not in label else max(1, 20 // members)
+            
+            def per_member():
+                for queue in queues:
+                    queue.put(encode_message(notification))
+            
+            def once():
+                frame = encode_message(notification)
+                for queue in queues:
+                    queue.put(frame)
+            
+            old = cpu_time(per_member, repeat)
+            new = cpu_time(once, repeat)
+            print(f"{label:<16}{members:>8}{old:>14.3f}{new:>12.3f}{old / max(new, 1e-6):>7.0f}x")
+
+def bench_download():
+    """Download de arquivo: chunks base64 em JSON vs. frames binários com sendfile"""
+    size = 32 * 1024 * 1024
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(os.urandom(size))
+        path = f.name
+    
+    def json_chunks(sock):
+        with open(path, 'rb') as f:
+            offset = 0
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sock.sendall(encode_message({
+                    'type': 'file_chunk',
+                    'file_id': 'x',
+                    'offset': offset,
+                    'data': base64.b64encode(chunk).decode('utf-8')
+                }))
+                offset += len(chunk)
+    
+    def binary_frames(sock):
+        for frame in FileStream(path, 'x').frames():
+            if isinstance(frame, FileRegion):
+                frame.send(sock)
+            else:
+                sock.sendall(frame)
+    
+    print("\n== download de arquivo de 32 MB (inclui o leitor do outro lado) ==")
+    print(f"{'caminho':<16}{'CPU ms':>10}{'tempo ms':>10}")
+    try:
+        for label, send in (('base64 + JSON', json_chunks), ('sendfile', binary_frames)):
+            server, client = socket.socketpair()
+            reader = threading.Thread(target=drain, args=(client,))
+            reader.start()
+            start, cpu = time.perf_counter(), time.process_time()
+            send(server)
+            server.close()
+            reader.join()
+            cpu = (time.process_time() - cpu) * 1000
+            wall = (time.perf_counter() - start) * 1000
+            client.close()
+            print(f"{label:<16}{cpu:>10.1f}{wall:>10.1f}")
+    finally:
+        os.remove(path)
+
+def bench_codec():
+    """Codec do payload: JSON vs. binário, para mensagens de texto e de arquivo"""
+    chunk = os.urandom(CHUNK_SIZE)
+    messages = {
+        'texto privado': {
+            'type': 'private_message_received',
+            'sender': 'alice',
+            'content': 'Oi, tudo bem? Já terminou a sua parte do trabalho?',
+            'timestamp': '12:00:00',
+            'id': 1234
+        },
+        'lista 20 arq.': {
+            'type': 'files_list',
+            'files': [{'file_id': f'{i:032x}', 'blob': f'{i:064x}', 'sender': 'alice', 'filename': f'relatorio{i}.pdf',
+                       'size': 123456 + i, 'group_name': 'trabalho'} for i in range(20)]
+        },
+        'chunk 64 KB': {
+            'type': 'file_chunk',
+            'transfer_id': 'a1b2c3d4',
+            'sender': 'alice',
+            'offset': 0,
+            'data': chunk
+        }
+    }
+    
+    print("\n== codec do payload (µs de CPU por mensagem, tamanho do frame) ==")
+    print(f"{'mensagem':<16}{'codec':<8}{'encode':>10}{'decode':>10}{'bytes':>9}")
+    for label, message in messages.items():
+        for codec_name in (CODEC_JSON, CODEC_BINARY):
+            # Caminho atual do JSON: os bytes do arquivo vão em base64
+            base64_data = codec_name == CODEC_JSON and 'data' in message
+            
+            def encode():
+                payload = message
+                if base64_data:
+                    payload = dict(message, data=base64.b64encode(message['data']).decode('ascii'))
+                return encode_message(payload, codec_name)
+            
+            def decode():
+                decoded = decode_message(memoryview(frame)[HEADER_SIZE:])
+                if base64_data:
+                    base64.b64decode(decoded['data'])
+            
+            frame = encode()
+            repeat = 200 if 'data' in message else 20000
+            encode_us = cpu_time(encode, repeat) * 1000
+            decode_us = cpu_time(decode, repeat) * 1000
+            print(f"{label:<16}{codec_name:<8}{encode_us:>10.1f}{decode_us:>10.1f}{len(frame):>9}")
+
+def bench_batching():
+    """Grupo movimentado: um envio por frame vs. frames agrupados em um envio (sendmsg/writelines)"""
+    members, messages = 50, 2000
+    frame = encode_message({
+        'type': 'group_message_received',
+        'sender': 'alice',
+        'group_name': 'trabalho',
+        'content': 'Alguém já subiu a versão nova do relatório?',
+        'timestamp': '12:00:00'
+    })
+    modes = (
+        ('sem agrupar', {'batch_delay': 0, 'batch_bytes': 1}),
+        ('só a fila', {'batch_delay': 0}),
+        ('espera 1 ms', {'batch_delay': 0.001})
+    )
+    
+    class QueueProtocol(asyncio.Protocol):
+        def pause_writing(self):
+            self.queue.pause_writing()
+        
+        def resume_writing(self):
+            self.queue.resume_writing()
+    
+    def run_thread(sockets, options):
+        queues = [OutboundQueue(sock, messages + 1, **options) for sock in sockets]
+        
+        def sender():
+            for _ in range(messages // 4):
+                for queue in queues:
+                    queue.put(frame)
+        
+        senders = [threading.Thread(target=sender) for _ in range(4)]
+        for thread in senders:
+            thread.start()
+        for thread in senders:
+            thread.join()
+        while sum(queue.sent for queue in queues) < members * messages:
+            time.sleep(0.001)
+        return queues
+    
+    async def run_async(sockets, options):
+        loop = asyncio.get_running_loop()
+        queues = []
+        for sock in sockets:
+            transport, protocol = await loop.connect_accepted_socket(QueueProtocol, sock)
+            protocol.queue = TransportQueue(transport, messages + 1, loop=loop, **options)
+            queues.append(protocol.queue)
+        
+        # Uma mensagem do remetente por volta do loop, como cada data_received
+        for _ in range(messages):
+            for queue in queues:
+                queue.put(frame)
+            await asyncio.sleep(0)
+        while sum(queue.sent for queue in queues) < members * messages:
+            await asyncio.sleep(0.001)
+        return queues
+    
+    print(f"\n== grupo de {members} membros recebendo {messages} mensagens (fan-out para sockets locais) ==")
+    print(f"{'modo':<8}{'envio':<14}{'envios/frame':>14}{'CPU ms':>10}{'tempo ms':>10}")
+    for engine in ('thread', 'async'):
+        for label, options in modes:
+            pairs = [socket.socketpair() for _ in range(members)]
+            readers = [threading.Thread(target=drain, args=(client,)) for _, client in pairs]
+            for thread in readers:
+                thread.start()
+            
+            start, cpu = time.perf_counter(), time.process_time()
+            sockets = [server for server, _ in pairs]
+            if engine == 'thread':
+                queues = run_thread(sockets, options)
+            else:
+                queues = asyncio.run(run_async(sockets, options))
+            cpu = (time.process_time() - cpu) * 1000
+            wall = (time.perf_counter() - start) * 1000
+            
+            writes = sum(queue.writes for queue in queues)
+            for queue in queues:
+                if engine == 'thread':
+                    queue.close()
+            for server, client in pairs:
+                server.close()
+            for thread in readers:
+                thread.join()
+            for _, client in pairs:
+                client.close()
+            print(f"{engine:<8}{label:<14}{writes / (members * messages):>14.3f}{cpu:>10.0f}{wall:>10.0f}")
+
+def bench_compression():
+    """Compressão por conexão: contexto zlib compartilhado vs. um contexto por frame"""
+    frames = [encode_message({
+        'type': 'group_message_received',
+        'sender': f'aluno{i % 7}',
+        'group_name': 'trabalho',
+        'content': f'Mensagem {i}: alguém já subiu a versão nova do relatório para o grupo?',
+        'timestamp': f'12:{i % 60:02d}:00',
+        'id': 1000 + i
+    }, codec_name) for i in range(2000) for codec_name in (CODEC_JSON, CODEC_BINARY)]
+    raw = sum(len(frame) for frame in frames)
+    
+    print("\n== compressão por conexão (2000 mensagens de grupo, JSON e binário) ==")
+    print(f"{'modo':<22}{'bytes':>10}{'razão':>8}{'µs/frame':>10}{'inflate µs':>12}")
+    print(f"{'sem compressão':<22}{raw:>10}{1:>8.3f}{0:>10.1f}{0:>12.1f}")
+    for label, shared in (('contexto compartilhado', True), ('contexto por frame', False)):
+        compressor = FrameCompressor()
+        
+        def compress_all():
+            nonlocal compressor
+            output = []
+            for frame in frames:
+                if not shared:
+                    compressor = FrameCompressor()
+                output.append(compressor.compress(frame))
+            return output
+        
+        start = time.process_time()
+        compressed = compress_all()
+        compress_us = (time.process_time() - start) * 1e6 / len(frames)
+        size = sum(len(frame) for frame in compressed)
+        
+        start = time.process_time()
+        decoder = FrameDecoder()
+        for frame in compressed:
+            if not shared:
+                decoder = FrameDecoder()
+            decoder.feed(frame)
+            for _ in decoder.frames():
+                pass
+        inflate_us = (time.process_time() - start) * 1e6 / len(frames)
+        print(f"{label:<22}{size:>10}{size / raw:>8.3f}{compress_us:>10.1f}{inflate_us:>12.1f}")
+
+@contextlib.contextmanager
+def scratch_server(**options):
+    """ChatServer com os arquivos em um diretório temporário (que vira o diretório atual)"""
+    from server import ChatServer
+    
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            with contextlib.redirect_stdout(None):
+                server = ChatServer(**options)
+            yield server
+            server.journal.close()
+        finally:
+            os.chdir(cwd)
+
+def bench_list_groups():
+    """list_groups: varredura de todos os grupos vs. índice reverso usuário -> grupos"""
+    lock = threading.Lock()
+    
+    def scan(groups, username):
+        # Implementação anterior: percorre todos os grupos sob um lock global
+        with lock:
+            return [group for group, members in groups.items() if username in members]
+    
+    print("\n== list_groups de um usuário em 10 grupos (µs por chamada) ==")
+    print(f"{'grupos':>8}{'varredura':>12}{'índice':>10}")
+    with scratch_server() as server:
+        created = 0
+        for total in (1000, 10000, 100000):
+            while created < total:
+                member = 'alice' if created < 10 else f'user{created}'
+                server.handle_create_group({'group_name': f'grupo{created}', 'creator': member})
+                created += 1
+            server.journal.sync()  # o log em segundo plano não entra na medição
+            
+            message = {'type': 'list_groups', 'username': 'alice'}
+            groups = dict(server.groups.items())
+            old = cpu_time(lambda: scan(groups, 'alice'), max(10, 1000000 // total)) * 1000
+            new = cpu_time(lambda: server.handle_list_groups(message), 100000) * 1000
+            print(f"{total:>8}{old:>12.1f}{new:>10.2f}")
+
+def bench_contention():
+    """Vazão com muitas threads em grupos distintos: lock global (1 faixa) vs. lock striping"""
+    operations = 2000
+    print("\n== threads operando em grupos distintos (mil operações/s) ==")
+    print(f"{'threads':>8}{'1 faixa':>10}{'64 faixas':>11}")
+    for threads in (1, 4, 16, 64):
+        results = []
+        for stripes in (1, 64):
+            with scratch_server(lock_stripes=stripes) as server:
+                for index in range(threads):
+                    for member in (f'dono{index}', f'membro{index}'):
+                        server.clients[member] = NullQueue()
+                    server.handle_create_group({'group_name': f'grupo{index}', 'creator': f'dono{index}'})
+                    server.handle_add_member({'group_name': f'grupo{index}', 'new_member': f'membro{index}',
+                                              'requester': f'dono{index}'})
+                
+                def worker(index):
+                    # Leitura de membros, lista de grupos e seleção das filas para o fan-out
+                    members = {'group_name': f'grupo{index}', 'requester': f'dono{index}'}
+                    groups = {'username': f'membro{index}'}
+                    for _ in range(operations):
+                        server.handle_list_group_members(members)
+                        server.handle_list_groups(groups)
+                        server.member_queues(server.group_members(f'grupo{index}'), f'dono{index}')
+                
+                workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+                start = time.perf_counter()
+                for thread in workers:
+                    thread.start()
+                for thread in workers:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+                results.append(threads * operations * 3 / elapsed / 1000)
+        print(f"{threads:>8}{results[0]:>10.0f}{results[1]:>11.0f}")
+
+def bench_metrics():
+    """Custo por evento das métricas: contador, histograma e lock medido (sem disputa)"""
+    import metrics
+    import tracing
+    
+    registry = metrics.Metrics()
+    plain = threading.RLock()
+    timed = metrics.TimedLock('bench')
+    repeat = 200000
+    
+    def locked(lock):
+        for _ in range(repeat):
+            with lock:
+                pass
+    
+    def loop(function, *args):
+        for _ in range(repeat):
+            function(*args)
+    
+    base = cpu_time(lambda: loop(int), 5) * 1e3 / repeat  # custo da chamada vazia
+    cases = (
+        ('count', lambda: loop(registry.count, 'errors_total', 'login')),
+        ('observe', lambda: loop(registry.observe, 'message_seconds', 'login', 123456)),
+        ('perf_counter_ns', lambda: loop(time.perf_counter_ns))
+    )
+    print("\n== métricas: custo por evento em uma thread (µs) ==")
+    for label, function in cases:
+        cost = cpu_time(function, 5) * 1e3 / repeat - base
+        print(f"{label:<22}{cost:>8.3f}")
+    plain_us = cpu_time(lambda: locked(plain), 5) * 1e3 / repeat
+    timed_us = cpu_time(lambda: locked(timed), 5) * 1e3 / repeat
+    print(f"{'RLock':<22}{plain_us:>8.3f}")
+    print(f"{'TimedLock':<22}{timed_us:>8.3f}")
+    
+    # Mensagem inteira por handle_frame, com as métricas do processo desligadas e ligadas
+    with scratch_server() as server:
+        server.clients['alice'] = NullQueue()
+        server.handle_create_group({'group_name': 'trabalho', 'creator': 'alice'})
+        frame = encode_message({'type': 'list_groups', 'username': 'alice'})[HEADER_SIZE:]
+        connection = NullQueue()
+        handle = lambda: server.handle_frame(frame, connection, 'alice')
+        originals = metrics.observe, metrics.count
+        metrics.observe = metrics.count = lambda *args: None
+        try:
+            off = cpu_time(handle, 50000) * 1000
+        finally:
+            metrics.observe, metrics.count = originals
+        on = cpu_time(handle, 50000) * 1000
+        tracing.TRACER.configure(True)
+        try:
+            traced = cpu_time(handle, 50000) * 1000
+        finally:
+            tracing.TRACER.configure(False)
+        print(f"{'list_groups sem':<22}{off:>8.3f}")
+        print(f"{'list_groups com':<22}{on:>8.3f}")
+        print(f"{'list_groups + trace':<22}{traced:>8.3f}")
+        print(f"{'linhas de /metrics':<22}{len(metrics.render().splitlines()):>8}")
+
+def bench_heartbeat():
+    """Prazos de inatividade: varrer todas as conexões a cada tick vs. roda de temporizadores"""
+    from timerwheel import TimerWheel
+    
+    interval, ticks = 30, 60
+    print(f"\n== prazo de {interval} s por conexão, 1 tick/s: CPU por tick (ms) ==")
+    print(f"{'conexões':>10}{'varredura':>12}{'roda':>10}")
+    for total in (1000, 10000, 100000):
+        last_seen = {index: 0.0 for index in range(total)}
+        
+        def scan():
+            # Um timer por conexão conferido a cada tick (o que cada thread faria sozinha)
+            now = time.monotonic()
+            return [key for key, seen in last_seen.items() if now - seen >= interval]
+        
+        wheel = TimerWheel(now=0)
+        for key in range(total):
+            wheel.schedule(key, interval * (1 + key / total))  # prazos espalhados
+        start = time.process_time()
+        for tick in range(1, ticks + 1):
+            for key in wheel.advance(interval + tick):
+                wheel.schedule(key, interval)
+        wheel_ms = (time.process_time() - start) * 1000 / ticks
+        print(f"{total:>10}{cpu_time(scan, 10):>12.2f}{wheel_ms:>10.3f}")
+
+def bench_dispatch():
+    """process_message: cadeia de if/elif vs. tabela de despacho; erro de validação montado vs. pré-serializado"""
+    import dispatch
+    from datetime import datetime
+    
+    invalid = {'type': 'message_response', 'status': 'error', 'message': 'Dados incompletos'}
+    
+    def chain(server, message, connection):
+        # Implementação anterior: comparações de texto em sequência, com a mesma
+        # validação que os handlers faziam no início (para comparar trabalho igual)
+        msg_type = message.get('type')
+        if msg_type == 'login':
+            if not message.get('username', '').strip():
+                return invalid
+            return server.handle_login(message)
+        elif msg_type == 'private_message':
+            if not all([message.get('sender'), message.get('recipient'), message.get('content')]):
+                return invalid
+            return server.handle_private_message(message)
+        elif msg_type == 'create_group':
+            if not message.get('group_name', '').strip() or not message.get('creator'):
+                return invalid
+            return server.handle_create_group(message)
+        elif msg_type == 'group_message':
+            if not all([message.get('sender'), message.get('group_name'), message.get('content')]):
+                return invalid
+            return server.handle_group_message(message)
+        elif msg_type == 'file_begin':
+            return server.handle_file_begin(message)
+        elif msg_type == 'file_chunk':
+            return server.handle_file_chunk(message)
+        elif msg_type == 'file_end':
+            return server.handle_file_end(message)
+        elif msg_type == 'fetch_file':
+            return server.handle_fetch_file(message, connection)
+        elif msg_type == 'list_files':
+            return server.handle_list_files(message, connection)
+        elif msg_type == 'history':
+            return server.handle_history(message, connection)
+        elif msg_type == 'list_users':
+            return server.handle_list_users()
+        elif msg_type == 'list_groups':
+            return server.handle_list_groups(message)
+        elif msg_type == 'add_member':
+            return server.handle_add_member(message)
+        elif msg_type == 'list_group_members':
+            return server.handle_list_group_members(message)
+        elif msg_type == 'queue_stats':
+            return server.handle_queue_stats()
+        else:
+            return {
+                'type': 'error',
+                'message': 'Tipo de mensagem não reconhecido'
+            }
+    
+    def old_invalid(message):
+        # Validação anterior dentro do handler: resposta montada e serializada a cada vez
+        sender = message.get('sender')
+        recipient = message.get('recipient')
+        content = message.get('content')
+        datetime.now().strftime("%H:%M:%S")
+        if not all([sender, recipient, content]):
+            return encode_message({
+                'type': 'message_response',
+                'status': 'error',
+                'message': 'Dados da mensagem incompletos'
+            })
+    
+    repeat = 200000
+    with scratch_server() as server:
+        # Handlers vazios: só o custo de chegar até eles
+        done = {'type': 'ok'}
+        for route in dispatch.ROUTES.values():
+            setattr(server, route.method, [lambda: done, lambda message: done,
+                                           lambda message, connection: done][route.arguments])
+        server.routes = dispatch.bind(server)
+        
+        print("\n== despacho de uma mensagem até o handler (µs) ==")
+        print(f"{'tipo':<26}{'posição':>8}{'if/elif':>10}{'tabela':>10}")
+        cases = (
+            ('file_chunk', 6, {'type': 'file_chunk', 'transfer_id': 't', 'offset': 0, 'data': ''}),
+            ('list_users', 11, {'type': 'list_users'}),
+            ('queue_stats', 15, {'type': 'queue_stats'}),
+            ('desconhecido', 16, {'type': 'desconhecido'}),
+            ('group_message (+campos)', 4, {'type': 'group_message', 'sender': 'alice', 'group_name': 'g', 'content': 'oi'}),
+            ('private_message (+campos)', 2, {'type': 'private_message', 'sender': 'alice', 'recipient': 'bob',
+                                              'content': 'oi'})
+        )
+        def best(function):
+            # Melhor de 5 rodadas: diferenças de décimos de µs somem no ruído de uma rodada só
+            return min(cpu_time(lambda: [function() for _ in range(repeat // 5)], 1) for _ in range(5)) \
+                * 1000 / (repeat // 5)
+        
+        for label, position, message in cases:
+            old = best(lambda: chain(server, message, None))
+            new = best(lambda: server.process_message(message, None))
+            print(f"{label:<26}{position:>8}{old:>10.3f}{new:>10.3f}")
+        
+        invalid = {'type': 'private_message', 'sender': 'alice'}
+        old = cpu_time(lambda: [old_invalid(invalid) for _ in range(repeat)], 1) * 1000 / repeat
+        new = cpu_time(lambda: [dispatch.encode_response(server.process_message(invalid, None), CODEC_JSON)
+                                for _ in range(repeat)], 1) * 1000 / repeat
+        print(f"\n== mensagem inválida: validação + resposta serializada (µs) ==")
+        print(f"{'montada a cada vez':<26}{old:>10.3f}")
+        print(f"{'pré-serializada':<26}{new:>10.3f}")
+
+def bench_memory():
+    """Memória: set de textos por grupo (antes) vs. Group com nomes internados e IDs; bytes por sessão"""
+    import gc
+    import tracemalloc
+    from outbound import Session
+    from registry import Group, NAMES, LARGE_GROUP
+    
+    def retained(build):
+        # Bytes que continuam alocados depois de build() (o resultado fica vivo até a medida)
+        gc.collect()
+        tracemalloc.start()
+        kept = build()
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        return used
+    
+    total, users = 200000, 20000
+    print(f"\n== MB por milhão de filiações ({total:,} medidas, {users:,} usuários; Group compacta acima de {LARGE_GROUP}) ==")
+    print(f"{'grupos x membros':<20}{'set de textos':>15}{'Group':>10}{'redução':>10}")
+    for scenario, size in enumerate((50, 100, 1000, 10000)):
+        groups = total // size
+        
+        def members(group_index, prefix):
+            # Cada nome chega como um texto novo, decodificado da mensagem
+            return (f'{prefix}{(group_index * 7919 + index) % users:06d}' for index in range(size))
+        
+        def old_layout():
+            return {f'grupo{index}': set(members(index, f'a{scenario}_')) for index in range(groups)}
+        
+        def new_layout():
+            registry = {}
+            for index in range(groups):
+                group = Group(f'grupo{index}', members(index, f'b{scenario}_'))
+                registry[group.name] = group
+            return registry
+        
+        # A tabela de nomes é paga uma vez por membro distinto (medida abaixo), não por filiação
+        for index in range(users):
+            NAMES.id(f'b{scenario}_{index:06d}')
+        old, new = retained(old_layout) / total, retained(new_layout) / total  # bytes por filiação = MB por milhão
+        print(f"{f'{groups:,} x {size:,}':<20}{old:>15.1f}{new:>10.1f}{old / new:>9.1f}x")
+    
+    per_user = retained(lambda: [NAMES.id(f'd_{index:06d}') for index in range(users)]) / users
+    print(f"{'tabela de nomes':<20}{per_user:>25.0f} bytes por membro")
+    
+    names = [f'c_{index:06d}' for index in range(10000)]
+    members_set, group = set(names), Group('grande', names)
+    probe = names[5000]
+    print(f"\n== grupo de {len(names):,} membros (µs) ==")
+    print(f"{'operação':<20}{'set':>10}{'Group':>10}")
+    print(f"{'membro in grupo':<20}{cpu_time(lambda: probe in members_set, 100000) * 1000:>10.3f}"
+          f"{cpu_time(lambda: probe in group, 100000) * 1000:>10.3f}")
+    print(f"{'cópia (fan-out)':<20}{cpu_time(lambda: set(members_set), 100) * 1000:>10.1f}"
+          f"{cpu_time(lambda: set(group), 100) * 1000:>10.1f}")
+    print(f"{'snapshot (fan-out)':<20}{'':>10}{cpu_time(group.snapshot, 100000) * 1000:>10.3f}")
+    print(f"{'membro in snapshot':<20}{'':>10}"
+          f"{cpu_time(lambda: probe in group.snapshot(), 100000) * 1000:>10.3f}")
+    
+    # Mensagem de grupo completa (todos os membros conectados): antes, set de
+    # textos copiado a cada envio; agora, array de IDs com o snapshot guardado
+    import registry
+    print(f"\n== group_message com todos os membros conectados (ms de CPU) ==")
+    print(f"{'membros':>8}{'set + cópia':>13}{'Group':>10}")
+    for size in (100, 1000, 10000):
+        results = []
+        for compact in (False, True):
+            large_group = registry.LARGE_GROUP
+            registry.LARGE_GROUP = large_group if compact else size + 1
+            try:
+                with scratch_server() as server:
+                    members = [f'f{size}_{index:06d}' for index in range(size)]
+                    server.apply_group('fanout', members)
+                    for member in members:
+                        server.clients[member] = NullQueue()
+                    if not compact:
+                        server.group_members = lambda name: set(server.groups.get(name))
+                    message = {'type': 'group_message', 'sender': members[0], 'group_name': 'fanout',
+                               'content': 'x' * 100}
+                    results.append(cpu_time(lambda: server.handle_group_message(message),
+                                            max(5, 20000 // size)))
+            finally:
+                registry.LARGE_GROUP = large_group
+        print(f"{size:>8}{results[0]:>13.3f}{results[1]:>10.3f}")
+    
+    class DictQueue:
+        """Mesmos atributos de TransportQueue guardados em __dict__ (como antes)"""
+    
+    fields = Session.__slots__ + TransportQueue.__slots__
+    
+    def dict_queues():
+        queues = []
+        for _ in range(10000):
+            source, queue = TransportQueue(None), DictQueue()
+            for name in fields:
+                setattr(queue, name, getattr(source, name))
+            queues.append(queue)
+        return queues
+    
+    slots = retained(lambda: [TransportQueue(None) for _ in range(10000)]) / 10000
+    print(f"\n== estado de uma conexão async (TransportQueue, bytes) ==")
+    print(f"{'__dict__':<20}{retained(dict_queues) / 10000:>10.0f}")
+    print(f"{'__slots__':<20}{slots:>10.0f}")
+
+BENCHMARKS = {
+    'fanout': bench_fanout,
+    'download': bench_download,
+    'codec': bench_codec,
+    'compression': bench_compression,
+    'batching': bench_batching,
+    'list_groups': bench_list_groups,
+    'contention': bench_contention,
+    'metrics': bench_metrics,
+    'heartbeat': bench_heartbeat,
+    'dispatch': bench_dispatch,
+    'memory': bench_memory
+}
+
+def main():
+    """Função principal dos benchmarks"""
+    parser = argparse.ArgumentParser(description="Benchmarks do Chat Distribuído")
+    parser.add_argument('names', nargs='*', help=f"benchmarks a executar: {', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+    
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"benchmark desconhecido: {', '.join(unknown)}")
+    
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,19 @@ import threading
 import json
 import os
 import base64
-from datetime import datetime
+import hashlib
+import time
+import uuid
+
+from protocol import FrameDecoder, FrameError, FrameCompressor, CODECS, CODEC_BINARY, CODEC_JSON, COMPRESSION_ZLIB, \
+    encode_message, decode_message
+from transfer import CHUNK_SIZE, is_compressible
+
+# Segundos de espera pelo offset de um upload informado pelo servidor
+UPLOAD_OFFSET_TIMEOUT = 10.0
+
+# Uploads pendentes mais antigos que isso não são mais retomados (o servidor já os descartou)
+UPLOAD_RESUME_LIMIT = 24 * 60 * 60
 
 class ChatClient:
     def __init__(self):
@@ -17,11 +29,23 @@ class ChatClient:
         self.username = None
         self.connected = False
         self.running = True
+        self.redirect = None  # servidor do cluster indicado no login ({host, port})
+        self.codec = CODEC_JSON  # codec das mensagens enviadas, negociado no login
+        self.compressor = None  # compressão das mensagens enviadas, negociada no login
+        self.files = {}  # file_id -> metadados dos arquivos recebidos
+        self.downloads = {}  # file_id -> arquivo sendo baixado
+        self.incoming_data = None  # file_data cujo frame binário é o próximo a chegar
+        self.send_lock = threading.Lock()  # o envio de arquivos pode rodar em outra thread
+        self.upload_waiters = {}  # transfer_id -> espera pelo offset informado pelo servidor
+        self.uploads_lock = threading.Lock()
         
         # Diretório para arquivos recebidos
         self.downloads_dir = "client_downloads"
         if not os.path.exists(self.downloads_dir):
             os.makedirs(self.downloads_dir)
+        
+        # Uploads não concluídos, retomados no próximo login
+        self.uploads_path = os.path.join(self.downloads_dir, '.uploads.json')
     
     def connect_to_server(self, host='localhost', port=12345):
         """Conecta ao servidor"""
@@ -29,6 +53,9 @@ class ChatClient:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((host, port))
             self.connected = True
+            # Codec e compressão valem por conexão: renegociados no login
+            self.codec = CODEC_JSON
+            self.compressor = None
             
             # Thread para escutar mensagens do servidor
             listen_thread = threading.Thread(target=self.listen_server)
@@ -43,36 +70,81 @@ class ChatClient:
     
     def listen_server(self):
         """Escuta mensagens do servidor"""
+        decoder = FrameDecoder()
+        sock = self.socket
         while self.connected and self.running:
             try:
-                data = self.socket.recv(4096)
-                if not data:
+                if not decoder.recv_into(sock):
                     break
                 
-                message = json.loads(data.decode('utf-8'))
-                self.handle_server_message(message)
+                # Processa todos os frames completos recebidos (o servidor envia vários por vez)
+                received = False
+                for frame in decoder.frames():
+                    if self.incoming_data is not None:
+                        # Frame binário com os bytes anunciados pelo file_data anterior
+                        self.handle_file_data(self.incoming_data, frame)
+                        self.incoming_data = None
+                        continue
+                    
+                    try:
+                        message = decode_message(frame)
+                    except ValueError:  # JSON ou payload binário inválido
+                        print("\n[ERRO] Mensagem inválida recebida do servidor")
+                        continue
+                    if message.get('type') == 'ping':
+                        # Heartbeat do servidor: responde sem mexer no prompt
+                        self.send_message({'type': 'pong'})
+                        continue
+                    self.handle_server_message(message, prompt=False)
+                    received = True
+                
+                # Reexibe o prompt uma vez por lote, não a cada mensagem
+                if received:
+                    print(f"\n{self.username}> ", end='', flush=True)
                 
             except ConnectionResetError:
                 print("\n[ERRO] Conexão com servidor perdida")
                 break
-            except json.JSONDecodeError:
-                print("\n[ERRO] Mensagem inválida recebida do servidor")
+            except FrameError as e:
+                print(f"\n[ERRO] Frame inválido recebido do servidor: {e}")
+                break
             except Exception as e:
                 print(f"\n[ERRO] Erro ao receber mensagem: {e}")
                 break
         
-        self.connected = False
+        # Após um redirecionamento a conexão antiga termina, mas o cliente segue conectado
+        if self.socket is sock:
+            self.connected = False
     
-    def handle_server_message(self, message: dict):
+    def handle_server_message(self, message: dict, prompt: bool = True):
         """Processa mensagens recebidas do servidor"""
         msg_type = message.get('type')
         
-        if msg_type == 'private_message_received':
+        if msg_type == 'offline_messages':
+            print(f"\n📬 {len(message['messages'])} mensagem(ns) recebida(s) enquanto você estava offline:")
+            for offline_message in message['messages']:
+                self.handle_server_message(offline_message, prompt=False)
+            
+        elif msg_type == 'private_message_received':
             print(f"\n💬 [PRIVADA] {message['sender']} ({message['timestamp']}): {message['content']}")
             
         elif msg_type == 'group_message_received':
             print(f"\n👥 [GRUPO: {message['group_name']}] {message['sender']} ({message['timestamp']}): {message['content']}")
             
+        elif msg_type == 'file_data':
+            self.incoming_data = message
+            return
+            
+        elif msg_type == 'file_complete':
+            self.handle_file_complete(message)
+            
+        elif msg_type == 'upload_offset':
+            self.handle_upload_offset(message)
+            return
+            
+        elif msg_type == 'files_list':
+            self.handle_files_list(message)
+            
         elif msg_type == 'file_received':
             self.handle_file_received(message)
             
@@ -93,6 +165,18 @@ class ChatClient:
         elif msg_type == 'added_to_group':
             print(f"\n🎉 Você foi adicionado ao grupo '{message['group_name']}' por {message['added_by']} ({message['timestamp']})")
         
+        elif msg_type == 'history':
+            if message.get('status') == 'success':
+                if message.get('group_name'):
+                    title = f"grupo '{message['group_name']}'"
+                else:
+                    title = f"conversa com {message['with']}"
+                print(f"\n📜 Histórico da {title} ({len(message['messages'])} mensagens):")
+                for entry in message['messages']:
+                    print(f"  #{entry['id']} {entry['sender']} ({entry['timestamp']}): {entry['content']}")
+            else:
+                print(f"\n❌ {message['message']}")
+        
         elif msg_type == 'members_list_response':
             if message.get('status') == 'success':
                 group_name = message['group_name']
@@ -105,82 +189,150 @@ class ChatClient:
                 print(f"\n❌ {message['message']}")
                 
         elif msg_type in ['login_response', 'message_response', 'group_response', 'file_response', 'member_response']:
+            if msg_type == 'login_response' and message.get('redirect'):
+                self.redirect = message['redirect']
+            if msg_type == 'login_response' and message.get('codec'):
+                self.codec = message['codec']
+            if msg_type == 'login_response' and message.get('compression') == COMPRESSION_ZLIB:
+                self.compressor = FrameCompressor()
+            if msg_type == 'file_response' and message.get('transfer_id'):
+                self.handle_upload_response(message)
             status = message.get('status', 'unknown')
             msg = message.get('message', 'Sem mensagem')
             icon = "✅" if status == 'success' else "❌"
             print(f"\n{icon} {msg}")
         
         # Reexibe prompt
-        print(f"\n{self.username}> ", end='', flush=True)
+        if prompt:
+            print(f"\n{self.username}> ", end='', flush=True)
     
     def handle_file_received(self, message: dict):
-        """Processa arquivo recebido (mensagem privada)"""
+        """Processa arquivo recebido (mensagem privada): só registra, o download é sob demanda"""
         sender = message['sender']
         filename = message['filename']
-        file_data = message['file_data']
         timestamp = message['timestamp']
         
-        try:
-            # Salva arquivo
-            safe_filename = f"{sender}_{filename}"
-            file_path = os.path.join(self.downloads_dir, safe_filename)
-            
-            with open(file_path, 'wb') as f:
-                f.write(base64.b64decode(file_data))
-            
-            print(f"\n📎 [ARQUIVO PRIVADO] {sender} ({timestamp}) enviou: {filename}")
-            print(f"   Salvo como: {file_path}")
-            
-        except Exception as e:
-            print(f"\n❌ Erro ao salvar arquivo de {sender}: {e}")
+        self.register_file(message)
+        print(f"\n📎 [ARQUIVO PRIVADO] {sender} ({timestamp}) enviou: {filename} ({format_size(message['size'])})")
+        print("   Use a opção 9 para baixar")
     
     def handle_group_file_received(self, message: dict):
-        """Processa arquivo recebido (grupo)"""
+        """Processa arquivo recebido (grupo): só registra, o download é sob demanda"""
         sender = message['sender']
         group_name = message['group_name']
         filename = message['filename']
-        file_data = message['file_data']
         timestamp = message['timestamp']
         
-        try:
-            # Salva arquivo
+        self.register_file(message)
+        print(f"\n📎 [ARQUIVO GRUPO: {group_name}] {sender} ({timestamp}) enviou: {filename} ({format_size(message['size'])})")
+        print("   Use a opção 9 para baixar")
+    
+    def handle_files_list(self, message: dict):
+        """Registra os arquivos disponíveis no servidor para este usuário"""
+        for file_info in message['files']:
+            self.register_file(file_info)
+        if message['files']:
+            print(f"\n📎 {len(message['files'])} arquivo(s) disponível(is) para download (opção 9)")
+    
+    def register_file(self, file_info: dict):
+        """Guarda os metadados de um arquivo recebido e o caminho de destino"""
+        sender = file_info['sender']
+        filename = os.path.basename(file_info['filename'])
+        group_name = file_info.get('group_name')
+        
+        if group_name:
             safe_filename = f"{group_name}_{sender}_{filename}"
-            file_path = os.path.join(self.downloads_dir, safe_filename)
-            
-            with open(file_path, 'wb') as f:
-                f.write(base64.b64decode(file_data))
-            
-            print(f"\n📎 [ARQUIVO GRUPO: {group_name}] {sender} ({timestamp}) enviou: {filename}")
-            print(f"   Salvo como: {file_path}")
-            
+        else:
+            safe_filename = f"{sender}_{filename}"
+        self.files[file_info['file_id']] = dict(file_info, path=os.path.join(self.downloads_dir, safe_filename))
+    
+    def handle_file_data(self, message: dict, data: memoryview):
+        """Grava um trecho recebido direto no disco"""
+        download = self.downloads.get(message['file_id'])
+        if download is None:
+            return
+        
+        try:
+            download.seek(message['offset'])
+            download.write(data)
         except Exception as e:
-            print(f"\n❌ Erro ao salvar arquivo do grupo: {e}")
+            print(f"\n❌ Erro ao salvar arquivo: {e}")
+            download.close()
+            del self.downloads[message['file_id']]
     
-    def send_message(self, message: dict):
-        """Envia mensagem para o servidor"""
+    def handle_file_complete(self, message: dict):
+        """Confere o hash do arquivo baixado e o move para o nome definitivo"""
+        file_id = message['file_id']
+        download = self.downloads.pop(file_id, None)
+        if download is None:
+            return
+        download.close()
+        
+        file_info = self.files[file_id]
+        part_path = file_info['path'] + '.part'
+        if file_sha256(part_path) != file_info['blob']:
+            os.remove(part_path)
+            print(f"\n❌ Arquivo {file_info['filename']} corrompido no download; tente novamente")
+            return
+        
+        os.replace(part_path, file_info['path'])
+        print(f"\n📥 Arquivo salvo como: {file_info['path']}")
+    
+    def send_message(self, message: dict, compress: bool = True) -> bool:
+        """Envia mensagem para o servidor (compress=False: conteúdo já comprimido)"""
         try:
-            self.socket.send(json.dumps(message).encode('utf-8'))
+            frame = encode_message(message, self.codec)
+            with self.send_lock:
+                # Sob o lock: os frames são comprimidos na ordem em que vão para o socket
+                if compress and self.compressor is not None:
+                    frame = self.compressor.compress(frame)
+                self.socket.sendall(frame)
+            return True
         except Exception as e:
             print(f"[ERRO] Não foi possível enviar mensagem: {e}")
+            return False
     
     def login(self):
         """Realiza login no servidor"""
         while not self.username:
             username = input("Digite seu nome de usuário: ").strip()
             if username:
+                # Oferece os codecs em ordem de preferência; sem resposta, segue em JSON
                 message = {
                     'type': 'login',
-                    'username': username
+                    'username': username,
+                    'codecs': list(CODECS),
+                    'compression': [COMPRESSION_ZLIB]
                 }
                 self.send_message(message)
                 
                 # Aguarda resposta (simplificado)
-                import time
                 time.sleep(0.5)
                 
+                if self.redirect:
+                    # Cluster: o usuário é atendido por outro servidor
+                    redirect, self.redirect = self.redirect, None
+                    self.socket.close()
+                    if not self.connect_to_server(redirect['host'], redirect['port']):
+                        return
+                    print(f"Redirecionado para {redirect['host']}:{redirect['port']}")
+                    self.send_message(message)
+                    time.sleep(0.5)
+                
                 if self.connected:
                     self.username = username
                     print(f"\n✅ Conectado como {username}")
+                    
+                    # Descobre arquivos recebidos que ainda podem ser baixados
+                    self.send_message({
+                        'type': 'list_files',
+                        'requester': username
+                    })
+                    
+                    # Retoma em segundo plano os uploads interrompidos
+                    resume_thread = threading.Thread(target=self.resume_uploads)
+                    resume_thread.daemon = True
+                    resume_thread.start()
                     break
             else:
                 print("Nome de usuário não pode estar vazio!")
@@ -267,26 +419,227 @@ class ChatClient:
             return
         
         try:
-            filename = os.path.basename(file_path)
-            
-            # Lê arquivo e converte para base64
-            with open(file_path, 'rb') as f:
-                file_data = base64.b64encode(f.read()).decode('utf-8')
-            
-            message = {
-                'type': 'send_file',
+            stat = os.stat(file_path)
+            upload = {
+                'transfer_id': uuid.uuid4().hex,
                 'sender': self.username,
                 'recipient': recipient,
-                'filename': filename,
-                'file_data': file_data,
-                'file_type': file_type
+                'file_type': file_type,
+                'path': os.path.abspath(file_path),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'created': time.time()
             }
+            self.save_upload(upload)
+            self.upload_file(upload)
             
-            self.send_message(message)
+        except Exception as e:
+            print(f"❌ Erro ao enviar arquivo: {e}")
+    
+    def upload_file(self, upload: dict) -> bool:
+        """Envia um arquivo em chunks a partir do offset que o servidor já recebeu"""
+        transfer_id = upload['transfer_id']
+        filename = os.path.basename(upload['path'])
+        waiter = {'event': threading.Event(), 'offset': None}
+        self.upload_waiters[transfer_id] = waiter
+        
+        message = {
+            'type': 'file_begin',
+            'transfer_id': transfer_id,
+            'sender': upload['sender'],
+            'recipient': upload['recipient'],
+            'filename': filename,
+            'size': upload['size'],
+            'file_type': upload['file_type']
+        }
+        if not self.send_message(message):
+            return False
+        
+        # O servidor responde com upload_offset (ou com um file_response de erro)
+        if not waiter['event'].wait(UPLOAD_OFFSET_TIMEOUT):
+            self.upload_waiters.pop(transfer_id, None)
+            print(f"❌ O servidor não respondeu ao envio de {filename}")
+            return False
+        offset = waiter['offset']
+        if offset is None:
+            return False
+        
+        if offset:
+            print(f"📎 Retomando envio de {filename} a partir de {format_size(offset)}...")
+        else:
             print(f"📎 Enviando arquivo {filename}...")
+        
+        # Lê e envia o arquivo em chunks: a memória usada não depende do tamanho
+        compressible = is_compressible(filename)
+        with open(upload['path'], 'rb') as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                
+                message = {
+                    'type': 'file_chunk',
+                    'transfer_id': transfer_id,
+                    'sender': upload['sender'],
+                    'offset': offset,
+                    'data': chunk if self.codec == CODEC_BINARY else base64.b64encode(chunk).decode('utf-8')
+                }
+                if not self.send_message(message, compress=compressible):
+                    return False
+                offset += len(chunk)
+        
+        return self.send_message({
+            'type': 'file_end',
+            'transfer_id': transfer_id,
+            'sender': upload['sender']
+        })
+    
+    def resume_uploads(self):
+        """Retoma os uploads deste usuário interrompidos em uma sessão anterior"""
+        for upload in self.load_uploads().values():
+            if upload['sender'] != self.username:
+                continue
             
+            try:
+                stat = os.stat(upload['path'])
+                unchanged = stat.st_size == upload['size'] and stat.st_mtime == upload['mtime']
+            except OSError:
+                unchanged = False
+            if not unchanged or time.time() - upload['created'] > UPLOAD_RESUME_LIMIT:
+                # Arquivo alterado/removido ou upload expirado: não dá mais para retomar
+                self.forget_upload(upload['transfer_id'])
+                continue
+            
+            try:
+                self.upload_file(upload)
+            except Exception as e:
+                print(f"❌ Erro ao retomar envio de {upload['path']}: {e}")
+    
+    def load_uploads(self) -> dict:
+        """Uploads pendentes salvos no disco (transfer_id -> upload)"""
+        with self.uploads_lock:
+            try:
+                with open(self.uploads_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return {}
+    
+    def save_upload(self, upload: dict):
+        """Registra um upload pendente para que ele possa ser retomado"""
+        uploads = self.load_uploads()
+        uploads[upload['transfer_id']] = upload
+        self._write_uploads(uploads)
+    
+    def forget_upload(self, transfer_id: str):
+        """Remove um upload concluído (ou que não será mais retomado)"""
+        uploads = self.load_uploads()
+        if uploads.pop(transfer_id, None) is not None:
+            self._write_uploads(uploads)
+    
+    def _write_uploads(self, uploads: dict):
+        with self.uploads_lock:
+            tmp_path = self.uploads_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(uploads, f)
+            os.replace(tmp_path, self.uploads_path)
+    
+    def handle_upload_offset(self, message: dict):
+        """Libera o envio dos chunks a partir do offset informado pelo servidor"""
+        waiter = self.upload_waiters.pop(message.get('transfer_id'), None)
+        if waiter:
+            waiter['offset'] = message.get('offset', 0)
+            waiter['event'].set()
+    
+    def handle_upload_response(self, message: dict):
+        """Resultado de um upload: concluído é esquecido; recusado acorda quem espera o offset"""
+        transfer_id = message['transfer_id']
+        if message.get('status') == 'success':
+            self.forget_upload(transfer_id)
+            return
+        
+        waiter = self.upload_waiters.pop(transfer_id, None)
+        if waiter:
+            waiter['event'].set()
+        else:
+            # Erro no meio do envio: o servidor descartou o arquivo parcial
+            self.forget_upload(transfer_id)
+    
+    def show_history(self):
+        """Pede ao servidor as últimas mensagens de uma conversa"""
+        print("Tipos de conversa:")
+        print("1. Privada")
+        print("2. Grupo")
+        
+        choice = input("Escolha o tipo (1-2): ").strip()
+        if choice not in ['1', '2']:
+            print("❌ Opção inválida")
+            return
+        
+        if choice == '1':
+            name = input("Digite o nome do usuário: ").strip()
+        else:
+            name = input("Digite o nome do grupo: ").strip()
+        if not name:
+            print("❌ Nome é obrigatório")
+            return
+        
+        limit = input("Quantas mensagens (padrão 20): ").strip()
+        message = {
+            'type': 'history',
+            'requester': self.username,
+            'limit': int(limit) if limit.isdigit() and int(limit) > 0 else 20
+        }
+        message['with' if choice == '1' else 'group_name'] = name
+        self.send_message(message)
+    
+    def download_file(self):
+        """Baixa do servidor um arquivo recebido, retomando downloads interrompidos"""
+        if not self.files:
+            print("❌ Nenhum arquivo disponível para download")
+            return
+        
+        files = list(self.files.values())
+        print("Arquivos disponíveis:")
+        for i, file_info in enumerate(files, 1):
+            origin = f"grupo {file_info['group_name']}" if file_info.get('group_name') else "privado"
+            status = " (baixado)" if os.path.exists(file_info['path']) else ""
+            print(f"  {i}. {file_info['filename']} de {file_info['sender']} ({origin}, {format_size(file_info['size'])}){status}")
+        
+        choice = input("Escolha o arquivo: ").strip()
+        if not choice.isdigit() or not 1 <= int(choice) <= len(files):
+            print("❌ Opção inválida")
+            return
+        
+        file_info = files[int(choice) - 1]
+        file_id = file_info['file_id']
+        if file_id in self.downloads:
+            print("❌ Este arquivo já está sendo baixado")
+            return
+        
+        # Um .part existente indica download interrompido: continua do ponto onde parou
+        part_path = file_info['path'] + '.part'
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset > file_info['size']:
+            offset = 0
+        
+        try:
+            download = open(part_path, 'r+b' if offset else 'wb')
         except Exception as e:
-            print(f"❌ Erro ao enviar arquivo: {e}")
+            print(f"❌ Erro ao criar arquivo: {e}")
+            return
+        download.truncate(offset)
+        self.downloads[file_id] = download
+        
+        message = {
+            'type': 'fetch_file',
+            'file_id': file_id,
+            'requester': self.username,
+            'offset': offset
+        }
+        if self.send_message(message):
+            action = f"Retomando em {format_size(offset)}" if offset else "Baixando"
+            print(f"📥 {action}: {file_info['filename']}...")
     
     def list_users(self):
         """Lista usuários conectados"""
@@ -354,8 +707,10 @@ class ChatClient:
         print("6. 📋 Listar meus grupos")
         print("7. ➕ Adicionar membro ao grupo")
         print("8. 👥 Ver membros do grupo")
-        print("9. ❓ Mostrar menu")
-        print("10. 🚪 Sair")
+        print("9. 📥 Baixar arquivo recebido")
+        print("10. 📜 Ver histórico de conversa")
+        print("11. ❓ Mostrar menu")
+        print("12. 🚪 Sair")
         print("="*50)
     
     def run(self):
@@ -395,15 +750,19 @@ class ChatClient:
                 elif command == '8':
                     self.list_group_members()
                 elif command == '9':
-                    self.show_menu()
+                    self.download_file()
                 elif command == '10':
+                    self.show_history()
+                elif command == '11':
+                    self.show_menu()
+                elif command == '12':
                     print("Encerrando cliente...")
                     self.running = False
                     break
                 elif command == '':
                     continue
                 else:
-                    print("Comando inválido. Digite '9' para ver o menu.")
+                    print("Comando inválido. Digite '11' para ver o menu.")
                     
             except KeyboardInterrupt:
                 print("\n\nEncerrando cliente...")
@@ -419,6 +778,22 @@ class ChatClient:
             self.socket.close()
         print("Cliente encerrado.")
 
+def format_size(size: int) -> str:
+    """Formata um tamanho em bytes para exibição"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def file_sha256(path: str) -> str:
+    """Hash SHA-256 de um arquivo, lido em chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 def main():
     """Função principal do cliente"""
     client = ChatClient()
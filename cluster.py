@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+Cluster do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Vários servidores (nós) dividem usuários e grupos por hashing consistente: cada
+usuário (com sua caixa de entrada) e cada grupo pertence a um nó, e os nós repassam
+mensagens entre si por conexões TCP próprias (servidor a servidor)
+"""
+
+import time
+import socket
+import hashlib
+import itertools
+import threading
+from bisect import bisect_right
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from protocol import HEADER, HEADER_SIZE, CODEC_JSON, encode_message, decode_message, encode_cached, recode_frame
+from outbound import FileRegion
+from history import private_conversation
+from workers import BusLink, CALL_TIMEOUT
+
+# Pontos de cada nó no anel (nós virtuais): espalham as chaves de modo uniforme
+RING_REPLICAS = 128
+
+# Segundos sem tentar reconectar a um nó que não respondeu
+RECONNECT_INTERVAL = 2.0
+
+# Threads que executam pedidos de clientes repassados por outros nós
+PEER_THREADS = 16
+
+# Pedidos executados no nó dono do grupo (chave: group_name)
+GROUP_REQUESTS = {'create_group', 'add_member', 'group_message', 'list_group_members'}
+
+# Pedidos atendidos só com o estado deste nó (os demais podem consultar outro nó,
+# e no servidor assíncrono vão para o pool de threads)
+LOCAL_REQUESTS = {'login', 'ping', 'pong', 'file_begin', 'file_chunk', 'queue_stats'}
+
+# Tipo da resposta de cada pedido repassado (para o erro de nó indisponível)
+RESPONSE_TYPES = {
+    'create_group': 'group_response',
+    'add_member': 'member_response',
+    'group_message': 'message_response',
+    'list_group_members': 'members_list_response',
+    'private_message': 'message_response',
+    'history': 'history'
+}
+
+def hash_key(key: str) -> int:
+    # hash() do Python muda a cada processo; todos os nós precisam do mesmo valor
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+class HashRing:
+    """Anel de hashing consistente: acrescentar ou remover um nó só move as chaves dele"""
+    
+    def __init__(self, nodes, replicas: int = RING_REPLICAS):
+        points = sorted((hash_key(f'{node}#{replica}'), node) for node in nodes for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+    
+    def owner(self, key: str) -> str:
+        """Nó dono da chave: o primeiro ponto do anel depois do hash dela"""
+        index = bisect_right(self._hashes, hash_key(key)) % len(self._hashes)
+        return self._nodes[index]
+
+def parse_cluster(spec: str) -> Dict[str, Tuple[str, int, int]]:
+    """'a=host:porta:porta_cluster,b=...' -> {nó: (host, porta dos clientes, porta do cluster)}"""
+    nodes = {}
+    for item in spec.split(','):
+        name, _, address = item.strip().partition('=')
+        host, port, peer_port = address.rsplit(':', 2)
+        nodes[name] = (host, int(port), int(peer_port))
+    return nodes
+
+class PeerClient:
+    """Conexão de saída para outro nó (aberta sob demanda e reaberta se cair).
+    
+    Por ela vão os pedidos e entregas deste nó; as respostas voltam pela mesma
+    conexão. Os pedidos do outro nó chegam pela conexão que ele abriu para cá.
+    """
+    
+    def __init__(self, local_node: str, node: str, host: str, peer_port: int):
+        self.local_node = local_node
+        self.node = node
+        self.address = (host, peer_port)
+        self.link = None
+        self.lock = threading.Lock()
+        self._retry_at = 0.0
+        self._ids = itertools.count(1)
+        self._replies: Dict[int, dict] = {}
+        self._cond = threading.Condition()
+    
+    def _connected(self) -> Optional[BusLink]:
+        with self.lock:
+            if self.link is not None and not self.link.closed:
+                return self.link
+            if time.monotonic() < self._retry_at:
+                return None
+            try:
+                sock = socket.create_connection(self.address, timeout=RECONNECT_INTERVAL)
+                sock.settimeout(None)
+            except OSError:
+                self._retry_at = time.monotonic() + RECONNECT_INTERVAL
+                return None
+            self.link = BusLink(sock)
+            self.link.send({'op': 'hello', 'node': self.local_node})
+            reader = threading.Thread(target=self._read, args=(self.link,))
+            reader.daemon = True
+            reader.start()
+            return self.link
+    
+    def send(self, op: str, raw: bytes = None, **fields) -> bool:
+        """Envia uma mensagem ao nó sem esperar resposta"""
+        link = self._connected()
+        return link is not None and link.send(dict(fields, op=op), raw)
+    
+    def start_call(self, op: str, **fields) -> Optional[int]:
+        """Envia um pedido; a resposta é obtida com wait_reply"""
+        request_id = next(self._ids)
+        return request_id if self.send(op, rid=request_id, **fields) else None
+    
+    def wait_reply(self, request_id: Optional[int]) -> Optional[dict]:
+        if request_id is None:
+            return None
+        with self._cond:
+            self._cond.wait_for(lambda: request_id in self._replies or self.link.closed, CALL_TIMEOUT)
+            return self._replies.pop(request_id, None)
+    
+    def call(self, op: str, **fields) -> Optional[dict]:
+        """Envia um pedido e espera a resposta (None se o nó não respondeu)"""
+        return self.wait_reply(self.start_call(op, **fields))
+    
+    def _read(self, link: BusLink):
+        for message, _ in link.messages():
+            with self._cond:
+                self._replies[message['rid']] = message
+                self._cond.notify_all()
+        with self._cond:
+            self._cond.notify_all()
+    
+    def close(self):
+        with self.lock:
+            if self.link is not None:
+                self.link.close()
+
+class PeerQueue:
+    """Fila de um usuário conectado a outro nó: os frames seguem pela conexão com ele.
+    
+    Também recebe um FileStream (download de um arquivo guardado neste nó): os
+    frames e trechos do arquivo são repassados em ordem pela mesma conexão.
+    """
+    
+    codec = CODEC_JSON  # entre nós sempre JSON; o nó do usuário recodifica se preciso
+    
+    __slots__ = ('peer', 'username', 'store')
+    
+    def __init__(self, peer: PeerClient, username: str, store: bool = False):
+        self.peer = peer
+        self.username = username
+        self.store = store  # se o usuário saiu, o nó dele guarda a mensagem na caixa de entrada
+    
+    def __len__(self):
+        return 0
+    
+    def put(self, item) -> bool:
+        if isinstance(item, bytes):
+            return self.peer.send('deliver', item, users=[self.username], store=self.store)
+        # Cada entrega leva frames inteiros: o trecho segue junto com o frame file_data
+        pending = b''
+        for frame in item.frames():
+            if isinstance(frame, FileRegion):
+                pending += frame.frame()
+                continue
+            if pending and not self.peer.send('deliver', pending, users=[self.username], store=False, stream=True):
+                return False
+            pending = frame
+        return not pending or self.peer.send('deliver', pending, users=[self.username], store=False, stream=True)
+    
+    def depth(self) -> int:
+        return 0
+    
+    def stats(self) -> dict:
+        return {'node': self.peer.node}
+
+class RelayedStream:
+    """Frames de um download repassados por outro nó, enfileirados como um único item:
+    nada se intercala entre o file_data e o frame binário do trecho, e a conexão
+    de destino pode comprimir cada frame separadamente"""
+    
+    def __init__(self, data: bytes):
+        self.data = data
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def frames(self):
+        view = memoryview(self.data)
+        position = 0
+        while position < len(view):
+            (length,) = HEADER.unpack_from(view, position)
+            end = position + HEADER_SIZE + length
+            yield bytes(view[position:end])
+            position = end
+
+class ClusterMixin:
+    """Nó de um cluster (combinado com ChatServer ou AsyncChatServer).
+    
+    Cada usuário pertence ao nó indicado pelo anel (quem se conecta ao nó errado
+    recebe um redirecionamento no login) e cada grupo ao nó dono do seu nome, que
+    executa os pedidos do grupo e faz o fan-out com um único frame por nó. Listas
+    globais (usuários, grupos, arquivos) consultam todos os nós.
+    """
+    
+    def __init__(self, *args, node: str, cluster: Dict[str, Tuple[str, int, int]], **options):
+        self.node = node
+        self.cluster = cluster
+        self.ring = HashRing(cluster)
+        self.peers = {name: PeerClient(node, name, host, peer_port)
+                      for name, (host, _, peer_port) in cluster.items() if name != node}
+        self.peer_pool = ThreadPoolExecutor(max_workers=PEER_THREADS)
+        super().__init__(*args, **options)
+    
+    def start_server(self):
+        """Aceita as conexões dos outros nós e inicia o servidor de clientes"""
+        host, _, peer_port = self.cluster[self.node]
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, peer_port))
+        listener.listen(len(self.cluster))
+        accept_thread = threading.Thread(target=self.accept_peers, args=(listener,))
+        accept_thread.daemon = True
+        accept_thread.start()
+        print(f"[SERVIDOR] Nó {self.node} do cluster ({len(self.cluster)} nós), porta do cluster {peer_port}")
+        super().start_server()
+    
+    def close(self):
+        for peer in self.peers.values():
+            peer.close()
+        self.peer_pool.shutdown(wait=False)
+        super().close()
+    
+    def owner(self, key: str) -> str:
+        return self.ring.owner(key)
+    
+    # Conexões vindas de outros nós
+    
+    def accept_peers(self, listener: socket.socket):
+        while True:
+            sock, _ = listener.accept()
+            peer_thread = threading.Thread(target=self.handle_peer, args=(BusLink(sock),))
+            peer_thread.daemon = True
+            peer_thread.start()
+    
+    def handle_peer(self, link: BusLink):
+        """Atende um nó: consultas e entregas na ordem de chegada, pedidos de clientes no pool"""
+        node = None
+        for message, raw in link.messages():
+            op = message['op']
+            if op == 'hello':
+                node = message['node']
+                print(f"[SERVIDOR] Nó {node} conectado ao cluster")
+            elif op == 'deliver':
+                for username in message['users']:
+                    self.deliver_local(username, raw, message['store'], message.get('stream', False))
+            elif op in ('request', 'fetch'):
+                # Podem consultar outros nós: não seguram a leitura desta conexão
+                self.peer_pool.submit(self.run_peer_request, link, message, node)
+            else:
+                self.reply(link, message, self.handle_peer_query(message))
+        if node:
+            print(f"[SERVIDOR] Nó {node} desconectado do cluster")
+    
+    def reply(self, link: BusLink, message: dict, result: dict):
+        if 'rid' in message:
+            link.send(dict(result, op='reply', rid=message['rid']))
+    
+    def run_peer_request(self, link: BusLink, message: dict, node: Optional[str]):
+        try:
+            if message['op'] == 'fetch':
+                self.serve_remote_fetch(message)
+                return
+            # O usuário autenticado no nó de origem (os handlers que verificam acesso usam a conexão)
+            connection = PeerQueue(self.peers[node], message['user']) \
+                if node in self.peers and message.get('user') else None
+            # Sem process_message do cluster: o pedido já está no nó dono
+            response = super().process_message(message['message'], connection)
+        except Exception as e:
+            print(f"[SERVIDOR] Erro em pedido de outro nó: {e}")
+            response = {'type': 'error', 'message': 'Erro no servidor'}
+        self.reply(link, message, {'response': response})
+    
+    def handle_peer_query(self, message: dict) -> dict:
+        """Consultas rápidas (não consultam outros nós)"""
+        op = message['op']
+        if op == 'online':
+            return {'result': message['user'] in self.clients}
+        if op == 'members':
+            members = super().group_members(message['group'])
+            return {'members': sorted(members) if members is not None else None}
+        if op == 'user_groups':
+            with self.user_groups.lock(message['user']):
+                return {'groups': sorted(self.user_groups.get(message['user'], ()))}
+        if op == 'groups':
+            return {'groups': self.groups.keys()}
+        if op == 'users':
+            return {'users': self.clients.keys()}
+        if op == 'files':
+            return {'files': self.files_for(message['user'], set(message['groups']))}
+        if op == 'has_file':
+            return {'result': self.store.get(message['file_id']) is not None}
+        return {}
+    
+    def deliver_local(self, username: str, frame: bytes, store: bool, stream: bool = False):
+        """Entrega um frame repassado por outro nó; offline, guarda se for uma mensagem.
+        Trechos de um download (stream) vão como chegaram, sem recodificar"""
+        with self.clients.lock(username):
+            connection = self.clients.get(username)
+            if connection is not None and connection.put(RelayedStream(frame) if stream
+                                                         else recode_frame(frame, connection.codec)):
+                return
+            if store:
+                self.inbox.put(username, decode_message(memoryview(frame)[HEADER_SIZE:]))
+    
+    # Pedidos de clientes conectados a este nó
+    
+    def gather(self, op: str, **fields) -> List[dict]:
+        """Consulta todos os outros nós em paralelo (nós indisponíveis ficam de fora)"""
+        pending = [(peer, peer.start_call(op, **fields)) for peer in self.peers.values()]
+        replies = [peer.wait_reply(request_id) for peer, request_id in pending]
+        return [reply for reply in replies if reply is not None]
+    
+    def forward(self, node: str, message: dict, connection=None) -> dict:
+        """Executa o pedido do cliente no nó dono e devolve a resposta dele"""
+        reply = self.peers[node].call('request', message=message,
+                                      user=connection.username if connection is not None else None)
+        if reply is None:
+            return {
+                'type': RESPONSE_TYPES.get(message.get('type'), 'error'),
+                'status': 'error',
+                'message': f'Servidor {node} indisponível, tente novamente'
+            }
+        return reply['response']
+    
+    def may_block(self, message: dict) -> bool:
+        # Repasses, consultas a todos os nós e entregas remotas esperam a rede (até CALL_TIMEOUT)
+        return message.get('type') not in LOCAL_REQUESTS
+    
+    def process_message(self, message: dict, sender_socket) -> dict:
+        msg_type = message.get('type')
+        group_name = (message.get('group_name') or '').strip()
+        if group_name and (msg_type in GROUP_REQUESTS or msg_type == 'history'):
+            node = self.owner(group_name)
+            if node != self.node:
+                return self.forward(node, message, sender_socket)
+        return super().process_message(message, sender_socket)
+    
+    def handle_login(self, message: dict) -> dict:
+        username = message.get('username', '').strip()
+        node = self.owner(username) if username else self.node
+        if node != self.node:
+            host, port, _ = self.cluster[node]
+            return {
+                'type': 'login_response',
+                'status': 'error',
+                'message': f'Usuário atendido pelo servidor {node} ({host}:{port})',
+                'redirect': {'host': host, 'port': port}
+            }
+        return super().handle_login(message)
+    
+    def handle_private_message(self, message: dict) -> dict:
+        recipient = message.get('recipient')
+        node = self.owner(recipient) if recipient else self.node
+        if node == self.node:
+            return super().handle_private_message(message)
+        
+        # O nó do destinatário entrega (ou guarda); cada nó tem a sua cópia do histórico
+        response = self.forward(node, message)
+        if response.get('status') == 'success':
+            self.history.append(private_conversation(message['sender'], recipient), {
+                'type': 'private_message_received',
+                'sender': message['sender'],
+                'content': message['content'],
+                'timestamp': datetime.now().strftime("%H:%M:%S")
+            })
+        return response
+    
+    def fan_out(self, members: Iterable[str], notification: dict, sender: str = None) -> Tuple[int, int]:
+        # Membros de outros nós: um único frame por nó, com a lista de destinatários
+        by_node: Dict[str, List[str]] = {}
+        for member in members:
+            if member != sender:
+                by_node.setdefault(self.owner(member), []).append(member)
+        delivered_count, stored_count = super().fan_out(by_node.pop(self.node, ()), notification)
+        if by_node:
+            frame = encode_message(notification)
+            for node, users in by_node.items():
+                if self.peers[node].send('deliver', frame, users=users, store=True):
+                    delivered_count += len(users)
+        return delivered_count, stored_count
+    
+    def lookup_connection(self, username: str):
+        node = self.owner(username)
+        if node == self.node:
+            return super().lookup_connection(username)
+        reply = self.peers[node].call('online', user=username)
+        return PeerQueue(self.peers[node], username) if reply and reply['result'] else None
+    
+    def member_queues(self, members: Set[str], sender: str):
+        local = {member for member in members if self.owner(member) == self.node}
+        queues = super().member_queues(local, sender)
+        queues.extend(PeerQueue(self.peers[self.owner(member)], member)
+                      for member in members - local if member != sender)
+        return queues
+    
+    def broadcast(self, connections, message: dict) -> int:
+        # Filas de outros nós: um único frame por nó
+        frames = {}
+        delivered_count = 0
+        by_node: Dict[str, List[PeerQueue]] = {}
+        for connection in connections:
+            if isinstance(connection, PeerQueue):
+                by_node.setdefault(connection.peer.node, []).append(connection)
+            elif connection.put(encode_cached(message, connection.codec, frames)):
+                delivered_count += 1
+        for node, queues in by_node.items():
+            frame = encode_cached(message, CODEC_JSON, frames)
+            if self.peers[node].send('deliver', frame, users=[queue.username for queue in queues],
+                                     store=queues[0].store):
+                delivered_count += len(queues)
+        return delivered_count
+    
+    def group_members(self, group_name: str) -> Optional[FrozenSet[str]]:
+        node = self.owner(group_name)
+        if node == self.node:
+            return super().group_members(group_name)
+        reply = self.peers[node].call('members', group=group_name)
+        if not reply or reply['members'] is None:
+            return None
+        return frozenset(reply['members'])
+    
+    def handle_list_users(self) -> dict:
+        users = set(self.clients.keys())
+        for reply in self.gather('users'):
+            users.update(reply['users'])
+        return {
+            'type': 'users_list',
+            'users': sorted(users)
+        }
+    
+    def user_group_names(self, username: str) -> Set[str]:
+        """Grupos do usuário em todos os nós"""
+        with self.user_groups.lock(username):
+            groups = set(self.user_groups.get(username, ()))
+        for reply in self.gather('user_groups', user=username):
+            groups.update(reply['groups'])
+        return groups
+    
+    def handle_list_groups(self, message: dict) -> dict:
+        username = message.get('username')
+        if username:
+            groups = self.user_group_names(username)
+        else:
+            groups = set(self.groups.keys())
+            for reply in self.gather('groups'):
+                groups.update(reply['groups'])
+        return {
+            'type': 'groups_list',
+            'groups': sorted(groups)
+        }
+    
+    def handle_list_files(self, message: dict, connection) -> dict:
+        requester = connection.username if connection is not None else None
+        if requester is None:
+            return {
+                'type': 'files_list',
+                'status': 'error',
+                'message': 'Faça login para listar os arquivos'
+            }
+        groups = self.user_group_names(requester)
+        files = self.files_for(requester, groups)
+        # O usuário vai pela conexão entre os nós, tirado da conexão autenticada dele
+        for reply in self.gather('files', user=requester, groups=sorted(groups)):
+            files.extend(reply['files'])
+        return {
+            'type': 'files_list',
+            'files': files
+        }
+    
+    def handle_fetch_file(self, message: dict, connection) -> Optional[dict]:
+        file_id = message.get('file_id')
+        if not file_id or self.store.get(file_id) is not None:
+            return super().handle_fetch_file(message, connection)
+        
+        # Arquivo guardado em outro nó (o de quem o enviou): ele envia direto para cá
+        for node, peer in self.peers.items():
+            reply = peer.call('has_file', file_id=file_id)
+            if reply and reply['result']:
+                peer.send('fetch', message=message, user=connection.username, node=self.node)
+                return None
+        return super().handle_fetch_file(message, connection)
+    
+    def serve_remote_fetch(self, message: dict):
+        """Envia um arquivo deste nó a um usuário de outro nó, pela conexão com ele"""
+        request = message['message']
+        # O usuário vem do nó dele (o da conexão autenticada), não do pedido do cliente
+        queue = PeerQueue(self.peers[message['node']], message['user'])
+        response = super().handle_fetch_file(request, queue)
+        if response is not None:
+            queue.put(encode_message(response))
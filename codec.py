@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Codec binário do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Alternativa compacta ao JSON no formato do MessagePack: valores com tags de tipo
+de um byte, tipos de mensagem e nomes de campo conhecidos trocados por códigos
+inteiros e bytes crus (sem base64) nos campos binários
+"""
+
+import struct
+
+# Tipos de mensagem com código de um byte (o código é a posição: só acrescente no final)
+MESSAGE_TYPES = (
+    'login', 'login_response', 'private_message', 'private_message_received',
+    'create_group', 'group_response', 'group_message', 'group_message_received',
+    'message_response', 'add_member', 'member_response', 'added_to_group',
+    'list_users', 'users_list', 'list_groups', 'groups_list',
+    'list_group_members', 'members_list_response', 'file_begin', 'upload_offset',
+    'file_chunk', 'file_end', 'file_response', 'file_received',
+    'group_file_received', 'fetch_file', 'file_data', 'file_complete',
+    'list_files', 'files_list', 'history', 'offline_messages',
+    'queue_stats', 'error', 'ping', 'pong'
+)
+
+# Nomes de campo com código de um byte (idem)
+FIELDS = (
+    'type', 'status', 'message', 'sender', 'recipient', 'content', 'timestamp', 'id',
+    'group_name', 'creator', 'requester', 'new_member', 'added_by', 'username', 'users', 'groups',
+    'members', 'messages', 'transfer_id', 'file_id', 'blob', 'filename', 'size', 'offset',
+    'data', 'files', 'with', 'since', 'limit', 'queues', 'depth', 'bytes',
+    'dropped', 'redirect', 'host', 'port', 'codec', 'codecs', 'compression'
+)
+
+TYPE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES)}
+FIELD_CODES = {name: code for code, name in enumerate(FIELDS)}
+TYPE_FIELD = FIELD_CODES['type']
+
+# Tags de tipo (as mesmas do MessagePack)
+NIL, FALSE, TRUE = 0xC0, 0xC2, 0xC3
+BIN8, BIN16, BIN32 = 0xC4, 0xC5, 0xC6
+FLOAT64 = 0xCB
+UINT8, UINT16, UINT32, UINT64 = 0xCC, 0xCD, 0xCE, 0xCF
+INT8, INT16, INT32, INT64 = 0xD0, 0xD1, 0xD2, 0xD3
+STR8, STR16, STR32 = 0xD9, 0xDA, 0xDB
+ARRAY16, ARRAY32, MAP16, MAP32 = 0xDC, 0xDD, 0xDE, 0xDF
+
+# Tags de tamanho fixo: tag -> formato do valor que vem depois dela
+NUMBERS = {
+    FLOAT64: struct.Struct('!d'),
+    UINT8: struct.Struct('!B'), UINT16: struct.Struct('!H'),
+    UINT32: struct.Struct('!I'), UINT64: struct.Struct('!Q'),
+    INT8: struct.Struct('!b'), INT16: struct.Struct('!h'),
+    INT32: struct.Struct('!i'), INT64: struct.Struct('!q')
+}
+
+# Tags com tamanho explícito: tag -> formato do tamanho
+SIZES = {
+    BIN8: NUMBERS[UINT8], BIN16: NUMBERS[UINT16], BIN32: NUMBERS[UINT32],
+    STR8: NUMBERS[UINT8], STR16: NUMBERS[UINT16], STR32: NUMBERS[UINT32],
+    ARRAY16: NUMBERS[UINT16], ARRAY32: NUMBERS[UINT32],
+    MAP16: NUMBERS[UINT16], MAP32: NUMBERS[UINT32]
+}
+
+def pack(message: dict) -> bytearray:
+    """Serializa uma mensagem no codec binário"""
+    out = bytearray()
+    _pack(message, out)
+    return out
+
+def _pack_size(size: int, out: bytearray, fixed: int, fixed_limit: int, tags):
+    """Cabeçalho de str/bin/array/map: forma curta (tag + tamanho em um byte) ou tag + tamanho"""
+    if size < fixed_limit:
+        out.append(fixed | size)
+        return
+    for tag in tags:
+        if size < 1 << (8 * SIZES[tag].size):
+            out.append(tag)
+            out += SIZES[tag].pack(size)
+            return
+    raise ValueError(f'Valor grande demais para o codec binário ({size})')
+
+def _pack_int(value: int, out: bytearray):
+    if 0 <= value < 0x80:
+        out.append(value)
+    elif -0x20 <= value < 0:
+        out.append(value & 0xFF)
+    else:
+        tags = (UINT8, UINT16, UINT32, UINT64) if value >= 0 else (INT8, INT16, INT32, INT64)
+        for tag in tags:
+            number = NUMBERS[tag]
+            bits = 8 * number.size
+            if (value < 1 << bits) if value >= 0 else (value >= -(1 << (bits - 1))):
+                out.append(tag)
+                out += number.pack(value)
+                return
+        raise ValueError(f'Inteiro fora do alcance do codec binário: {value}')
+
+def _pack(value, out: bytearray):
+    kind = type(value)
+    if kind is str:
+        data = value.encode('utf-8')
+        _pack_size(len(data), out, 0xA0, 32, (STR8, STR16, STR32))
+        out += data
+    elif kind is int:
+        _pack_int(value, out)
+    elif kind is dict:
+        _pack_size(len(value), out, 0x80, 16, (MAP16, MAP32))
+        for key, item in value.items():
+            code = FIELD_CODES.get(key)
+            kind = type(item)
+            if code == TYPE_FIELD:
+                # Só um tipo conhecido vai como código; outro valor leva a chave por extenso
+                if kind is str and item in TYPE_CODES:
+                    out.append(code)
+                    out.append(TYPE_CODES[item])
+                    continue
+                code = None
+            if code is None:
+                _pack(key if type(key) is str else str(key), out)  # como no JSON, chaves viram texto
+            else:
+                out.append(code)
+            
+            # Casos comuns sem chamada de função: texto curto e inteiro pequeno
+            if kind is str:
+                data = item.encode('utf-8')
+                if len(data) < 32:
+                    out.append(0xA0 | len(data))
+                elif len(data) < 0x100:
+                    out.append(STR8)
+                    out.append(len(data))
+                else:
+                    _pack_size(len(data), out, 0xA0, 32, (STR8, STR16, STR32))
+                out += data
+            elif kind is int and 0 <= item < 0x80:
+                out.append(item)
+            else:
+                _pack(item, out)
+    elif kind is list or kind is tuple:
+        _pack_size(len(value), out, 0x90, 16, (ARRAY16, ARRAY32))
+        for item in value:
+            _pack(item, out)
+    elif kind is bytes or kind is bytearray or kind is memoryview:
+        _pack_size(len(value), out, 0, 0, (BIN8, BIN16, BIN32))
+        out += value
+    elif value is None:
+        out.append(NIL)
+    elif kind is bool:
+        out.append(TRUE if value else FALSE)
+    elif kind is float:
+        out.append(FLOAT64)
+        out += NUMBERS[FLOAT64].pack(value)
+    else:
+        raise TypeError(f'Tipo não suportado pelo codec binário: {kind.__name__}')
+
+def unpack(payload) -> dict:
+    """Desserializa uma mensagem do codec binário (bytes ou memoryview)"""
+    data = bytes(payload)
+    try:
+        message, position = _unpack(data, 0)
+    except (IndexError, KeyError, struct.error):
+        raise ValueError('Payload binário inválido')
+    if position != len(data):
+        raise ValueError('Payload binário com bytes sobrando')
+    return message
+
+def _unpack(data: bytes, position: int):
+    """Decodifica o valor que começa em `position`; retorna (valor, posição seguinte)"""
+    tag = data[position]
+    position += 1
+    if tag < 0x80:
+        return tag, position
+    if tag >= 0xE0:
+        return tag - 0x100, position
+    if tag < 0x90:
+        return _unpack_map(data, position, tag & 0x0F)
+    if tag < 0xA0:
+        return _unpack_array(data, position, tag & 0x0F)
+    if tag < 0xC0:
+        return _unpack_bytes(data, position, tag & 0x1F).decode('utf-8'), position + (tag & 0x1F)
+    if tag == NIL:
+        return None, position
+    if tag == FALSE or tag == TRUE:
+        return tag == TRUE, position
+    
+    number = NUMBERS.get(tag)
+    if number is not None:
+        return number.unpack_from(data, position)[0], position + number.size
+    
+    size_format = SIZES[tag]
+    (size,) = size_format.unpack_from(data, position)
+    position += size_format.size
+    if tag == MAP16 or tag == MAP32:
+        return _unpack_map(data, position, size)
+    if tag == ARRAY16 or tag == ARRAY32:
+        return _unpack_array(data, position, size)
+    value = _unpack_bytes(data, position, size)
+    return (value.decode('utf-8') if tag >= STR8 else value), position + size
+
+def _unpack_bytes(data: bytes, position: int, size: int) -> bytes:
+    if position + size > len(data):
+        raise IndexError('Valor além do fim do payload')
+    return data[position:position + size]
+
+def _unpack_array(data: bytes, position: int, count: int):
+    items = []
+    for _ in range(count):
+        item, position = _unpack(data, position)
+        items.append(item)
+    return items, position
+
+def _unpack_map(data: bytes, position: int, count: int):
+    result = {}
+    for _ in range(count):
+        # Casos comuns sem chamada de função: campo com código e texto curto
+        tag = data[position]
+        coded_type = tag == TYPE_FIELD  # o valor é o código do tipo da mensagem
+        if tag < 0x80:
+            key = FIELDS[tag]
+            position += 1
+        else:
+            key, position = _unpack(data, position)
+            if type(key) is not str:
+                raise IndexError('Chave inválida')
+        
+        tag = data[position]
+        if coded_type:
+            value = MESSAGE_TYPES[tag]
+            position += 1
+        elif tag < 0x80:
+            value = tag
+            position += 1
+        elif 0xA0 <= tag < 0xC0 or tag == STR8:
+            if tag == STR8:
+                start = position + 2
+                end = start + data[position + 1]
+            else:
+                start = position + 1
+                end = start + (tag & 0x1F)
+            if end > len(data):
+                raise IndexError('Valor além do fim do payload')
+            value = data[start:end].decode('utf-8')
+            position = end
+        else:
+            value, position = _unpack(data, position)
+        result[key] = value
+    return result, position
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Despacho de mensagens do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Tabela tipo de mensagem -> handler, preenchida pelo decorador @handles nos
+métodos do servidor, com o esquema (campos obrigatórios) de cada tipo
+verificado antes do handler. Respostas constantes (como os erros de
+validação) são serializadas uma única vez por codec
+"""
+
+from typing import Dict, Iterable, Optional, Tuple
+
+from protocol import CODECS, encode_message
+
+class Schema:
+    """Campos obrigatórios de um tipo de mensagem: texto não vazio (`trimmed`:
+    não vazio depois de strip). Na falha devolve a resposta de erro pré-serializada.
+    
+    `check` é gerado para o esquema, com um teste por campo e sem laço: ele roda
+    em toda mensagem válida, e assim custa menos que a validação que cada handler
+    fazia antes (`python benchmark.py dispatch`)"""
+    
+    __slots__ = ('required', 'trimmed', 'error', 'check')
+    
+    def __init__(self, required: Iterable[str], trimmed: Iterable[str], error: dict):
+        self.trimmed = tuple(trimmed)
+        self.required = tuple(name for name in required if name not in self.trimmed)
+        self.error = error
+        self.check = self._compile()
+    
+    def _compile(self):
+        """check(message): resposta de erro se falta algum campo (None se a mensagem é válida)"""
+        lines = ['def check(message):', '    try:']
+        for name in self.required + self.trimmed:
+            test = 'value' if name in self.required else 'value.strip()'
+            lines += [f'        value = message[{name!r}]',
+                      f'        if type(value) is not str or not {test}:',
+                      '            return error']
+        lines += ['    except KeyError:', '        return error', '    return None']
+        namespace = {'error': self.error}
+        exec('\n'.join(lines), namespace)  # os nomes vêm dos decoradores, nunca de uma mensagem
+        return namespace['check']
+
+class Route:
+    """Handler registrado para um tipo de mensagem (pelo nome do método, para
+    que as subclasses do servidor possam sobrescrevê-lo)"""
+    
+    __slots__ = ('method', 'schema', 'arguments')
+    
+    def __init__(self, method: str, schema: Optional[Schema], arguments: int):
+        self.method = method
+        self.schema = schema
+        self.arguments = arguments  # 0: handler(); 1: handler(message); 2: handler(message, conexão)
+
+# Tipo de mensagem -> rota (preenchida na importação de server.py)
+ROUTES: Dict[str, Route] = {}
+
+# id da resposta constante -> (resposta, frame de cada codec); a resposta fica
+# referenciada aqui, então o id não é reaproveitado por outro objeto
+_ENCODED: Dict[int, Tuple[dict, Dict[str, bytes]]] = {}
+_ERRORS: Dict[Tuple[str, str], dict] = {}
+
+def constant(response: dict) -> dict:
+    """Registra uma resposta que nunca muda: os frames são gerados aqui, uma vez.
+    A resposta não pode ser alterada depois"""
+    _ENCODED[id(response)] = (response, {codec_name: encode_message(response, codec_name)
+                                         for codec_name in CODECS})
+    return response
+
+def error(response_type: str, text: str) -> dict:
+    """Resposta de erro constante (criada e serializada no primeiro uso). Só para
+    textos fixos: mensagens com nomes ou valores continuam sendo dicts comuns"""
+    response = _ERRORS.get((response_type, text))
+    if response is None:
+        response = _ERRORS[(response_type, text)] = constant({
+            'type': response_type,
+            'status': 'error',
+            'message': text
+        })
+    return response
+
+def encode_response(response: dict, codec_name: str) -> bytes:
+    """Frame da resposta: o pré-serializado se ela é constante"""
+    encoded = _ENCODED.get(id(response))
+    if encoded is not None and encoded[0] is response:
+        return encoded[1][codec_name]
+    return encode_message(response, codec_name)
+
+def handles(msg_type: str, *required: str, trimmed: Iterable[str] = (), response: str = None,
+            message: str = 'Dados incompletos'):
+    """Decorador: registra o método como handler de `msg_type`. Os campos em
+    `required` (e em `trimmed`) são verificados antes da chamada; se faltar
+    algum, o cliente recebe o erro `message` com o tipo `response`"""
+    def decorator(function):
+        trimmed_fields = tuple(trimmed)
+        schema = None
+        if required or trimmed_fields:
+            schema = Schema(required + trimmed_fields, trimmed_fields, error(response or 'error', message))
+        ROUTES[msg_type] = Route(function.__name__, schema, function.__code__.co_argcount - 1)
+        return function
+    return decorator
+
+def bind(server) -> Dict[str, Tuple]:
+    """Tabela do servidor: tipo -> (método ligado, verificação do esquema ou None,
+    argumentos). Usa os métodos da instância, então as sobrescritas de workers.py
+    e cluster.py valem"""
+    table = {}
+    for msg_type, route in ROUTES.items():
+        method = getattr(server, route.method, None)
+        if method is not None:
+            table[msg_type] = (method, route.schema.check if route.schema else None, route.arguments)
+    return table
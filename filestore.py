@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Armazenamento de arquivos do servidor do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Blobs endereçados pelo conteúdo (SHA-256): uploads idênticos são guardados uma única vez
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Set
+
+try:
+    import fcntl  # indisponível no Windows (usado só no modo multiprocesso)
+except ImportError:
+    fcntl = None
+
+# Operações acumuladas no log do índice antes de ele ser compactado em index.json
+COMPACT_EVERY = 1000
+
+def audience(entry: dict) -> str:
+    """Quem recebe o arquivo: o grupo ou, num envio privado, o destinatário"""
+    if entry.get('group_name'):
+        return 'group:' + entry['group_name']
+    return 'user:' + str(entry.get('recipient'))
+
+class BlobStore:
+    """Repositório de blobs com índice file_id -> blob e contagem de referências.
+    
+    Layout em disco:
+        blobs/ab/abcdef...   conteúdo do arquivo, nomeado pelo hash
+        tmp/                 uploads em andamento
+        index.json           file_id -> metadados (blob, nome, remetente, ...)
+        index.log            alterações posteriores ao index.json, uma por linha
+        index.lock           trava entre processos (só com shared=True)
+    
+    Cada envio ou remoção só acrescenta uma linha ao log; quando o log cresce, o
+    índice inteiro é regravado em index.json e o log esvaziado (compactação).
+    Um arquivo só deixa o índice quando expira (retention): sem retenção os envios
+    ficam para sempre e a coleta de lixo apaga apenas blobs órfãos.
+    
+    Com shared=True vários processos usam o mesmo repositório: cada operação trava
+    index.lock, aplica as linhas que outro processo acrescentou ao log e relê o
+    índice se outro processo o compactou.
+    """
+    
+    def __init__(self, root: str, retention: Optional[float] = None, shared: bool = False):
+        self.root = root
+        self.retention = retention  # segundos até um arquivo expirar (None = para sempre)
+        self.shared = shared
+        self.blobs_dir = os.path.join(root, 'blobs')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.index_path = os.path.join(root, 'index.json')
+        self.log_path = os.path.join(root, 'index.log')
+        self.lock = threading.Lock()
+        self._index_stamp = None  # (inode, mtime, tamanho) do índice carregado
+        self._log_offset = 0  # bytes do log já aplicados ao índice
+        self._log_ops = 0  # operações no log desde a última compactação
+        
+        for directory in (self.blobs_dir, self.tmp_dir):
+            if not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+        
+        self._load_index()
+    
+    def _stamp(self):
+        try:
+            stat = os.stat(self.index_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def _load_index(self):
+        self._index_stamp = self._stamp()
+        self.index: Dict[str, dict] = {}
+        self.refs = Counter()
+        self.received: Dict[str, Set[str]] = {}  # audience -> file_ids (evita varrer o índice)
+        if self._index_stamp is not None:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for file_id, entry in json.load(f).items():
+                    self._apply(file_id, entry)
+        self._log_offset = 0
+        self._log_ops = 0
+        self._replay()
+    
+    def _replay(self):
+        """Aplica ao índice as linhas do log ainda não lidas"""
+        try:
+            with open(self.log_path, 'rb') as f:
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Uma linha sem '\n' no fim é uma escrita interrompida: fica de fora
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            self._apply(record['id'], record['entry'])
+            self._log_ops += 1
+        self._log_offset += end
+    
+    def _apply(self, file_id: str, entry: Optional[dict]):
+        """Grava (ou remove, com entry=None) um arquivo no índice em memória"""
+        old = self.index.pop(file_id, None)
+        if old is not None:
+            self.refs[old['blob']] -= 1
+            if self.refs[old['blob']] <= 0:
+                del self.refs[old['blob']]
+            file_ids = self.received[audience(old)]
+            file_ids.discard(file_id)
+            if not file_ids:
+                del self.received[audience(old)]
+        if entry is not None:
+            self.index[file_id] = entry
+            self.refs[entry['blob']] += 1
+            self.received.setdefault(audience(entry), set()).add(file_id)
+    
+    @contextmanager
+    def _locked(self):
+        """Lock do índice; compartilhado, também trava o arquivo e relê o índice se ele mudou"""
+        with self.lock:
+            if not self.shared:
+                yield
+                return
+            with open(os.path.join(self.root, 'index.lock'), 'ab') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if self._stamp() != self._index_stamp:
+                    self._load_index()
+                else:
+                    self._replay()
+                yield
+    
+    def _log(self, file_id: str, entry: Optional[dict] = None):
+        """Registra a alteração de um arquivo no log e no índice em memória"""
+        line = json.dumps({'id': file_id, 'entry': entry}).encode('utf-8') + b'\n'
+        with open(self.log_path, 'ab') as f:
+            if f.tell() != self._log_offset:
+                # Restos de uma escrita interrompida: descarta antes de acrescentar
+                f.truncate(self._log_offset)
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_offset += len(line)
+        self._log_ops += 1
+        self._apply(file_id, entry)
+        
+        # Compacta só quando o log passa do tamanho do índice: custo amortizado constante
+        if self._log_ops >= max(COMPACT_EVERY, len(self.index)):
+            self._compact()
+    
+    def _compact(self):
+        """Grava o índice inteiro em index.json e esvazia o log"""
+        # Escrita atômica: arquivo temporário + rename. Se cair antes de esvaziar o
+        # log, as linhas são reaplicadas sobre o índice novo sem efeito
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        with open(self.log_path, 'wb'):
+            pass
+        self._index_stamp = self._stamp()
+        self._log_offset = 0
+        self._log_ops = 0
+    
+    def blob_path(self, blob: str) -> str:
+        """Caminho do blob no disco"""
+        return os.path.join(self.blobs_dir, blob[:2], blob)
+    
+    def temp_path(self, name: str) -> str:
+        """Caminho para um upload em andamento"""
+        return os.path.join(self.tmp_dir, os.path.basename(name) + '.part')
+    
+    def add(self, temp_path: str, blob: str, size: int, **metadata) -> str:
+        """Move um upload concluído para o repositório e retorna o novo file_id.
+        Se o conteúdo já existe, o upload é descartado e o blob reaproveitado"""
+        path = self.blob_path(blob)
+        file_id = uuid.uuid4().hex
+        
+        with self._locked():
+            if os.path.exists(path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+            
+            self._log(file_id, dict(metadata, blob=blob, size=size, created=time.time()))
+        return file_id
+    
+    def get(self, file_id: str) -> Optional[dict]:
+        """Metadados de um arquivo (ou None)"""
+        with self._locked():
+            entry = self.index.get(file_id)
+            return dict(entry) if entry else None
+    
+    def entries(self) -> Dict[str, dict]:
+        """Cópia do índice (file_id -> metadados)"""
+        with self._locked():
+            return {file_id: dict(entry) for file_id, entry in self.index.items()}
+    
+    def files_for(self, user: str, groups: Iterable[str]) -> Dict[str, dict]:
+        """Arquivos enviados ao usuário ou a um dos grupos (file_id -> metadados)"""
+        with self._locked():
+            keys = ['user:' + str(user)] + ['group:' + group for group in groups]
+            return {file_id: dict(self.index[file_id])
+                    for key in keys for file_id in self.received.get(key, ())}
+    
+    def release(self, file_id: str) -> bool:
+        """Remove a referência de um arquivo; o blob vira lixo quando ninguém mais o usa"""
+        with self._locked():
+            if file_id not in self.index:
+                return False
+            self._log(file_id)
+            return True
+    
+    def gc(self) -> int:
+        """Expira arquivos antigos e apaga blobs sem referência. Retorna quantos blobs foram apagados"""
+        if self.retention is not None:
+            limit = time.time() - self.retention
+            with self._locked():
+                expired = [file_id for file_id, entry in self.index.items() if entry['created'] < limit]
+            for file_id in expired:
+                self.release(file_id)
+        
+        removed = 0
+        for prefix in os.listdir(self.blobs_dir):
+            prefix_dir = os.path.join(self.blobs_dir, prefix)
+            for blob in os.listdir(prefix_dir):
+                with self._locked():
+                    if self.refs.get(blob):
+                        continue
+                    try:
+                        os.remove(os.path.join(prefix_dir, blob))
+                        removed += 1
+                    except OSError:
+                        pass
+        return removed
+    
+    def stats(self) -> dict:
+        """Números do repositório (arquivos, blobs e bytes únicos)"""
+        with self._locked():
+            unique = {entry['blob']: entry['size'] for entry in self.index.values()}
+            return {
+                'files': len(self.index),
+                'blobs': len(unique),
+                'bytes': sum(unique.values())
+            }
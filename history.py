@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Histórico de mensagens do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Cada conversa (privada ou de grupo) tem um log append-only em segmentos, com um
+índice esparso id -> offset para atender pedidos de histórico sem varrer o log
+"""
+
+import os
+import json
+import mmap
+import hashlib
+import struct
+import threading
+from bisect import bisect_right
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+try:
+    import fcntl  # indisponível no Windows (usado só no modo multiprocesso)
+except ImportError:
+    fcntl = None
+
+# Tamanho a partir do qual um novo segmento é iniciado
+SEGMENT_SIZE = 1024 * 1024
+
+# Segmentos mantidos por conversa; os mais antigos são apagados na virada
+MAX_SEGMENTS = 8
+
+# Uma entrada no índice a cada tantas mensagens
+INDEX_INTERVAL = 64
+
+# Entrada do índice: id da mensagem e offset da linha no segmento
+INDEX_ENTRY = struct.Struct('!QQ')
+
+# Conversas mantidas em memória; além disso as usadas há mais tempo são descartadas (LRU)
+MAX_OPEN_LOGS = 1024
+
+def private_conversation(user_a: str, user_b: str) -> str:
+    """Chave da conversa privada entre dois usuários (a mesma nos dois sentidos)"""
+    return 'private:' + json.dumps(sorted((user_a, user_b)))
+
+def group_conversation(group_name: str) -> str:
+    """Chave da conversa de um grupo"""
+    return 'group:' + group_name
+
+class ConversationLog:
+    """Log de uma conversa.
+    
+    Layout em disco (o nome de cada segmento é o id da sua primeira mensagem):
+        00000000000000000001.log   uma mensagem JSON por linha, ids consecutivos
+        00000000000000000001.idx   entradas (id, offset) a cada INDEX_INTERVAL mensagens
+        lock                       trava entre processos (só com shared=True)
+    
+    Com shared=True vários processos gravam na mesma conversa: cada operação trava
+    o arquivo `lock` e, se outro processo gravou desde a última vez, relê o final do log.
+    """
+    
+    def __init__(self, directory: str, segment_size: int = SEGMENT_SIZE, max_segments: int = MAX_SEGMENTS,
+                 shared: bool = False):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.segments: List[int] = []  # id da primeira mensagem de cada segmento, em ordem
+        self.next_id = 1
+        self._size = 0  # bytes do segmento atual
+        
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(int(name[:-len('.log')]) for name in os.listdir(directory) if name.endswith('.log'))
+        if self.segments:
+            self._recover()
+    
+    @contextmanager
+    def _locked(self):
+        """Lock da conversa; compartilhado, também trava o arquivo e atualiza o estado do disco"""
+        with self.lock:
+            if not self.shared:
+                yield
+                return
+            with open(os.path.join(self.directory, 'lock'), 'ab') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._refresh()
+                yield
+    
+    def _refresh(self):
+        """Relê segmentos e próximo id se outro processo gravou na conversa"""
+        if self.segments:
+            log_path, _ = self._paths(self.segments[-1])
+            try:
+                if os.path.getsize(log_path) == self._size and not os.path.exists(self._paths(self.next_id)[0]):
+                    return
+            except OSError:
+                pass  # segmento apagado na virada de outro processo
+        self.segments = sorted(int(name[:-len('.log')]) for name in os.listdir(self.directory) if name.endswith('.log'))
+        self.next_id, self._size = 1, 0
+        if self.segments:
+            self._recover()
+    
+    def _paths(self, first_id: int):
+        base = os.path.join(self.directory, f'{first_id:020d}')
+        return base + '.log', base + '.idx'
+    
+    def _recover(self):
+        """Descobre o próximo id a partir do último segmento (descartando uma linha incompleta)"""
+        first_id = self.segments[-1]
+        log_path, idx_path = self._paths(first_id)
+        size = os.path.getsize(log_path)
+        
+        # Entradas do índice que apontam além do fim do segmento se perderam na queda
+        with open(idx_path, 'ab+') as f:
+            f.seek(0)
+            data = f.read()
+            entries = [INDEX_ENTRY.unpack_from(data, position)
+                       for position in range(0, len(data) - len(data) % INDEX_ENTRY.size, INDEX_ENTRY.size)]
+            entries = [entry for entry in entries if entry[1] < size]
+            f.truncate(len(entries) * INDEX_ENTRY.size)
+        
+        next_id, offset = entries[-1] if entries else (first_id, 0)
+        with open(log_path, 'r+b') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                next_id = json.loads(line)['id'] + 1
+            f.truncate(offset)
+        self.next_id = next_id
+        self._size = offset
+    
+    def append(self, record: dict) -> int:
+        """Acrescenta uma mensagem e retorna o seu id"""
+        with self._locked():
+            if not self.segments or self._size >= self.segment_size:
+                self._roll()
+            
+            message_id = self.next_id
+            line = json.dumps(dict(record, id=message_id)).encode('utf-8') + b'\n'
+            log_path, idx_path = self._paths(self.segments[-1])
+            if (message_id - self.segments[-1]) % INDEX_INTERVAL == 0:
+                with open(idx_path, 'ab') as f:
+                    f.write(INDEX_ENTRY.pack(message_id, self._size))
+            with open(log_path, 'ab') as f:
+                f.write(line)
+            
+            self._size += len(line)
+            self.next_id += 1
+            return message_id
+    
+    def _roll(self):
+        """Inicia um novo segmento e apaga os mais antigos além do limite"""
+        self.segments.append(self.next_id)
+        self._size = 0
+        for path in self._paths(self.next_id):
+            open(path, 'ab').close()
+        
+        while len(self.segments) > self.max_segments:
+            for path in self._paths(self.segments.pop(0)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    
+    def read(self, since: Optional[int] = None, limit: int = 50) -> List[dict]:
+        """Mensagens com id maior que `since` ou, sem `since`, as `limit` mais recentes"""
+        with self._locked():
+            segments = list(self.segments)
+            next_id = self.next_id
+            last_size = self._size
+        if not segments:
+            return []
+        
+        start = max(next_id - limit, 1) if since is None else since + 1
+        start = max(start, segments[0])
+        count = min(limit, next_id - start)
+        messages = []
+        for position in range(max(bisect_right(segments, start) - 1, 0), len(segments)):
+            if len(messages) >= count:
+                break
+            first_id = segments[position]
+            size = last_size if first_id == segments[-1] else None
+            try:
+                messages.extend(self._read_segment(first_id, start, count - len(messages), size))
+            except (OSError, ValueError):
+                continue  # segmento apagado na virada enquanto era lido
+        return messages
+    
+    def _seek(self, first_id: int, message_id: int):
+        """Última entrada (id, offset) do índice com id <= message_id (busca binária no mmap)"""
+        _, idx_path = self._paths(first_id)
+        with open(idx_path, 'rb') as f:
+            entries = os.fstat(f.fileno()).st_size // INDEX_ENTRY.size
+            if not entries:
+                return first_id, 0
+            with mmap.mmap(f.fileno(), entries * INDEX_ENTRY.size, access=mmap.ACCESS_READ) as index:
+                low, high = 0, entries
+                while low < high:
+                    middle = (low + high) // 2
+                    if INDEX_ENTRY.unpack_from(index, middle * INDEX_ENTRY.size)[0] <= message_id:
+                        low = middle + 1
+                    else:
+                        high = middle
+                if not low:
+                    return first_id, 0
+                return INDEX_ENTRY.unpack_from(index, (low - 1) * INDEX_ENTRY.size)
+    
+    def _read_segment(self, first_id: int, start: int, count: int, size: Optional[int]) -> List[dict]:
+        log_path, _ = self._paths(first_id)
+        message_id, offset = self._seek(first_id, start)
+        messages = []
+        with open(log_path, 'rb') as f:
+            size = size if size is not None else os.fstat(f.fileno()).st_size
+            if not size:
+                return messages
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as segment:
+                # Os ids são consecutivos: as linhas antes de `start` são puladas sem decodificar
+                while message_id < start and offset < size:
+                    offset = segment.find(b'\n', offset, size) + 1 or size
+                    message_id += 1
+                while offset < size and len(messages) < count:
+                    end = segment.find(b'\n', offset, size)
+                    if end < 0:
+                        break
+                    messages.append(json.loads(segment[offset:end]))
+                    offset = end + 1
+        return messages
+
+class HistoryStore:
+    """Históricos de todas as conversas em <root>/history/<hash da chave da conversa>/
+    
+    Só as `max_logs` conversas usadas mais recentemente ficam em memória. Uma conversa
+    descartada é reaberta do disco no próximo uso; uma em uso nunca é descartada
+    (duas instâncias do mesmo log gravando ao mesmo tempo repetiriam ids).
+    """
+    
+    def __init__(self, root: str, segment_size: int = SEGMENT_SIZE, max_segments: int = MAX_SEGMENTS,
+                 shared: bool = False, max_logs: int = MAX_OPEN_LOGS):
+        self.directory = os.path.join(root, 'history')
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.shared = shared
+        self.max_logs = max_logs
+        self.lock = threading.Lock()
+        self.logs: Dict[str, ConversationLog] = OrderedDict()  # da usada há mais tempo à mais recente
+        self.busy = Counter()  # conversa -> operações em andamento
+        
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+    
+    @contextmanager
+    def _log(self, conversation: str, create: bool):
+        """Log da conversa (ou None), protegido do descarte enquanto é usado"""
+        with self.lock:
+            log = self.logs.get(conversation)
+            if log is not None:
+                self.logs.move_to_end(conversation)
+            else:
+                directory = os.path.join(self.directory, hashlib.sha1(conversation.encode('utf-8')).hexdigest())
+                if create or os.path.exists(directory):
+                    log = self.logs[conversation] = ConversationLog(directory, self.segment_size,
+                                                                    self.max_segments, self.shared)
+                    self._evict()
+            if log is not None:
+                self.busy[conversation] += 1
+        if log is None:
+            yield None
+            return
+        try:
+            yield log
+        finally:
+            with self.lock:
+                self.busy[conversation] -= 1
+                if not self.busy[conversation]:
+                    del self.busy[conversation]
+    
+    def _evict(self):
+        """Descarta as conversas ociosas usadas há mais tempo além de max_logs"""
+        excess = len(self.logs) - self.max_logs
+        if excess <= 0:
+            return
+        idle = []
+        for conversation in self.logs:
+            if len(idle) >= excess:
+                break
+            if not self.busy[conversation]:
+                idle.append(conversation)
+        for conversation in idle:
+            del self.logs[conversation]
+    
+    def append(self, conversation: str, record: dict) -> int:
+        """Grava uma mensagem no histórico da conversa e retorna o seu id"""
+        with self._log(conversation, create=True) as log:
+            return log.append(record)
+    
+    def read(self, conversation: str, since: Optional[int] = None, limit: int = 50) -> List[dict]:
+        """Mensagens da conversa (ver ConversationLog.read)"""
+        with self._log(conversation, create=False) as log:
+            return log.read(since, limit) if log else []
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Caixas de entrada offline do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Mensagens para usuários desconectados ficam guardadas no disco (com as mais
+recentes também em memória) e são entregues em lotes quando o usuário entra
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from typing import Dict, Iterator, List, Set
+
+# Limites padrão de cada caixa de entrada
+DEFAULT_MAX_MESSAGES = 1000
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+# Mensagens mais recentes de cada caixa mantidas em memória
+TAIL_SIZE = 64
+
+# Mensagens por frame na entrega ao fazer login
+BATCH_SIZE = 100
+
+class OfflineInbox:
+    """Caixas de entrada persistentes, uma por usuário.
+    
+    Layout em disco:
+        inbox/<usuário em hex>.log   uma mensagem JSON por linha ({queued_at, message})
+    
+    Um arquivo existe para todo usuário que já fez login; mensagens para nomes
+    desconhecidos não são guardadas. Se a caixa inteira cabe no final mantido em
+    memória, a entrega não lê o disco.
+    
+    put() só escreve no arquivo; sync() espera o fsync antes de o remetente receber
+    a confirmação. Um único fsync por caixa alterada cobre as mensagens de todas
+    as threads que chegaram enquanto o anterior estava em andamento (group commit).
+    """
+    
+    def __init__(self, root: str, max_messages: int = DEFAULT_MAX_MESSAGES, ttl: float = DEFAULT_TTL,
+                 tail_size: int = TAIL_SIZE):
+        self.directory = os.path.join(root, 'inbox')
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.tail_size = tail_size
+        self.lock = threading.Lock()
+        self._cond = threading.Condition(self.lock)
+        self.seq = 0     # última mensagem guardada
+        self.synced = 0  # última mensagem garantida no disco
+        self._dirty: Set[str] = set()  # caixas escritas desde o último fsync
+        self._syncing = False
+        self.counts: Dict[str, int] = {}    # usuário -> mensagens guardadas
+        self.newest: Dict[str, float] = {}  # usuário -> horário da mensagem mais recente
+        self.tails: Dict[str, deque] = {}   # usuário -> mensagens mais recentes
+        
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self._load()
+    
+    def _path(self, username: str) -> str:
+        # Nome em hex: qualquer nome de usuário vira um nome de arquivo seguro
+        return os.path.join(self.directory, username.encode('utf-8').hex() + '.log')
+    
+    def _load(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.draining'):
+                # Queda no meio de uma entrega: as mensagens voltam para a caixa
+                log_path = path[:-len('.draining')]
+                with open(path, 'rb') as f:
+                    pending = f.read()
+                if os.path.exists(log_path):
+                    with open(log_path, 'rb') as f:
+                        pending += f.read()
+                with open(log_path, 'wb') as f:
+                    f.write(pending)
+                os.remove(path)
+                path, name = log_path, os.path.basename(log_path)
+            elif not name.endswith('.log'):
+                continue
+            
+            username = bytes.fromhex(name[:-len('.log')]).decode('utf-8')
+            with open(path, 'rb') as f:
+                count = sum(1 for _ in f)
+            if count:
+                self.counts[username] = count
+                self.newest[username] = os.path.getmtime(path)
+            else:
+                self.counts.setdefault(username, 0)
+    
+    def register(self, username: str):
+        """Cria a caixa de entrada de um usuário (chamado no login)"""
+        with self.lock:
+            if username not in self.counts:
+                open(self._path(username), 'ab').close()
+                self.counts[username] = 0
+    
+    def known(self, username: str) -> bool:
+        """Se o usuário já fez login alguma vez (e portanto tem caixa de entrada)"""
+        with self.lock:
+            return username in self.counts
+    
+    def full(self, username: str) -> bool:
+        """Se a caixa de entrada do usuário atingiu o limite de mensagens"""
+        with self.lock:
+            return self.counts.get(username, 0) >= self.max_messages
+    
+    def put(self, username: str, message: dict) -> bool:
+        """Guarda uma mensagem. Retorna False se o usuário é desconhecido ou a caixa está cheia"""
+        now = time.time()
+        line = json.dumps({'queued_at': now, 'message': message}).encode('utf-8') + b'\n'
+        with self.lock:
+            count = self.counts.get(username)
+            if count is None or count >= self.max_messages:
+                return False
+            with open(self._path(username), 'ab') as f:
+                f.write(line)
+            self.seq += 1
+            self._dirty.add(username)
+            
+            self.counts[username] = count + 1
+            self.newest[username] = now
+            tail = self.tails.get(username)
+            if tail is None:
+                tail = self.tails[username] = deque(maxlen=self.tail_size)
+            tail.append((now, message))
+            return True
+    
+    def sync(self) -> bool:
+        """Espera até que as mensagens já guardadas estejam no disco. Retorna False
+        se o fsync falhou (as caixas continuam pendentes para o próximo sync)"""
+        with self._cond:
+            target = self.seq
+            self._cond.wait_for(lambda: self.synced >= target or not self._syncing)
+            if self.synced >= target:
+                return True
+            # Nenhum fsync em andamento: esta thread grava tudo o que está pendente,
+            # inclusive as mensagens que as outras threads esperam
+            self._syncing = True
+            batch, self._dirty = self._dirty, set()
+            last = self.seq
+        
+        error = None
+        for username in batch:
+            try:
+                with open(self._path(username), 'ab') as f:
+                    os.fsync(f.fileno())
+            except OSError as e:
+                error = e
+        
+        with self._cond:
+            self._syncing = False
+            if error is None:
+                self.synced = last
+            else:
+                self._dirty |= batch
+            self._cond.notify_all()
+        if error is not None:
+            print(f"[SERVIDOR] Erro ao gravar as caixas de entrada: {error}")
+        return error is None
+    
+    def take(self, username: str) -> Iterator[List[dict]]:
+        """Retira todas as mensagens do usuário e as devolve em lotes (expiradas são descartadas)"""
+        with self.lock:
+            count = self.counts.get(username, 0)
+            tail = self.tails.pop(username, None)
+            self.newest.pop(username, None)
+            if not count:
+                return iter(())
+            self.counts[username] = 0
+            
+            path = self._path(username)
+            if tail is not None and len(tail) == count:
+                # A caixa inteira está em memória: só esvazia o arquivo
+                open(path, 'wb').close()
+                return self._batches(tail)
+            
+            draining = path + '.draining'
+            os.replace(path, draining)
+            open(path, 'ab').close()
+        return self._batches(self._read(draining))
+    
+    def _read(self, path: str):
+        try:
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    yield entry['queued_at'], entry['message']
+        finally:
+            os.remove(path)
+    
+    def _batches(self, entries) -> Iterator[List[dict]]:
+        limit = time.time() - self.ttl
+        batch = []
+        for queued_at, message in entries:
+            if queued_at < limit:
+                continue
+            batch.append(message)
+            if len(batch) >= BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def expire(self) -> int:
+        """Esvazia caixas cuja mensagem mais recente passou do TTL. Retorna quantas mensagens saíram"""
+        limit = time.time() - self.ttl
+        expired = 0
+        with self.lock:
+            for username, newest in list(self.newest.items()):
+                if newest >= limit:
+                    continue
+                open(self._path(username), 'wb').close()
+                expired += self.counts[username]
+                self.counts[username] = 0
+                del self.newest[username]
+                self.tails.pop(username, None)
+        return expired
+    
+    def stats(self) -> dict:
+        """Números das caixas de entrada (usuários com mensagens e total guardado)"""
+        with self.lock:
+            return {
+                'users': sum(1 for count in self.counts.values() if count),
+                'messages': sum(self.counts.values())
+            }
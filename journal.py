@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Persistência dos grupos do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Log de operações (write-ahead log) com fsync em lote (group commit) e snapshots
+compactados: ao reiniciar, o servidor carrega o snapshot e reaplica o final do log
+"""
+
+import os
+import json
+import time
+import threading
+from typing import Dict, Set
+
+from registry import Group
+
+# Operações acumuladas no log antes de um novo snapshot (limita o tempo de recuperação)
+SNAPSHOT_INTERVAL = 1000
+
+# Tentativas de gravar um lote antes de o log ser desativado
+WRITE_RETRIES = 3
+RETRY_DELAY = 0.5  # segundos entre as tentativas
+
+class GroupJournal:
+    """Log das operações sobre grupos e membros.
+    
+    Layout em disco:
+        groups.snapshot.json   estado compactado {seq, groups}
+        groups.log             uma operação JSON por linha, com número de sequência
+    
+    append() só enfileira a operação. Uma thread grava todas as operações pendentes
+    com um único fsync (group commit) e, a cada `snapshot_interval` operações,
+    grava um snapshot e esvazia o log.
+    """
+    
+    def __init__(self, directory: str, snapshot_interval: int = SNAPSHOT_INTERVAL):
+        self.snapshot_path = os.path.join(directory, 'groups.snapshot.json')
+        self.log_path = os.path.join(directory, 'groups.log')
+        self.snapshot_interval = snapshot_interval
+        self.groups: Dict[str, Group] = {}  # estado já gravado no log (usado nos snapshots)
+        self.seq = 0        # última operação enfileirada
+        self.committed = 0  # última operação garantida no disco
+        self.replayed = 0   # operações reaplicadas do log no último load()
+        self.closed = False
+        self.error: OSError = None  # falha definitiva de gravação: o log deixa de aceitar operações
+        self._pending = []
+        self._since_snapshot = 0
+        self._cond = threading.Condition()
+        self._log = None
+        self._offset = 0  # tamanho do log antes do lote sendo gravado
+        self._writer = None
+    
+    def load(self) -> Dict[str, Set[str]]:
+        """Carrega o snapshot mais recente e reaplica o final do log. Retorna os grupos"""
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            snapshot_seq = snapshot['seq']
+            self.groups = {}
+            for name, members in snapshot['groups'].items():
+                group = Group(name, members)
+                self.groups[group.name] = group
+        self.seq = snapshot_seq
+        
+        self.replayed = 0
+        valid = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # última linha incompleta: queda no meio da escrita
+                    try:
+                        operation = json.loads(line)
+                    except ValueError:
+                        break
+                    valid += len(line)
+                    if operation['seq'] <= snapshot_seq:
+                        continue  # já incluída no snapshot
+                    self._apply(operation)
+                    self.seq = operation['seq']
+                    self.replayed += 1
+        
+        self._log = open(self.log_path, 'ab', buffering=0)  # sem buffer: nada fica pendente após um erro
+        # Descarta um final corrompido para que as novas operações não fiquem depois dele
+        self._log.truncate(valid)
+        self.committed = self.seq
+        self._since_snapshot = self.replayed
+        return {name: set(members) for name, members in self.groups.items()}
+    
+    def start(self):
+        """Inicia a thread que grava o log"""
+        self._writer = threading.Thread(target=self._run)
+        self._writer.daemon = True
+        self._writer.start()
+    
+    def append(self, operation: str, **fields):
+        """Enfileira uma operação (não espera o disco). Com o log desativado por um
+        erro de gravação a operação não é persistida (sync() informa o erro)"""
+        with self._cond:
+            if self.error is not None:
+                return
+            self.seq += 1
+            self._pending.append(dict(fields, op=operation, seq=self.seq))
+            self._cond.notify_all()
+    
+    def sync(self, timeout: float = None) -> bool:
+        """Espera até que tudo o que foi enfileirado esteja no disco. OSError se o
+        log foi desativado por um erro de gravação"""
+        with self._cond:
+            target = self.seq
+            done = self._cond.wait_for(lambda: self.committed >= target or self.closed or self.error is not None,
+                                       timeout)
+            if self.error is not None:
+                raise OSError(f'Log de grupos desativado: {self.error}')
+            return done
+    
+    def close(self):
+        """Grava as operações pendentes e encerra a thread do log"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+        if self._log is not None:
+            self._log.close()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self.closed)
+                if not self._pending:
+                    return
+                # Tudo o que chegou durante o fsync anterior vai no mesmo lote
+                batch, self._pending = self._pending, []
+            
+            data = b''.join(json.dumps(operation).encode('utf-8') + b'\n' for operation in batch)
+            for attempt in range(1, WRITE_RETRIES + 1):
+                try:
+                    self._write(data)
+                    break
+                except OSError as e:
+                    print(f"[SERVIDOR] Erro ao gravar o log de grupos (tentativa {attempt}/{WRITE_RETRIES}): {e}")
+                    if not self._rewind() or attempt == WRITE_RETRIES:
+                        self._fail(e)
+                        return
+                    time.sleep(RETRY_DELAY)
+            
+            for operation in batch:
+                self._apply(operation)
+            with self._cond:
+                self.committed = batch[-1]['seq']
+                self._cond.notify_all()
+            
+            self._since_snapshot += len(batch)
+            if self._since_snapshot >= self.snapshot_interval:
+                try:
+                    self.snapshot(batch[-1]['seq'])
+                except OSError as e:
+                    print(f"[SERVIDOR] Erro ao gravar o snapshot de grupos: {e}")
+    
+    def _write(self, data: bytes):
+        """Acrescenta o lote ao log e espera o fsync; em caso de erro desfaz a escrita
+        parcial, para que nenhuma linha pela metade fique antes das próximas"""
+        self._offset = os.fstat(self._log.fileno()).st_size
+        view = memoryview(data)
+        while view:
+            view = view[self._log.write(view):]
+        os.fsync(self._log.fileno())
+    
+    def _rewind(self) -> bool:
+        """Volta o log ao tamanho de antes do lote que falhou"""
+        try:
+            self._log.truncate(self._offset)
+            os.fsync(self._log.fileno())
+            return True
+        except OSError as e:
+            print(f"[SERVIDOR] Erro ao desfazer a gravação parcial do log de grupos: {e}")
+            return False
+    
+    def _fail(self, error: OSError):
+        """Desativa o log: quem espera em sync() recebe o erro, e nada mais é gravado
+        depois de uma possível linha incompleta (que o load() trataria como o fim do log)"""
+        with self._cond:
+            self.error = error
+            self._pending = []
+            self._cond.notify_all()
+        print(f"[SERVIDOR] Log de grupos desativado após {WRITE_RETRIES} tentativas: "
+              f"as alterações de grupos deixam de ser persistidas")
+    
+    def snapshot(self, seq: int):
+        """Grava o estado compactado até `seq` e esvazia o log"""
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'seq': seq,
+                'groups': {name: sorted(members) for name, members in self.groups.items()}
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        
+        # Operações até `seq` estão no snapshot; se cair antes daqui, o load() as ignora
+        self._log.truncate(0)
+        self._since_snapshot = 0
+    
+    def _apply(self, operation: dict):
+        if operation['op'] == 'create_group':
+            group = Group(operation['group'], (operation['user'],))
+            self.groups[group.name] = group
+        elif operation['op'] == 'add_member':
+            group = self.groups.get(operation['group'])
+            if group is None:
+                group = Group(operation['group'])
+                self.groups[group.name] = group
+            group.add(operation['user'])
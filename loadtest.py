@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+"""
+Gerador de carga do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Simula milhares de usuários em um único loop asyncio, sem input(), falando o mesmo
+protocolo do cliente: login, mensagens privadas, mensagens de grupo e arquivos.
+Mede vazão, latência de ponta a ponta (p50/p99/p999) e memória (RSS) do servidor
+
+Uso:
+  python loadtest.py --users 2000 --duration 30            # servidor já em execução
+  python loadtest.py --scenario grupos --spawn "--mode thread" --spawn "--mode async"
+  python loadtest.py --scenario-file cenario.json --output resultado.json
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import os
+import random
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from protocol import (CODEC_BINARY, CODEC_JSON, COMPRESSION_ZLIB, FrameCompressor, FrameDecoder, FrameError,
+                      encode_message, decode_message)
+from transfer import CHUNK_SIZE, is_compressible
+from server import raise_file_limit
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+REQUEST_TIMEOUT = 30.0  # segundos de espera por uma resposta do servidor
+DRAIN_TIMEOUT = 10.0    # segundos de espera pelas entregas pendentes ao fim da medição
+RSS_INTERVAL = 0.5      # intervalo de amostragem da memória do servidor
+START_TIMEOUT = 15.0    # segundos para um servidor iniciado com --spawn aceitar conexões
+
+# Parâmetros de um cenário; um arquivo JSON (--scenario-file) pode mudar qualquer um
+DEFAULT_SCENARIO = {
+    'users': 1000,          # usuários conectados ao mesmo tempo
+    'ramp': 5.0,            # segundos para conectar todos os usuários
+    'duration': 20.0,       # segundos de medição depois dos logins
+    'rate': 1.0,            # operações por segundo de cada usuário (intervalos exponenciais)
+    'mix': {'private': 0.7, 'group': 0.25, 'file': 0.05},  # peso de cada operação
+    'group_size': 20,       # membros de cada grupo (os usuários são divididos em grupos)
+    'message_size': 100,    # bytes do conteúdo de cada mensagem
+    'file_size': 256 * 1024,
+    'file_extension': '.bin',  # '.zip' etc. não é comprimido quando há compressão
+    'codec': CODEC_JSON,    # codec oferecido no login
+    'compression': False    # pede compressão zlib no login
+}
+
+# Cenários prontos (apenas o que difere do padrão)
+SCENARIOS = {
+    'misto': {},
+    'login': {'users': 5000, 'ramp': 10.0, 'duration': 5.0, 'rate': 0},
+    'privadas': {'mix': {'private': 1}},
+    'grupos': {'mix': {'group': 1}, 'rate': 0.5},
+    'arquivos': {'users': 100, 'rate': 0.5, 'mix': {'file': 1}}
+}
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Percentil de uma lista ordenada"""
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+def process_rss(pid: int) -> int:
+    """Memória residente (bytes) de um processo e de seus filhos (Linux, via /proc)"""
+    total = 0
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1]) * 1024
+        # Filhos: os workers do modo multiprocesso
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                for child in f.read().split():
+                    total += process_rss(int(child))
+    except (OSError, ValueError):
+        pass
+    return total
+
+class LoadClient(asyncio.Protocol):
+    """Usuário simulado: uma conexão asyncio que fala o protocolo do ChatClient"""
+    
+    def __init__(self, test: 'LoadTest', username: str):
+        self.test = test
+        self.username = username
+        self.transport = None
+        # Como no servidor assíncrono: buffer liberado entre leituras (milhares de conexões)
+        self.decoder = FrameDecoder(buffer_size=0)
+        self.codec = CODEC_JSON
+        self.compressor: FrameCompressor = None
+        self.group: Optional[str] = None  # grupo do usuário
+        self.group_size = 0
+        self.waiters: Dict[str, asyncio.Future] = {}  # tipo de resposta -> future
+    
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def data_received(self, data: bytes):
+        self.test.bytes_received += len(data)
+        try:
+            self.decoder.feed(data)
+            for frame in self.decoder.frames():
+                self.handle_message(decode_message(frame))
+            self.decoder.release()
+        except (FrameError, ValueError):
+            self.test.errors['frame inválido'] += 1
+            self.transport.close()
+    
+    def connection_lost(self, exc):
+        self.transport = None
+        for future in self.waiters.values():
+            if not future.done():
+                future.set_exception(ConnectionError('Conexão encerrada pelo servidor'))
+    
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+    
+    def send(self, message: dict, compress: bool = True):
+        """Envia uma mensagem no codec e com a compressão negociados"""
+        if self.transport is None:
+            raise ConnectionError('Conexão encerrada')
+        frame = encode_message(message, self.codec)
+        if self.compressor is not None and compress:
+            frame = self.compressor.compress(frame)
+        self.test.bytes_sent += len(frame)
+        self.transport.write(frame)
+    
+    async def request(self, message: dict, *response_types: str, compress: bool = True) -> dict:
+        """Envia uma mensagem e espera a primeira resposta de um dos tipos indicados"""
+        future = asyncio.get_running_loop().create_future()
+        for response_type in response_types:
+            self.waiters[response_type] = future
+        try:
+            self.send(message, compress)
+            return await asyncio.wait_for(future, REQUEST_TIMEOUT)
+        finally:
+            for response_type in response_types:
+                self.waiters.pop(response_type, None)
+    
+    def handle_message(self, message: dict):
+        """Registra entregas e erros e acorda quem espera pela resposta"""
+        msg_type = message.get('type')
+        if msg_type == 'ping':
+            self.send({'type': 'pong'})  # heartbeat: sem resposta o servidor derruba a conexão ociosa
+        elif msg_type == 'private_message_received':
+            self.test.delivered('private', int(message['content'].split(' ', 1)[0]))
+        elif msg_type == 'group_message_received':
+            self.test.delivered('group', int(message['content'].split(' ', 1)[0]))
+        elif msg_type in ('file_received', 'group_file_received'):
+            self.test.delivered('file', int(os.path.splitext(message['filename'])[0].split('-')[-1]))
+        elif (message.get('status') == 'error' or msg_type == 'error') and msg_type != 'login_response':
+            self.test.errors[msg_type] += 1
+        
+        future = self.waiters.get(msg_type)
+        if future is not None and not future.done():
+            future.set_result(message)
+
+class LoadTest:
+    """Execução de um cenário contra um servidor"""
+    
+    def __init__(self, scenario: dict, host: str, port: int, pid: Optional[int] = None):
+        self.scenario = scenario
+        self.host = host
+        self.port = port
+        self.pid = pid  # processo do servidor, para medir a memória
+        self.prefix = f'lt{uuid.uuid4().hex[:6]}'  # nomes únicos: grupos e arquivos persistem entre execuções
+        self.clients: List[LoadClient] = []
+        self.start = self.end = float('inf')  # janela de medição (perf_counter_ns)
+        
+        self.latencies = defaultdict(list)  # operação -> latências em segundos
+        self.sent = Counter()      # operações enviadas na janela
+        self.expected = Counter()  # entregas esperadas das operações enviadas
+        self.received = Counter()  # entregas recebidas das operações enviadas
+        self.errors = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.rss = []
+        self.file_data = os.urandom(scenario['file_size'])
+    
+    def delivered(self, operation: str, sent_ns: int):
+        """Uma entrega chegou; só conta se a operação foi enviada dentro da janela"""
+        if self.start <= sent_ns <= self.end:
+            self.received[operation] += 1
+            self.latencies[operation].append((time.perf_counter_ns() - sent_ns) / 1e9)
+    
+    async def sample_rss(self):
+        while True:
+            rss = process_rss(self.pid)
+            if rss:
+                self.rss.append(rss)
+            await asyncio.sleep(RSS_INTERVAL)
+    
+    async def connect(self, username: str, delay: float) -> Optional[LoadClient]:
+        """Conecta e faz login de um usuário, seguindo o redirecionamento do cluster"""
+        await asyncio.sleep(delay)
+        loop = asyncio.get_running_loop()
+        login = {
+            'type': 'login',
+            'username': username,
+            'codecs': [CODEC_BINARY, CODEC_JSON] if self.scenario['codec'] == CODEC_BINARY else [CODEC_JSON]
+        }
+        if self.scenario['compression']:
+            login['compression'] = [COMPRESSION_ZLIB]
+        
+        started = time.perf_counter()
+        host, port = self.host, self.port
+        for _ in range(2):
+            try:
+                _, client = await loop.create_connection(lambda: LoadClient(self, username), host, port)
+                response = await client.request(login, 'login_response')
+            except (OSError, ConnectionError, asyncio.TimeoutError):
+                self.errors['conexão'] += 1
+                return None
+            
+            if response.get('redirect'):
+                client.close()
+                host, port = response['redirect']['host'], response['redirect']['port']
+                continue
+            if response.get('status') != 'success':
+                self.errors['login'] += 1
+                client.close()
+                return None
+            
+            client.codec = response.get('codec', CODEC_JSON)
+            if response.get('compression'):
+                client.compressor = FrameCompressor()
+            self.latencies['login'].append(time.perf_counter() - started)
+            return client
+        
+        self.errors['login'] += 1
+        return None
+    
+    async def create_group(self, index: int, members: List[LoadClient]):
+        """O primeiro membro cria o grupo e adiciona os demais"""
+        owner, group_name = members[0], f'{self.prefix}_g{index}'
+        try:
+            response = await owner.request({
+                'type': 'create_group',
+                'group_name': group_name,
+                'creator': owner.username
+            }, 'group_response')
+            if response.get('status') != 'success':
+                return
+            
+            joined = [owner]
+            for member in members[1:]:
+                response = await owner.request({
+                    'type': 'add_member',
+                    'group_name': group_name,
+                    'new_member': member.username,
+                    'requester': owner.username
+                }, 'member_response')
+                if response.get('status') == 'success':
+                    joined.append(member)
+        except (ConnectionError, asyncio.TimeoutError):
+            self.errors['grupo'] += 1
+            return
+        
+        for member in joined:
+            member.group = group_name
+            member.group_size = len(joined)
+    
+    async def send_private(self, client: LoadClient):
+        recipient = random.choice(self.clients)
+        if recipient is client:
+            return
+        client.send({
+            'type': 'private_message',
+            'sender': client.username,
+            'recipient': recipient.username,
+            'content': self.content()
+        })
+        self.sent['private'] += 1
+        self.expected['private'] += 1
+    
+    async def send_group(self, client: LoadClient):
+        if client.group is None or client.group_size < 2:
+            return await self.send_private(client)
+        client.send({
+            'type': 'group_message',
+            'sender': client.username,
+            'group_name': client.group,
+            'content': self.content()
+        })
+        self.sent['group'] += 1
+        self.expected['group'] += client.group_size - 1
+    
+    async def send_file(self, client: LoadClient):
+        """Upload completo (file_begin, chunks, file_end) para outro usuário"""
+        recipient = random.choice(self.clients)
+        if recipient is client:
+            return
+        sent_ns = time.perf_counter_ns()
+        transfer_id = uuid.uuid4().hex
+        filename = f'{self.prefix}-{sent_ns}{self.scenario["file_extension"]}'
+        compress = is_compressible(filename)
+        # Conteúdo diferente a cada envio (o servidor deduplica arquivos iguais)
+        data = (transfer_id.encode('ascii') + self.file_data)[:len(self.file_data)]
+        
+        response = await client.request({
+            'type': 'file_begin',
+            'transfer_id': transfer_id,
+            'sender': client.username,
+            'recipient': recipient.username,
+            'filename': filename,
+            'size': len(data)
+        }, 'upload_offset', 'file_response')
+        if response.get('type') != 'upload_offset':
+            return
+        
+        for offset in range(response.get('offset', 0), len(data), CHUNK_SIZE):
+            chunk = data[offset:offset + CHUNK_SIZE]
+            client.send({
+                'type': 'file_chunk',
+                'transfer_id': transfer_id,
+                'sender': client.username,
+                'offset': offset,
+                'data': chunk if client.codec == CODEC_BINARY else base64.b64encode(chunk).decode('ascii')
+            }, compress)
+        response = await client.request({
+            'type': 'file_end',
+            'transfer_id': transfer_id,
+            'sender': client.username
+        }, 'file_response')
+        if response.get('status') == 'success' and self.start <= sent_ns <= self.end:
+            self.sent['file'] += 1
+            self.expected['file'] += 1
+    
+    def content(self) -> str:
+        """Conteúdo com o instante do envio no início (para medir a latência na entrega)"""
+        stamp = f'{time.perf_counter_ns()} '
+        return stamp + 'x' * max(0, self.scenario['message_size'] - len(stamp))
+    
+    async def user_loop(self, client: LoadClient):
+        """Operações de um usuário em intervalos exponenciais até o fim da janela"""
+        rate = self.scenario['rate']
+        operations = [operation for operation, weight in self.scenario['mix'].items() if weight > 0]
+        weights = [self.scenario['mix'][operation] for operation in operations]
+        if rate <= 0 or not operations:
+            return
+        
+        while True:
+            delay = random.expovariate(rate)
+            if time.perf_counter_ns() + delay * 1e9 >= self.end:
+                return
+            await asyncio.sleep(delay)
+            if time.perf_counter_ns() >= self.end or client.transport is None:
+                return
+            operation = random.choices(operations, weights)[0]
+            try:
+                await getattr(self, f'send_{operation}')(client)
+            except (ConnectionError, asyncio.TimeoutError):
+                self.errors[operation] += 1
+                return
+    
+    async def run(self) -> dict:
+        """Conecta os usuários, cria os grupos, mede a janela e espera as entregas pendentes"""
+        scenario = self.scenario
+        sampler = asyncio.create_task(self.sample_rss()) if self.pid else None
+        await asyncio.sleep(0)
+        rss_start = self.rss[-1] if self.rss else 0
+        
+        users = scenario['users']
+        print(f"[CARGA] Conectando {users} usuários em {scenario['ramp']:.0f} s...")
+        clients = await asyncio.gather(*(self.connect(f'{self.prefix}_{index}', index * scenario['ramp'] / users)
+                                         for index in range(users)))
+        self.clients = [client for client in clients if client is not None]
+        if not self.clients:
+            raise ConnectionError(f'Nenhum usuário conseguiu entrar em {self.host}:{self.port}')
+        
+        if scenario['mix'].get('group') and scenario['group_size'] > 1:
+            size = scenario['group_size']
+            groups = [self.clients[i:i + size] for i in range(0, len(self.clients), size)]
+            await asyncio.gather(*(self.create_group(index, members)
+                                   for index, members in enumerate(groups) if len(members) > 1))
+        
+        print(f"[CARGA] {len(self.clients)} usuários conectados; medindo por {scenario['duration']:.0f} s...")
+        cpu = time.process_time()
+        self.start = time.perf_counter_ns()
+        self.end = self.start + int(scenario['duration'] * 1e9)
+        await asyncio.gather(*(self.user_loop(client) for client in self.clients))
+        cpu = (time.process_time() - cpu) / ((time.perf_counter_ns() - self.start) / 1e9)
+        measured = scenario['duration']
+        
+        # Entregas das mensagens enviadas perto do fim da janela
+        deadline = time.perf_counter() + DRAIN_TIMEOUT
+        while sum(self.received.values()) < sum(self.expected.values()) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        
+        if sampler is not None:
+            sampler.cancel()
+        for client in self.clients:
+            client.close()
+        await asyncio.sleep(0.1)
+        return self.report(measured, cpu, rss_start)
+    
+    def report(self, measured: float, cpu: float, rss_start: int) -> dict:
+        """Resumo da execução (também gravado com --output)"""
+        latencies = {}
+        for operation, samples in self.latencies.items():
+            samples.sort()
+            latencies[operation] = {
+                'samples': len(samples),
+                'p50': percentile(samples, 0.5) * 1000,
+                'p99': percentile(samples, 0.99) * 1000,
+                'p999': percentile(samples, 0.999) * 1000,
+                'max': samples[-1] * 1000
+            }
+        return {
+            'scenario': self.scenario,
+            'users': len(self.clients),
+            'duration': measured,
+            'sent': dict(self.sent),
+            'delivered': dict(self.received),
+            'lost': {operation: self.expected[operation] - self.received[operation] for operation in self.expected},
+            'sent_per_s': sum(self.sent.values()) / measured,
+            'delivered_per_s': sum(self.received.values()) / measured,
+            'latency_ms': latencies,
+            'errors': dict(self.errors),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'rss_mb': {
+                'start': rss_start / 2**20,
+                'peak': max(self.rss, default=0) / 2**20,
+                'end': (self.rss[-1] if self.rss else 0) / 2**20
+            },
+            'client_cpu': cpu  # fração de um núcleo usada pelo próprio gerador
+        }
+
+def print_report(result: dict):
+    """Mostra o resultado de uma execução"""
+    print(f"\n== {result['server']}: {result['users']} usuários por {result['duration']:.1f} s ==")
+    print(f"enviadas: {result['sent']}  ({result['sent_per_s']:.0f}/s)")
+    print(f"entregues: {result['delivered']}  ({result['delivered_per_s']:.0f}/s)")
+    if any(result['lost'].values()):
+        print(f"não entregues: {result['lost']}")
+    if result['errors']:
+        print(f"erros: {result['errors']}")
+    print(f"{'operação':<10}{'amostras':>10}{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}{'máx ms':>10}")
+    for operation, latency in result['latency_ms'].items():
+        print(f"{operation:<10}{latency['samples']:>10}{latency['p50']:>10.2f}{latency['p99']:>10.2f}"
+              f"{latency['p999']:>10.2f}{latency['max']:>10.2f}")
+    rss = result['rss_mb']
+    if rss['peak']:
+        print(f"RSS do servidor: {rss['start']:.1f} MB no início, pico {rss['peak']:.1f} MB, {rss['end']:.1f} MB no fim")
+    print(f"tráfego: {result['bytes_sent'] / 2**20:.1f} MB enviados, {result['bytes_received'] / 2**20:.1f} MB recebidos")
+    if result['client_cpu'] > 0.9:
+        print("[CARGA] Aviso: o gerador usou quase um núcleo inteiro; os números podem estar limitados pelo cliente")
+
+def print_comparison(results: List[dict]):
+    """Tabela com uma linha por servidor testado"""
+    print("\n== comparação ==")
+    print(f"{'servidor':<28}{'entregas/s':>12}{'p50 ms':>9}{'p99 ms':>9}{'p999 ms':>9}{'RSS MB':>9}{'erros':>7}")
+    for result in results:
+        # Latência da operação com mais amostras (fora o login)
+        operations = {name: latency for name, latency in result['latency_ms'].items() if name != 'login'}
+        latency = max(operations.values(), key=lambda item: item['samples']) if operations else \
+            result['latency_ms'].get('login', {'p50': 0, 'p99': 0, 'p999': 0})
+        print(f"{result['server']:<28}{result['delivered_per_s']:>12.0f}{latency['p50']:>9.2f}{latency['p99']:>9.2f}"
+              f"{latency['p999']:>9.2f}{result['rss_mb']['peak']:>9.1f}{sum(result['errors'].values()):>7}")
+
+def wait_for_port(host: str, port: int, process: subprocess.Popen):
+    """Espera o servidor recém-iniciado aceitar conexões"""
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'O servidor terminou ao iniciar (código {process.returncode})')
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'O servidor não aceitou conexões em {START_TIMEOUT:.0f} s')
+
+@contextlib.contextmanager
+def spawned_server(arguments: str, host: str, port: int):
+    """server.py com os argumentos dados, em um diretório temporário; encerrado com Ctrl+C no fim"""
+    with tempfile.TemporaryDirectory() as directory:
+        command = [sys.executable, SERVER_SCRIPT, '--host', host, '--port', str(port),
+                   '--data-dir', os.path.join(directory, 'server_files')] + shlex.split(arguments)
+        with open(os.path.join(directory, 'server.log'), 'wb') as log:
+            process = subprocess.Popen(command, cwd=directory, stdout=log, stderr=subprocess.STDOUT)
+            try:
+                wait_for_port(host, port, process)
+                yield process
+            finally:
+                process.send_signal(signal.SIGINT)
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+
+def load_scenario(args) -> dict:
+    """Cenário pronto + arquivo JSON + opções da linha de comando, nessa ordem"""
+    scenario = dict(DEFAULT_SCENARIO)
+    scenario.update(SCENARIOS[args.scenario])
+    if args.scenario_file:
+        with open(args.scenario_file, encoding='utf-8') as f:
+            overrides = json.load(f)
+        unknown = set(overrides) - set(DEFAULT_SCENARIO)
+        if unknown:
+            raise ValueError(f"Campos desconhecidos no cenário: {', '.join(sorted(unknown))}")
+        scenario.update(overrides)
+    for field in ('users', 'duration', 'rate', 'ramp', 'codec'):
+        if getattr(args, field) is not None:
+            scenario[field] = getattr(args, field)
+    if args.compression:
+        scenario['compression'] = True
+    return scenario
+
+def main():
+    """Função principal do gerador de carga"""
+    parser = argparse.ArgumentParser(description="Gerador de carga do Chat Distribuído")
+    parser.add_argument('--host', default='localhost', help="endereço do servidor")
+    parser.add_argument('--port', type=int, default=12345, help="porta do servidor")
+    parser.add_argument('--scenario', choices=SCENARIOS, default='misto', help="cenário pronto")
+    parser.add_argument('--scenario-file', default=None,
+                        help="arquivo JSON com campos do cenário (ver DEFAULT_SCENARIO em loadtest.py)")
+    parser.add_argument('--users', type=int, default=None, help="usuários simultâneos")
+    parser.add_argument('--duration', type=float, default=None, help="segundos de medição")
+    parser.add_argument('--rate', type=float, default=None, help="operações por segundo de cada usuário")
+    parser.add_argument('--ramp', type=float, default=None, help="segundos para conectar todos os usuários")
+    parser.add_argument('--codec', choices=[CODEC_JSON, CODEC_BINARY], default=None, help="codec oferecido no login")
+    parser.add_argument('--compression', action='store_true', help="pede compressão zlib no login")
+    parser.add_argument('--spawn', action='append', default=None, metavar='ARGS',
+                        help="inicia server.py com esses argumentos para o teste (repita para comparar modos)")
+    parser.add_argument('--pid', type=int, default=None, help="PID do servidor já em execução (para medir o RSS)")
+    parser.add_argument('--output', default=None, help="grava os resultados em JSON")
+    args = parser.parse_args()
+    
+    try:
+        scenario = load_scenario(args)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    raise_file_limit()
+    
+    results = []
+    try:
+        if args.spawn:
+            for arguments in args.spawn:
+                print(f"\n[CARGA] Iniciando servidor: server.py {arguments}")
+                with spawned_server(arguments, args.host, args.port) as process:
+                    result = asyncio.run(LoadTest(scenario, args.host, args.port, process.pid).run())
+                result['server'] = arguments or 'padrão'
+                print_report(result)
+                results.append(result)
+        else:
+            result = asyncio.run(LoadTest(scenario, args.host, args.port, args.pid).run())
+            result['server'] = f'{args.host}:{args.port}'
+            print_report(result)
+            results.append(result)
+    except (ConnectionError, RuntimeError) as e:
+        print(f"[CARGA] Erro: {e}")
+    except KeyboardInterrupt:
+        print("\n[CARGA] Interrompido")
+    
+    if len(results) > 1:
+        print_comparison(results)
+    if args.output and results:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"[CARGA] Resultados gravados em {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Métricas do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Contadores e histogramas log-lineares (no estilo do HdrHistogram) sem lock no
+caminho quente: cada thread grava no seu próprio shard e a coleta soma os shards.
+A saída segue o formato de texto do Prometheus (servida por admin.py)
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+import tracing
+
+# Histograma log-linear: 16 faixas por potência de 2 (erro relativo abaixo de 6,25%).
+# Valores abaixo de 32 são exatos; os `le` exportados são potências de 2
+SUB_BITS = 4
+LINEAR_LIMIT = 2 << SUB_BITS  # valores abaixo disso têm uma faixa cada
+
+# Métricas conhecidas: nome -> (descrição, nome do rótulo, escala do valor exportado)
+DESCRIPTIONS = {
+    'message_seconds': ('Tempo de processamento de cada mensagem em process_message', 'type', 1e-9),
+    'errors_total': ('Respostas de erro por tipo de mensagem', 'type', 1),
+    'fanout_recipients': ('Destinatários de cada mensagem de grupo', None, 1),
+    'bytes_received_total': ('Bytes recebidos dos clientes', None, 1),
+    'bytes_sent_total': ('Bytes enviados aos clientes', None, 1),
+    'lock_wait_seconds': ('Espera por locks ocupados (só as aquisições que precisaram esperar)', 'lock', 1e-9),
+    'reaped_total': ('Conexões derrubadas pelo heartbeat por inatividade', None, 1),
+    'connected_users': ('Usuários conectados a este processo', None, 1),
+    'groups': ('Grupos conhecidos por este processo', None, 1),
+    'queue_depth': ('Frames aguardando na fila de saída de cada usuário', 'user', 1)
+}
+
+QUANTILES = (0.5, 0.99, 0.999)
+PREFIX = 'chat_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def bucket_index(value: int) -> int:
+    """Faixa do histograma de um valor inteiro não negativo"""
+    if value < LINEAR_LIMIT:
+        return value if value > 0 else 0
+    shift = value.bit_length() - SUB_BITS - 1
+    return (shift << SUB_BITS) + (value >> shift)
+
+def bucket_bounds(index: int) -> Tuple[int, int]:
+    """Intervalo [início, fim) de valores de uma faixa"""
+    if index < LINEAR_LIMIT:
+        return index, index + 1
+    shift = (index >> SUB_BITS) - 1
+    mantissa = index - (shift << SUB_BITS)
+    return mantissa << shift, (mantissa + 1) << shift
+
+class Histogram:
+    """Contagem por faixa (esparsa), total de eventos e soma dos valores"""
+    
+    __slots__ = ('buckets', 'count', 'total')
+    
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+    
+    def merge(self, other: 'Histogram'):
+        for index, count in dict(other.buckets).items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+    
+    def quantile(self, fraction: float) -> float:
+        """Valor aproximado (meio da faixa) do quantil pedido"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                low, high = bucket_bounds(index)
+                return (low + high - 1) / 2
+        return float(bucket_bounds(max(self.buckets))[1])
+    
+    def cumulative(self, bounds: List[int]) -> List[int]:
+        """Eventos com valor até cada limite (crescentes)"""
+        totals = [0] * len(bounds)  # o que passa do último limite só entra no +Inf
+        for index, count in self.buckets.items():
+            highest = bucket_bounds(index)[1] - 1
+            for position, bound in enumerate(bounds):
+                if highest <= bound:
+                    totals[position] += count
+                    break
+        for position in range(1, len(totals)):
+            totals[position] += totals[position - 1]
+        return totals
+
+class Shard:
+    """Métricas gravadas por uma thread (só ela escreve aqui)"""
+    
+    __slots__ = ('counters', 'histograms', 'thread')
+    
+    def __init__(self, thread=None):
+        self.counters: Dict[Tuple[str, str], int] = {}
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.thread = thread
+    
+    def merge(self, other: 'Shard'):
+        # dict() copia de uma vez (sob o GIL) mesmo com a thread dona gravando
+        for key, value in dict(other.counters).items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, histogram in dict(other.histograms).items():
+            self.histograms.setdefault(key, Histogram()).merge(histogram)
+
+class Metrics:
+    """Registro de métricas do processo"""
+    
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()  # só para criar shards e coletar
+        self._shards: List[Shard] = []
+        self._retired = Shard()  # soma dos shards de threads que já terminaram
+        self._fold_at = 64
+        self._gauges: Dict[str, Callable] = {}
+    
+    def _shard(self) -> Shard:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+                if len(self._shards) >= self._fold_at:
+                    # Uma thread por conexão: junta de tempos em tempos os shards de threads encerradas
+                    self._fold_dead()
+                    self._fold_at = max(64, 2 * len(self._shards))
+        return shard
+    
+    def _fold_dead(self):
+        alive = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                alive.append(shard)
+            else:
+                self._retired.merge(shard)
+        self._shards = alive
+    
+    def count(self, name: str, label: str = '', amount: int = 1):
+        """Soma `amount` a um contador"""
+        shard = getattr(self._local, 'shard', None) or self._shard()
+        counters = shard.counters
+        key = (name, label)
+        counters[key] = counters.get(key, 0) + amount
+    
+    def observe(self, name: str, label: str, value: int):
+        """Registra um valor inteiro (ns para tempos) em um histograma"""
+        shard = getattr(self._local, 'shard', None) or self._shard()
+        histogram = shard.histograms.get((name, label))
+        if histogram is None:
+            histogram = shard.histograms[(name, label)] = Histogram()
+        if value < LINEAR_LIMIT:
+            index = value if value > 0 else 0
+        else:
+            shift = value.bit_length() - SUB_BITS - 1
+            index = (shift << SUB_BITS) + (value >> shift)
+        buckets = histogram.buckets
+        buckets[index] = buckets.get(index, 0) + 1
+        histogram.count += 1
+        histogram.total += value
+    
+    def gauge(self, name: str, function: Callable):
+        """Valor lido na coleta: a função retorna um número ou {rótulo: número}"""
+        self._gauges[name] = function
+    
+    def snapshot(self) -> Shard:
+        """Soma de todos os shards"""
+        with self._lock:
+            self._fold_dead()
+            total = Shard()
+            total.merge(self._retired)
+            for shard in self._shards:
+                total.merge(shard)
+        return total
+    
+    def reset(self):
+        """Descarta tudo (no processo filho após um fork)"""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = Shard()
+        self._fold_at = 64
+    
+    def render(self) -> str:
+        """Métricas no formato de texto do Prometheus"""
+        snapshot = self.snapshot()
+        families: Dict[str, list] = {}
+        for (name, label), value in snapshot.counters.items():
+            families.setdefault(name, []).append((label, value))
+        for (name, label), histogram in snapshot.histograms.items():
+            families.setdefault(name, []).append((label, histogram))
+        for name, function in list(self._gauges.items()):
+            try:
+                value = function()
+            except Exception:
+                continue
+            items = value.items() if isinstance(value, dict) else [('', value)]
+            if items:
+                families[name] = [(str(label), number) for label, number in items]
+        
+        lines = []
+        for name in sorted(families):
+            description, label_name, scale = DESCRIPTIONS.get(name, (name, 'label', 1))
+            full_name = PREFIX + name
+            samples = sorted(families[name], key=lambda item: item[0])
+            if isinstance(samples[0][1], Histogram):
+                lines.extend(render_histogram(full_name, description, label_name, scale, samples))
+                continue
+            kind = 'counter' if name.endswith('_total') else 'gauge'
+            lines.append(f'# HELP {full_name} {description}')
+            lines.append(f'# TYPE {full_name} {kind}')
+            for label, value in samples:
+                lines.append(f'{full_name}{labels(label_name, label)} {format_number(value * scale)}')
+        return '\n'.join(lines) + '\n'
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def labels(label_name: str, label: str, **extra) -> str:
+    """Rótulos no formato {nome="valor",...} (vazio se não houver nenhum)"""
+    pairs = [(label_name, label)] if label_name and label != '' else []
+    pairs.extend(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{escape(str(value))}"' for key, value in pairs) + '}'
+
+def format_number(value) -> str:
+    return f'{value:.9g}' if isinstance(value, float) else str(value)
+
+def render_histogram(full_name: str, description: str, label_name: str, scale: float, samples) -> List[str]:
+    """Histograma (limites nas potências de 2) + resumo com p50/p99/p999"""
+    top = max(max(histogram.buckets, default=0) for _, histogram in samples)
+    first = 10 if scale < 1 else 0  # tempos em ns: a partir de ~1 µs
+    bounds = [1 << exponent for exponent in range(first, max(first, bucket_bounds(top)[1].bit_length()) + 1)]
+    lines = [f'# HELP {full_name} {description}', f'# TYPE {full_name} histogram']
+    for label, histogram in samples:
+        for bound, cumulative in zip(bounds, histogram.cumulative(bounds)):
+            lines.append(f'{full_name}_bucket{labels(label_name, label, le=format_number(bound * scale))} {cumulative}')
+        lines.append(f'{full_name}_bucket{labels(label_name, label, le="+Inf")} {histogram.count}')
+        lines.append(f'{full_name}_sum{labels(label_name, label)} {format_number(histogram.total * scale)}')
+        lines.append(f'{full_name}_count{labels(label_name, label)} {histogram.count}')
+    
+    summary = full_name + '_quantiles'
+    lines.extend([f'# HELP {summary} {description} (quantis do histograma)', f'# TYPE {summary} summary'])
+    for label, histogram in samples:
+        for fraction in QUANTILES:
+            value = histogram.quantile(fraction) * scale
+            lines.append(f'{summary}{labels(label_name, label, quantile=fraction)} {format_number(value)}')
+        lines.append(f'{summary}_sum{labels(label_name, label)} {format_number(histogram.total * scale)}')
+        lines.append(f'{summary}_count{labels(label_name, label)} {histogram.count}')
+    return lines
+
+class TimedLock:
+    """Lock que mede a espera quando está ocupado; sem disputa custa uma tentativa a mais"""
+    
+    __slots__ = ('_lock', 'name')
+    
+    def __init__(self, name: str, lock=None):
+        self._lock = lock if lock is not None else threading.RLock()
+        self.name = name
+    
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter_ns()
+        acquired = self._lock.acquire(True, timeout)
+        end = time.perf_counter_ns()
+        REGISTRY.observe('lock_wait_seconds', self.name, end - start)
+        tracing.TRACER.lock_wait(self.name, start, end)
+        return acquired
+    
+    def release(self):
+        self._lock.release()
+    
+    def __enter__(self):
+        if not self._lock.acquire(False):
+            start = time.perf_counter_ns()
+            self._lock.acquire()
+            end = time.perf_counter_ns()
+            REGISTRY.observe('lock_wait_seconds', self.name, end - start)
+            tracing.TRACER.lock_wait(self.name, start, end)
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+# Registro do processo; os módulos gravam com metrics.count/metrics.observe
+REGISTRY = Metrics()
+count = REGISTRY.count
+observe = REGISTRY.observe
+gauge = REGISTRY.gauge
+render = REGISTRY.render
+
+if hasattr(os, 'register_at_fork'):
+    # Workers do modo multiprocesso começam sem as métricas do processo pai
+    os.register_at_fork(after_in_child=REGISTRY.reset)
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+Filas de saída por conexão do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Cada cliente conectado tem uma fila limitada; o fan-out apenas enfileira frames
+e um escritor dedicado drena a fila para o socket
+
+Um item da fila é um frame (bytes) ou um stream com o método frames(), que gera
+os frames sob demanda (ex.: transfer.FileStream, para arquivos grandes). Um stream
+pode gerar também FileRegion: um trecho de arquivo que vai do disco para o socket
+com sendfile, sem passar pela memória do Python
+
+Com compressão negociada (compressor), o escritor comprime cada frame na ordem
+de envio; trechos de arquivos já comprimidos vão sem compressão, por sendfile
+
+Frames consecutivos na fila saem juntos em uma só chamada (sendmsg/writev no
+modo thread, writelines no asyncio). O escritor espera até `batch_delay` segundos
+para o lote crescer, ou menos se ele já somar `batch_bytes`
+"""
+
+import os
+import mmap
+import errno
+import socket
+import threading
+import time
+from collections import deque
+
+import metrics
+from protocol import CODEC_JSON, FrameCompressor
+
+# Políticas quando a fila está cheia
+POLICY_DROP = 'drop'              # descarta o frame novo
+POLICY_DISCONNECT = 'disconnect'  # derruba o cliente lento
+POLICY_BLOCK = 'block'            # espera espaço até o timeout, depois descarta
+POLICIES = (POLICY_DROP, POLICY_DISCONNECT, POLICY_BLOCK)
+
+DEFAULT_MAX_FRAMES = 1024
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TIMEOUT = 5.0
+
+# Agrupamento de frames em uma só chamada de envio
+DEFAULT_BATCH_DELAY = 0.001  # segundos que o primeiro frame do lote pode esperar
+DEFAULT_BATCH_BYTES = 64 * 1024  # lote com esse tamanho sai sem esperar
+MAX_BATCH_FRAMES = 512  # abaixo do IOV_MAX (1024 no Linux) aceito pelo sendmsg
+
+# Erros do sendfile que indicam falta de suporte (usa-se então mmap + memoryview)
+SENDFILE_UNSUPPORTED = {errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP}
+
+class FileRegion:
+    """Trecho de um arquivo aberto a ser enviado sem cópia para o heap do Python.
+    O cabeçalho vai antes do trecho: juntos formam um frame"""
+    
+    def __init__(self, file, offset: int, count: int, header: bytes = b'', compressible: bool = False):
+        self.file = file
+        self.offset = offset
+        self.count = count
+        self.header = header
+        self.compressible = compressible  # False para arquivos já comprimidos (zip, jpg...)
+    
+    def __len__(self):
+        return self.count
+    
+    def frame(self) -> bytes:
+        """Frame inteiro em memória (para comprimir ou repassar a outro servidor)"""
+        return self.header + self.view()
+    
+    def view(self) -> memoryview:
+        """Fatia do arquivo mapeado em memória (o mapa é liberado junto com a fatia)"""
+        mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped)[self.offset:self.offset + self.count]
+    
+    def send(self, sock: socket.socket):
+        """Envia o trecho por um socket bloqueante: os.sendfile ou, sem suporte, mmap"""
+        if self.header:
+            sock.sendall(self.header)
+        offset, remaining = self.offset, self.count
+        try:
+            while remaining:
+                sent = os.sendfile(sock.fileno(), self.file.fileno(), offset, remaining)
+                if not sent:
+                    raise OSError(errno.EIO, 'Arquivo menor que o trecho a enviar')
+                offset += sent
+                remaining -= sent
+        except (AttributeError, OSError) as e:
+            unsupported = isinstance(e, AttributeError) or e.errno in SENDFILE_UNSUPPORTED
+            if not unsupported or offset != self.offset:
+                raise
+            sock.sendall(self.view())
+
+def compress(compressor: FrameCompressor, frame: bytes) -> bytes:
+    """Frame comprimido, ou o próprio frame se a conexão não negociou compressão"""
+    return frame if compressor is None else compressor.compress(frame)
+
+def send_frames(sock: socket.socket, frames: list) -> int:
+    """Envia vários frames por um socket bloqueante com sendmsg (writev), retomando
+    envios parciais. Retorna o número de chamadas feitas"""
+    if not hasattr(sock, 'sendmsg'):  # Windows: junta os frames em um buffer só
+        sock.sendall(b''.join(frames))
+        return 1
+    
+    calls = 0
+    start = 0
+    while start < len(frames):
+        sent = sock.sendmsg(frames[start:start + MAX_BATCH_FRAMES])
+        calls += 1
+        # Pula os frames já enviados; o último pode ter ido só em parte
+        while start < len(frames) and sent >= len(frames[start]):
+            sent -= len(frames[start])
+            start += 1
+        if sent:
+            frames[start] = memoryview(frames[start])[sent:]
+    return calls
+
+class Session:
+    """Estado da conexão, guardado na própria fila de saída (que é o que fica em
+    `clients`): usuário, codec e compressão negociados, atividade para o heartbeat
+    e contadores de envio. Com __slots__, sem um dict de atributos por conexão"""
+    
+    __slots__ = ('username', 'codec', 'compressor', 'last_seen', 'pinged', 'closed', 'dropped', 'sent', 'writes')
+    
+    def __init__(self):
+        self.username = None  # usuário da conexão, definido no login
+        self.codec = CODEC_JSON  # codec do payload, negociado no login
+        self.compressor: FrameCompressor = None  # compressão negociada no login (usada só por quem envia)
+        self.last_seen = time.monotonic()  # último dado recebido (heartbeat do servidor)
+        self.pinged = 0.0  # quando o último ping foi enviado
+        self.closed = False
+        self.dropped = 0
+        self.sent = 0  # frames enviados
+        self.writes = 0  # chamadas de envio ao socket
+
+class OutboundQueue(Session):
+    """Fila de saída limitada de um socket, drenada por uma thread escritora"""
+    
+    __slots__ = ('sock', 'max_frames', 'max_bytes', 'policy', 'timeout', 'batch_delay', 'batch_bytes',
+                 '_frames', '_bytes', '_cond', '_writer')
+    
+    def __init__(self, sock: socket.socket, max_frames=DEFAULT_MAX_FRAMES, policy=POLICY_BLOCK,
+                 timeout=DEFAULT_TIMEOUT, max_bytes=DEFAULT_MAX_BYTES,
+                 batch_delay=DEFAULT_BATCH_DELAY, batch_bytes=DEFAULT_BATCH_BYTES):
+        if policy not in POLICIES:
+            raise ValueError(f'Política de fila desconhecida: {policy}')
+        super().__init__()
+        self.sock = sock
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.timeout = timeout
+        self.batch_delay = batch_delay
+        self.batch_bytes = batch_bytes
+        self._frames = deque()
+        self._bytes = 0
+        self._cond = threading.Condition()
+        
+        self._writer = threading.Thread(target=self._drain)
+        self._writer.daemon = True
+        self._writer.start()
+    
+    def _full(self, size: int) -> bool:
+        return len(self._frames) >= self.max_frames or (bool(self._frames) and self._bytes + size > self.max_bytes)
+    
+    def put(self, frame: bytes, block: bool = True) -> bool:
+        """Enfileira um frame. Retorna False se ele foi descartado (com block=False,
+        descarta em vez de esperar espaço mesmo na política 'block')"""
+        with self._cond:
+            if self.closed:
+                return False
+            
+            if self._full(len(frame)):
+                if self.policy == POLICY_DISCONNECT:
+                    self._close_locked()
+                    return False
+                if self.policy == POLICY_BLOCK and block:
+                    self._cond.wait_for(lambda: self.closed or not self._full(len(frame)), self.timeout)
+                if self.closed or self._full(len(frame)):
+                    self.dropped += 1
+                    return False
+            
+            self._frames.append(frame)
+            self._bytes += len(frame)
+            self._cond.notify_all()
+            return True
+    
+    def depth(self) -> int:
+        """Quantidade de frames aguardando envio"""
+        return len(self._frames)
+    
+    def stats(self) -> dict:
+        """Estado atual da fila (e da compressão, se negociada)"""
+        with self._cond:
+            stats = {'depth': len(self._frames), 'bytes': self._bytes, 'dropped': self.dropped,
+                     'sent': self.sent, 'writes': self.writes}
+        if self.compressor is not None:
+            stats['compression'] = self.compressor.stats()
+        return stats
+    
+    def close(self):
+        """Fecha a fila e descarta o que ainda não foi enviado"""
+        with self._cond:
+            self._close_locked()
+    
+    def _close_locked(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._frames.clear()
+        self._bytes = 0
+        self._cond.notify_all()
+        # Acorda a thread de leitura do cliente para que ele seja removido
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def _batch_ready(self) -> bool:
+        return (self.closed or self._bytes >= self.batch_bytes
+                or len(self._frames) >= min(MAX_BATCH_FRAMES, self.max_frames))
+    
+    def _take_batch(self) -> list:
+        """Retira da fila um stream ou uma sequência de frames a enviar juntos"""
+        batch = [self._frames.popleft()]
+        size = len(batch[0])
+        if isinstance(batch[0], bytes):
+            while (self._frames and isinstance(self._frames[0], bytes)
+                   and size < self.batch_bytes and len(batch) < MAX_BATCH_FRAMES):
+                batch.append(self._frames.popleft())
+                size += len(batch[-1])
+        self._bytes -= size
+        return batch
+    
+    def _drain(self):
+        """Thread escritora: envia os frames enfileirados em ordem, em lotes"""
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.closed or self._frames)
+                if not self.closed and self.batch_delay > 0 and isinstance(self._frames[0], bytes):
+                    # Dá um tempo para mais frames chegarem e irem na mesma chamada
+                    self._cond.wait_for(self._batch_ready, self.batch_delay)
+                if self.closed:
+                    return
+                batch = self._take_batch()
+                self._cond.notify_all()
+            
+            try:
+                if isinstance(batch[0], bytes):
+                    frames = [compress(self.compressor, frame) for frame in batch]
+                    size = sum(map(len, frames))
+                    self.writes += send_frames(self.sock, frames)
+                    self.sent += len(batch)
+                    metrics.count('bytes_sent_total', '', size)
+                else:
+                    for stream_frame in batch[0].frames():
+                        if self.closed:
+                            break
+                        if isinstance(stream_frame, FileRegion):
+                            if self.compressor is not None and stream_frame.compressible:
+                                data = self.compressor.compress(stream_frame.frame())
+                                self.sock.sendall(data)
+                                size = len(data)
+                            else:
+                                stream_frame.send(self.sock)
+                                size = len(stream_frame.header) + stream_frame.count
+                        else:
+                            data = compress(self.compressor, stream_frame)
+                            self.sock.sendall(data)
+                            size = len(data)
+                        self.writes += 1
+                        self.sent += 1
+                        metrics.count('bytes_sent_total', '', size)
+            except OSError:
+                self.close()
+                return
+
+class TransportQueue(Session):
+    """Fila de saída limitada sobre um transporte asyncio.
+    
+    Os frames vão direto para o transporte enquanto ele aceita escrita; quando o
+    transporte pede pausa (pause_writing), ficam na fila até resume_writing. O
+    loop de eventos não pode bloquear, então na política 'block' a fila pode
+    exceder o limite por até `timeout` segundos antes de o cliente ser derrubado.
+    
+    A fila pertence à thread do loop; um put() vindo de outra thread (ex.: uma
+    mensagem repassada por outro servidor do cluster) é agendado no loop.
+    
+    Os frames esperam até `batch_delay` segundos (ou até somarem `batch_bytes`)
+    e vão juntos em um transport.writelines, que é um só envio ao socket. Com
+    batch_delay 0 cada frame é escrito na hora (só se agrupa o que estava pausado).
+    """
+    
+    __slots__ = ('transport', 'max_frames', 'max_bytes', 'policy', 'timeout', 'batch_delay', 'batch_bytes',
+                 '_loop', '_thread', '_frames', '_bytes', '_paused', '_overflow_timer', '_flush_handle',
+                 '_stream', '_region_task', '_sendfile')
+    
+    def __init__(self, transport, max_frames=DEFAULT_MAX_FRAMES, policy=POLICY_BLOCK,
+                 timeout=DEFAULT_TIMEOUT, max_bytes=DEFAULT_MAX_BYTES, loop=None,
+                 batch_delay=DEFAULT_BATCH_DELAY, batch_bytes=DEFAULT_BATCH_BYTES):
+        if policy not in POLICIES:
+            raise ValueError(f'Política de fila desconhecida: {policy}')
+        super().__init__()
+        self.transport = transport
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.timeout = timeout
+        self.batch_delay = batch_delay
+        self.batch_bytes = batch_bytes
+        self._loop = loop
+        self._thread = threading.get_ident()  # thread do loop (a que criou a fila)
+        self._frames = deque()
+        self._bytes = 0
+        self._paused = False
+        self._overflow_timer = None
+        self._flush_handle = None  # envio do lote agendado
+        self._stream = None  # gerador do stream sendo enviado
+        self._region_task = None  # envio de um FileRegion em andamento (loop.sendfile)
+        self._sendfile = True  # desligado se o transporte não suportar sendfile
+    
+    def _full(self, size: int) -> bool:
+        return len(self._frames) >= self.max_frames or (bool(self._frames) and self._bytes + size > self.max_bytes)
+    
+    def put(self, frame: bytes, block: bool = True) -> bool:
+        """Enfileira um frame. Retorna False se ele foi descartado (o loop nunca
+        espera espaço, então `block` não muda nada aqui)"""
+        if self.closed:
+            return False
+        if threading.get_ident() != self._thread:
+            self._loop.call_soon_threadsafe(self.put, frame)
+            return True
+        
+        if self._full(len(frame)):
+            if self.policy == POLICY_DROP:
+                self.dropped += 1
+                return False
+            if self.policy == POLICY_DISCONNECT:
+                self.close()
+                return False
+            if self._overflow_timer is None:
+                self._overflow_timer = self._loop.call_later(self.timeout, self._overflow_expired)
+        
+        self._frames.append(frame)
+        self._bytes += len(frame)
+        if self._paused:
+            return True
+        if (self.batch_delay <= 0 or not isinstance(frame, bytes) or self._bytes >= self.batch_bytes
+                or len(self._frames) >= MAX_BATCH_FRAMES):
+            self._flush()
+        elif self._flush_handle is None:
+            # Espera mais frames para o lote
+            self._flush_handle = self._loop.call_later(self.batch_delay, self._flush)
+        return True
+    
+    def depth(self) -> int:
+        """Quantidade de frames aguardando envio"""
+        return len(self._frames)
+    
+    def stats(self) -> dict:
+        """Estado atual da fila (e da compressão, se negociada)"""
+        stats = {'depth': len(self._frames), 'bytes': self._bytes, 'dropped': self.dropped,
+                 'sent': self.sent, 'writes': self.writes}
+        if self.compressor is not None:
+            stats['compression'] = self.compressor.stats()
+        return stats
+    
+    def pause_writing(self):
+        self._paused = True
+    
+    def resume_writing(self):
+        self._paused = False
+        self._flush()
+    
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        
+        # transport.write pode chamar pause_writing no meio do laço
+        while self._frames and not self._paused and self._region_task is None:
+            item = self._frames[0]
+            if isinstance(item, bytes):
+                # Frames consecutivos vão em uma só escrita
+                batch = []
+                while self._frames and isinstance(self._frames[0], bytes) and len(batch) < MAX_BATCH_FRAMES:
+                    frame = self._frames.popleft()
+                    self._bytes -= len(frame)
+                    batch.append(compress(self.compressor, frame))
+                self.transport.writelines(batch)
+                self.writes += 1
+                self.sent += len(batch)
+                metrics.count('bytes_sent_total', '', sum(map(len, batch)))
+                continue
+            
+            # Stream: gera frames até o transporte pedir pausa ou o stream acabar
+            if self._stream is None:
+                self._stream = item.frames()
+            for frame in self._stream:
+                if isinstance(frame, FileRegion):
+                    if self.compressor is not None and frame.compressible:
+                        data = self.compressor.compress(frame.frame())
+                        self.transport.write(data)
+                        self.writes += 1
+                        self.sent += 1
+                        metrics.count('bytes_sent_total', '', len(data))
+                        if self._paused:
+                            break
+                        continue
+                    # O trecho de arquivo é enviado por uma tarefa; ela retoma o flush ao terminar
+                    self._region_task = self._loop.create_task(self._send_region(frame))
+                    break
+                data = compress(self.compressor, frame)
+                self.transport.write(data)
+                self.writes += 1
+                self.sent += 1
+                metrics.count('bytes_sent_total', '', len(data))
+                if self._paused:
+                    break
+            else:
+                self._stream = None
+            if self._stream is not None:
+                return
+            self._frames.popleft()
+            self._bytes -= len(item)
+        
+        if self._overflow_timer is not None and not self._full(0):
+            self._overflow_timer.cancel()
+            self._overflow_timer = None
+    
+    async def _send_region(self, region: FileRegion):
+        try:
+            self.transport.write(region.header)
+            self.writes += 1
+            self.sent += 1
+            metrics.count('bytes_sent_total', '', len(region.header) + region.count)
+            if self._sendfile:
+                try:
+                    await self._loop.sendfile(self.transport, region.file, region.offset, region.count,
+                                              fallback=False)
+                    return
+                except RuntimeError:
+                    # Inclui SendfileNotAvailableError: o transporte não suporta sendfile
+                    if self.transport.is_closing():
+                        raise ConnectionError('Transporte fechado')
+                    self._sendfile = False
+            self.transport.write(region.view())
+        except (OSError, ConnectionError):
+            self.close()
+        finally:
+            self._region_task = None
+            if not self.closed:
+                self._flush()
+    
+    def _overflow_expired(self):
+        self._overflow_timer = None
+        if self._full(0):
+            self.close()
+    
+    def close(self):
+        """Fecha a fila e derruba a conexão"""
+        if self.closed:
+            return
+        self.closed = True
+        self._frames.clear()
+        self._bytes = 0
+        self._stream = None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._region_task is not None:
+            self._region_task.cancel()
+            self._region_task = None
+        if self._overflow_timer is not None:
+            self._overflow_timer.cancel()
+            self._overflow_timer = None
+        self.transport.abort()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Protocolo de comunicação do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Enquadramento (framing) das mensagens: cabeçalho de 4 bytes com o tamanho + payload
+O payload é JSON ou, se negociado no login, o codec binário (codec.py); também
+negociada no login, a compressão zlib é marcada frame a frame no cabeçalho
+"""
+
+import json
+import time
+import zlib
+import struct
+
+import codec
+import tracing
+
+# Cabeçalho: tamanho do payload em 4 bytes (big-endian, sem sinal)
+HEADER = struct.Struct('!I')
+HEADER_SIZE = HEADER.size
+
+# Limite de segurança para um único frame
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# Tamanho inicial do buffer de recepção
+RECV_BUFFER_SIZE = 64 * 1024
+
+# Bit do cabeçalho que marca um payload comprimido (o tamanho usa os outros 31 bits)
+COMPRESSED_FLAG = 0x80000000
+
+# Compressão por conexão: um contexto zlib por sentido, compartilhado por todos os frames.
+# Janela de 8 KB e memLevel 6: ~64 KB por conexão em vez dos ~256 KB do padrão
+COMPRESSION_ZLIB = 'zlib'
+COMPRESSION_LEVEL = 6
+COMPRESSION_WBITS = 13
+COMPRESSION_MEM_LEVEL = 6
+
+# Codecs do payload, em ordem de preferência; JSON é o padrão e o fallback
+CODEC_BINARY = 'binary'
+CODEC_JSON = 'json'
+CODECS = (CODEC_BINARY, CODEC_JSON)
+
+class FrameError(Exception):
+    """Frame inválido recebido (ex.: tamanho acima do limite)"""
+
+class FrameCompressor:
+    """Compressão de um sentido da conexão (quem envia).
+    
+    Cada frame é comprimido no mesmo contexto zlib (as chaves e textos repetidos
+    de um frame servem de dicionário para os seguintes) e terminado com
+    Z_SYNC_FLUSH, para que o receptor o descomprima sem esperar o próximo. Os
+    frames têm de ser comprimidos na ordem em que vão para o socket.
+    """
+    
+    def __init__(self, level: int = COMPRESSION_LEVEL):
+        self._deflater = zlib.compressobj(level, zlib.DEFLATED, -COMPRESSION_WBITS, COMPRESSION_MEM_LEVEL)
+        self.frames = 0
+        self.bytes_in = 0   # bytes dos frames antes da compressão
+        self.bytes_out = 0  # bytes enviados
+        self.cpu = 0.0      # segundos de CPU gastos comprimindo
+    
+    def compress(self, frame) -> bytes:
+        """Frame comprimido (cabeçalho com COMPRESSED_FLAG) a partir de um frame completo"""
+        start = time.thread_time()
+        payload = self._deflater.compress(memoryview(frame)[HEADER_SIZE:]) + self._deflater.flush(zlib.Z_SYNC_FLUSH)
+        self.cpu += time.thread_time() - start
+        compressed = HEADER.pack(len(payload) | COMPRESSED_FLAG) + payload
+        self.frames += 1
+        self.bytes_in += len(frame)
+        self.bytes_out += len(compressed)
+        return compressed
+    
+    def stats(self) -> dict:
+        """Contadores da compressão (ratio: bytes enviados / bytes originais)"""
+        return {
+            'frames': self.frames,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+            'cpu_ms': round(self.cpu * 1000, 1)
+        }
+
+def encode_frame(payload: bytes) -> bytes:
+    """Monta um frame: cabeçalho de tamanho seguido do payload"""
+    return HEADER.pack(len(payload)) + payload
+
+def encode_message(message: dict, codec_name: str = CODEC_JSON) -> bytes:
+    """Serializa uma mensagem (em JSON ou no codec binário) e a enquadra"""
+    if codec_name == CODEC_BINARY:
+        return encode_frame(codec.pack(message))
+    return encode_frame(json.dumps(message).encode('utf-8'))
+
+def decode_message(frame) -> dict:
+    """Desserializa o payload de um frame (bytes ou memoryview). O codec é reconhecido
+    pelo primeiro byte: um objeto JSON começa com '{', um mapa binário nunca"""
+    if frame[:1] == b'{':
+        return json.loads(str(frame, 'utf-8'))
+    return codec.unpack(frame)
+
+def negotiate_codec(offered) -> str:
+    """Primeiro codec oferecido pelo cliente que o servidor conhece (JSON se nenhum)"""
+    for codec_name in offered or ():
+        if codec_name in CODECS:
+            return codec_name
+    return CODEC_JSON
+
+def encode_cached(message: dict, codec_name: str, frames: dict) -> bytes:
+    """Frame da mensagem no codec pedido, serializado uma única vez por codec
+    (`frames` guarda codec -> frame durante um mesmo envio)"""
+    frame = frames.get(codec_name)
+    if frame is None:
+        trace = tracing.current()
+        if trace is None:
+            frame = frames[codec_name] = encode_message(message, codec_name)
+        else:
+            with trace.span('encode'):
+                frame = frames[codec_name] = encode_message(message, codec_name)
+    return frame
+
+def recode_frame(frame: bytes, codec_name: str) -> bytes:
+    """Frame JSON (vindo de outro processo) no codec da conexão de destino"""
+    if codec_name == CODEC_JSON:
+        return frame
+    return encode_message(decode_message(memoryview(frame)[HEADER_SIZE:]), codec_name)
+
+class FrameDecoder:
+    """Decodificador incremental de frames sobre um buffer de recepção reutilizável.
+    
+    Os dados são lidos diretamente para o buffer (recv_into) e os frames são
+    devolvidos como fatias memoryview, sem copiar o buffer a cada frame. Uma
+    fatia só é válida até a próxima chamada de recv_into/feed. Frames com
+    COMPRESSED_FLAG são descomprimidos (em bytes) no contexto zlib da conexão.
+    """
+    
+    __slots__ = ('max_frame_size', '_buffer', '_view', '_start', '_end', '_missing', '_inflater')
+    
+    def __init__(self, buffer_size: int = RECV_BUFFER_SIZE, max_frame_size: int = MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # início dos dados ainda não consumidos
+        self._end = 0    # fim dos dados válidos no buffer
+        self._missing = 0  # bytes que faltam para completar o frame atual
+        self._inflater = None  # criado no primeiro frame comprimido
+    
+    def _reserve(self, size: int):
+        """Garante pelo menos `size` bytes livres no final do buffer"""
+        pending = self._end - self._start
+        if pending == 0:
+            self._start = self._end = 0
+        if len(self._buffer) - self._end >= size:
+            return
+        
+        if pending + size <= len(self._buffer):
+            # Compacta: move o frame parcial para o início (uma cópia por leitura)
+            self._view[:pending] = self._view[self._start:self._end]
+        else:
+            # Cresce o buffer para caber o frame parcial + nova leitura
+            new_buffer = bytearray(max(len(self._buffer) * 2, pending + size))
+            new_buffer[:pending] = self._view[self._start:self._end]
+            self._buffer = new_buffer
+            self._view = memoryview(new_buffer)
+        self._start, self._end = 0, pending
+    
+    def recv_into(self, sock) -> int:
+        """Lê do socket diretamente para o buffer. Retorna 0 se a conexão fechou"""
+        self._reserve(max(RECV_BUFFER_SIZE // 4, self._missing))
+        received = sock.recv_into(self._view[self._end:])
+        self._end += received
+        return received
+    
+    def feed(self, data: bytes):
+        """Acrescenta bytes já recebidos (ex.: vindos de um transporte asyncio)"""
+        self._reserve(len(data))
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
+    
+    def release(self):
+        """Libera a memória do buffer quando não há frame parcial pendente"""
+        if self._start == self._end and self._buffer:
+            self._buffer = bytearray()
+            self._view = memoryview(self._buffer)
+            self._start = self._end = self._missing = 0
+    
+    def frames(self):
+        """Gera todos os frames completos disponíveis no buffer"""
+        while True:
+            available = self._end - self._start
+            if available < HEADER_SIZE:
+                return
+            
+            (length,) = HEADER.unpack_from(self._buffer, self._start)
+            compressed = length & COMPRESSED_FLAG
+            length &= ~COMPRESSED_FLAG
+            if length > self.max_frame_size:
+                raise FrameError(f'Frame de {length} bytes excede o limite de {self.max_frame_size}')
+            
+            if available < HEADER_SIZE + length:
+                # Frame incompleto: a próxima leitura reserva espaço para ele inteiro
+                self._missing = HEADER_SIZE + length - available
+                return
+            
+            begin = self._start + HEADER_SIZE
+            self._start = begin + length
+            self._missing = 0
+            if compressed:
+                yield self._inflate(self._view[begin:self._start])
+            else:
+                yield self._view[begin:self._start]
+    
+    def _inflate(self, payload) -> bytes:
+        if self._inflater is None:
+            self._inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        try:
+            data = self._inflater.decompress(payload, self.max_frame_size)
+        except zlib.error as e:
+            raise FrameError(f'Frame comprimido inválido: {e}')
+        if self._inflater.unconsumed_tail:
+            raise FrameError(f'Frame descomprimido excede o limite de {self.max_frame_size}')
+        return data
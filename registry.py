@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Registros particionados do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Usuários e grupos são distribuídos em N faixas (stripes) pelo hash do nome, cada
+uma com seu próprio lock: operações sobre nomes de faixas diferentes não disputam lock
+
+Nomes de usuários e grupos são internados (uma única cópia de cada texto, por
+mais registros que o citem) e cada membro de grupo tem um ID inteiro; grupos
+grandes guardam os membros como um array ordenado desses IDs
+"""
+
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Set, Tuple
+
+# Número padrão de faixas de cada registro
+DEFAULT_STRIPES = 64
+
+# Acima deste número de membros o grupo troca o set de nomes pelo array de IDs
+LARGE_GROUP = 64
+
+class StripedDict:
+    """Dicionário dividido em faixas, cada uma protegida por um lock próprio.
+    
+    As operações simples (get, [], pop...) travam só a faixa da chave. Para uma
+    sequência atômica sobre uma chave use `with registro.lock(chave):`; o lock é
+    reentrante, então os métodos podem ser chamados dentro dele.
+    
+    Ordem dos locks no servidor (para não haver deadlock): faixa de groups ->
+    faixa de user_groups -> faixa de clients -> lock da caixa de entrada.
+    
+    As faixas são RLocks simples: toda operação de registro passa por elas, e
+    medir a espera (metrics.TimedLock) dobraria o custo de cada uma.
+    """
+    
+    def __init__(self, stripes: int = DEFAULT_STRIPES):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+        self._maps = [{} for _ in range(stripes)]
+    
+    def _stripe(self, key) -> int:
+        return hash(key) % len(self._maps)
+    
+    def lock(self, key) -> threading.RLock:
+        """Lock da faixa que contém a chave"""
+        return self._locks[self._stripe(key)]
+    
+    def get(self, key, default=None) -> Any:
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            return self._maps[stripe].get(key, default)
+    
+    def __getitem__(self, key) -> Any:
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            return self._maps[stripe][key]
+    
+    def __setitem__(self, key, value):
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            self._maps[stripe][key] = value
+    
+    def __contains__(self, key) -> bool:
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            return key in self._maps[stripe]
+    
+    def setdefault(self, key, default) -> Any:
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            return self._maps[stripe].setdefault(key, default)
+    
+    def pop(self, key, default=None) -> Any:
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            return self._maps[stripe].pop(key, default)
+    
+    def pop_if(self, key, value) -> bool:
+        """Remove a chave só se ela ainda aponta para `value` (o mesmo objeto)"""
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            if self._maps[stripe].get(key) is not value:
+                return False
+            del self._maps[stripe][key]
+            return True
+    
+    def items(self) -> List[Tuple[Any, Any]]:
+        """Cópia dos pares; cada faixa é travada só enquanto é copiada"""
+        pairs = []
+        for lock, mapping in zip(self._locks, self._maps):
+            with lock:
+                pairs.extend(mapping.items())
+        return pairs
+    
+    def keys(self) -> List[Any]:
+        return [key for key, _ in self.items()]
+    
+    def __len__(self) -> int:
+        return sum(len(mapping) for mapping in self._maps)
+
+class NameTable:
+    """Nomes de membros de grupos e o ID inteiro de cada um (a posição em `names`).
+    
+    Os IDs nunca são reaproveitados nem saem do processo, por isso só membros de
+    grupos entram na tabela: como os grupos só crescem, ela é limitada pelo número
+    de membros distintos, não por quantos nomes já fizeram login. Nomes de sessões
+    usam sys.intern, liberado quando o último registro que os cita sai.
+    """
+    
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        self._lock = threading.Lock()
+    
+    def id(self, name: str) -> int:
+        """ID do nome (criado no primeiro uso)"""
+        name_id = self.ids.get(name)
+        if name_id is None:
+            with self._lock:
+                name_id = self.ids.get(name)
+                if name_id is None:
+                    name = sys.intern(name)
+                    name_id = self.ids[name] = len(self.names)
+                    self.names.append(name)
+        return name_id
+    
+    def intern(self, name: str) -> str:
+        """A cópia única do nome (a mensagem recebida traz sempre um texto novo)"""
+        return self.names[self.id(name)]
+    
+    def __len__(self) -> int:
+        return len(self.names)
+
+NAMES = NameTable()
+
+class Group:
+    """Membros de um grupo. Até `LARGE_GROUP` membros, um set dos nomes internados;
+    acima disso, um array ordenado dos IDs (4 bytes por membro, contra ~30 do
+    set), com busca binária. Quem altera o grupo deve ter o lock da faixa dele.
+    
+    Para o fan-out, snapshot() devolve os membros num frozenset guardado até a
+    próxima alteração: mensagens seguidas ao mesmo grupo não copiam os membros
+    nem pagam a busca no array a cada envio"""
+    
+    __slots__ = ('name', 'members', 'ids', '_snapshot')
+    
+    def __init__(self, name: str, members: Iterable[str] = ()):
+        self.name = sys.intern(name)
+        self.members: Set[str] = set()  # grupos pequenos
+        self.ids: array = None  # grupos grandes (members fica None)
+        self._snapshot: FrozenSet[str] = None  # descartado a cada membro novo
+        self.update(members)
+    
+    def add(self, member: str) -> bool:
+        """Acrescenta um membro; False se ele já estava no grupo"""
+        if self.ids is None:
+            if member in self.members:
+                return False
+            self.members.add(NAMES.intern(member))
+            self._snapshot = None
+            if len(self.members) > LARGE_GROUP:
+                self.compact()
+            return True
+        member_id = NAMES.id(member)
+        index = bisect_left(self.ids, member_id)
+        if index < len(self.ids) and self.ids[index] == member_id:
+            return False
+        self.ids.insert(index, member_id)
+        self._snapshot = None
+        return True
+    
+    def update(self, members: Iterable[str]):
+        for member in members:
+            self.add(member)
+    
+    def snapshot(self) -> FrozenSet[str]:
+        """Membros atuais num conjunto imutável, compartilhado até a próxima alteração"""
+        if self._snapshot is None:
+            self._snapshot = frozenset(self)
+        return self._snapshot
+    
+    def compact(self):
+        """Troca o set de nomes pelo array ordenado de IDs"""
+        self.ids = array('I', sorted(NAMES.id(member) for member in self.members))
+        self.members = None
+    
+    def __contains__(self, member: str) -> bool:
+        if self.ids is None:
+            return member in self.members
+        member_id = NAMES.ids.get(member)
+        if member_id is None:
+            return False
+        index = bisect_left(self.ids, member_id)
+        return index < len(self.ids) and self.ids[index] == member_id
+    
+    def __len__(self) -> int:
+        return len(self.members) if self.ids is None else len(self.ids)
+    
+    def __iter__(self) -> Iterator[str]:
+        if self.ids is None:
+            return iter(self.members)
+        return map(NAMES.names.__getitem__, self.ids)
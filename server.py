@@ -4,36 +4,291 @@ Servidor do Chat Distribuído - Trabalho de Sistemas Distribuídos
 Implementação de um servidor de chat estilo WhatsApp usando sockets TCP
 """
 
+import sys
 import socket
 import threading
-import json
+import asyncio
+import argparse
 import os
+import time
 import base64
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Set
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+try:
+    import resource  # indisponível no Windows
+except ImportError:
+    resource = None
+
+from protocol import FrameDecoder, FrameError, FrameCompressor, COMPRESSION_ZLIB, encode_message, decode_message, \
+    encode_cached, negotiate_codec
+from outbound import (OutboundQueue, TransportQueue, POLICIES, POLICY_BLOCK,
+                      DEFAULT_BATCH_BYTES, DEFAULT_BATCH_DELAY)
+from transfer import FileTransfer, FileStream, expire_partials, is_compressible
+from filestore import BlobStore
+from journal import GroupJournal
+from inbox import OfflineInbox
+from history import HistoryStore, private_conversation, group_conversation
+from registry import StripedDict, Group, NAMES, DEFAULT_STRIPES
+from admin import AdminServer, ADMIN_HOST
+from codec import TYPE_CODES
+import dispatch
+from dispatch import handles
+from timerwheel import TimerWheel
+import metrics
+import tracing
+from workers import WorkerMixin, HubMixin, run_workers
+from cluster import ClusterMixin, parse_cluster
+
+# Máximo de mensagens devolvidas por um pedido de histórico
+HISTORY_MAX_LIMIT = 500
+
+# Threads do servidor assíncrono para as mensagens que esperam outro nó ou processo
+BLOCKING_THREADS = 32
+
+# Respostas constantes, serializadas uma única vez por codec
+INVALID_FORMAT = dispatch.constant({'type': 'error', 'message': 'Formato de mensagem inválido'})
+UNKNOWN_TYPE = dispatch.constant({'type': 'error', 'message': 'Tipo de mensagem não reconhecido'})
+PONG = dispatch.constant({'type': 'pong'})
+MESSAGE_SENT = dispatch.constant({
+    'type': 'message_response',
+    'status': 'success',
+    'message': 'Mensagem enviada com sucesso'
+})
 
 class ChatServer:
-    def __init__(self, host='localhost', port=12345):
+    # Porta de administração = --admin-port + admin_offset (cada worker usa a sua)
+    admin_offset = 0
+    
+    # Modo multiprocesso (workers.py): vários processos escutam na mesma porta e
+    # compartilham os arquivos do servidor
+    reuse_port = False
+    shared_files = False
+    
+    def __init__(self, host='localhost', port=12345, backlog=10,
+                 queue_size=1024, queue_policy=POLICY_BLOCK, queue_timeout=5.0,
+                 batch_delay=DEFAULT_BATCH_DELAY, batch_bytes=DEFAULT_BATCH_BYTES,
+                 file_retention=None, gc_interval=300.0, upload_ttl=86400.0,
+                 inbox_size=1000, inbox_ttl=604800.0, lock_stripes=DEFAULT_STRIPES, data_dir='server_files',
+                 compression=True, admin_port=None, heartbeat_interval=30.0, idle_timeout=90.0):
         self.host = host
         self.port = port
-        self.clients: Dict[str, socket.socket] = {}  # username -> socket
-        self.groups: Dict[str, Set[str]] = {}  # group_name -> set of usernames
-        self.client_lock = threading.Lock()
-        self.group_lock = threading.Lock()
+        self.backlog = backlog
+        # Registros particionados: cada faixa tem seu lock (ver registry.py para a ordem dos locks)
+        self.clients = StripedDict(lock_stripes)  # username -> fila de saída
+        self.groups = StripedDict(lock_stripes)  # group_name -> Group (membros)
+        self.user_groups = StripedDict(lock_stripes)  # username -> grupos do usuário (índice reverso de groups)
+        self.transfers: Dict[str, FileTransfer] = {}  # transfer_id -> upload em andamento
+        self.transfer_lock = metrics.TimedLock('transfers', threading.Lock())
+        
+        # Configuração das filas de saída por cliente
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.queue_timeout = queue_timeout
+        self.batch_delay = batch_delay  # espera máxima para agrupar frames em um envio
+        self.batch_bytes = batch_bytes  # tamanho de lote que sai sem esperar
+        self.compression = compression  # aceita compressão zlib se o cliente pedir
+        self.admin_port = admin_port  # porta de administração (métricas); None desliga
+        self.admin: Optional[AdminServer] = None
+        
+        # Heartbeat: ping após `heartbeat_interval` s sem receber nada, conexão derrubada
+        # após `idle_timeout` s. Um prazo por conexão na roda de temporizadores
+        self.heartbeat_interval = heartbeat_interval  # 0 desliga
+        self.idle_timeout = max(idle_timeout, heartbeat_interval)
+        self.timers = TimerWheel()
         
-        # Diretório para arquivos
-        self.files_dir = "server_files"
+        # Tipo de mensagem -> handler (métodos marcados com @handles)
+        self.routes = dispatch.bind(self)
+        
+        # Diretório para arquivos (repositório deduplicado por conteúdo)
+        self.files_dir = data_dir
         if not os.path.exists(self.files_dir):
-            os.makedirs(self.files_dir)
+            os.makedirs(self.files_dir, exist_ok=True)
+        self.store = BlobStore(self.files_dir, retention=file_retention, shared=self.shared_files)
+        
+        # Grupos persistidos: snapshot + log de operações
+        self.load_groups()
+        
+        # Mensagens guardadas para usuários desconectados
+        self.inbox = self.open_inbox(inbox_size, inbox_ttl)
+        
+        # Histórico de cada conversa (privada ou de grupo)
+        self.history = HistoryStore(self.files_dir, shared=self.shared_files)
+        self.gc_interval = gc_interval
+        self.upload_ttl = upload_ttl  # segundos que um upload suspenso aguarda retomada
+    
+    def load_groups(self):
+        """Restaura os grupos do snapshot e do log de operações"""
+        self.journal = GroupJournal(self.files_dir)
+        for group_name, members in self.journal.load().items():
+            self.apply_group(group_name, members)
+        self.journal.start()
+        if self.groups:
+            print(f"[SERVIDOR] {len(self.groups)} grupo(s) restaurado(s) ({self.journal.replayed} operação(ões) reaplicada(s) do log)")
+    
+    def apply_group(self, group_name: str, members):
+        """Acrescenta membros a um grupo (criando-o) e atualiza o índice reverso"""
+        with self.groups.lock(group_name):
+            group = self.groups.get(group_name)
+            if group is None:
+                group = Group(group_name)
+                self.groups[group.name] = group
+            for member in members:
+                if group.add(member):
+                    with self.user_groups.lock(member):
+                        self.user_groups.setdefault(NAMES.intern(member), set()).add(group.name)
+    
+    def log_group_operation(self, operation: str, group_name: str, username: str):
+        """Grava uma operação sobre grupos no log (chamado sob o lock da faixa do grupo)"""
+        self.journal.append(operation, group=group_name, user=username)
+    
+    def open_inbox(self, inbox_size: int, inbox_ttl: float):
+        """Abre as caixas de entrada offline"""
+        return OfflineInbox(self.files_dir, max_messages=inbox_size, ttl=inbox_ttl)
+    
+    def close(self):
+        """Libera os recursos do servidor (grava o que falta do log de grupos)"""
+        self.close_admin()
+        self.journal.close()
+    
+    def start_admin(self):
+        """Abre a porta de administração local com as métricas (/metrics)"""
+        if self.admin_port is None:
+            return
+        port = self.admin_port + self.admin_offset
+        try:
+            self.admin = AdminServer(ADMIN_HOST, port)
+        except OSError as e:
+            print(f"[SERVIDOR] Porta de administração {port} indisponível: {e}")
+            return
+        
+        metrics.gauge('connected_users', lambda: len(self.local_connections()))
+        metrics.gauge('groups', lambda: len(self.groups))
+        metrics.gauge('queue_depth', lambda: {username: connection.depth()
+                                              for username, connection in self.local_connections()})
+        self.admin.route('/metrics', lambda query: (metrics.CONTENT_TYPE, metrics.render()))
+        self.admin.add_tracing_routes()
+        self.admin.start()
+        print(f"[SERVIDOR] Métricas em http://{ADMIN_HOST}:{port}/metrics (traces em /trace, profiler em /profile)")
+    
+    def close_admin(self):
+        if self.admin is not None:
+            self.admin.close()
+            self.admin = None
+    
+    def local_connections(self) -> List[Tuple[str, OutboundQueue]]:
+        """Usuários conectados a este processo e suas filas de saída"""
+        return self.clients.items()
+    
+    def run_in_server(self, callback, *args):
+        """Executa uma chamada vinda de outra thread no contexto dos handlers"""
+        callback(*args)
+    
+    def start_maintenance(self):
+        """Inicia a thread de manutenção (coleta de lixo e expiração de uploads e mensagens offline)"""
+        maintenance_thread = threading.Thread(target=self.maintenance_loop)
+        maintenance_thread.daemon = True
+        maintenance_thread.start()
+    
+    def maintenance_loop(self):
+        """Executa periodicamente as tarefas de manutenção"""
+        while True:
+            time.sleep(self.gc_interval)
+            try:
+                removed = self.store.gc()
+                if removed:
+                    print(f"[SERVIDOR] Coleta de lixo removeu {removed} arquivo(s) sem referência")
+            except Exception as e:
+                print(f"[SERVIDOR] Erro na coleta de lixo: {e}")
+            
+            try:
+                with self.transfer_lock:
+                    active = set(self.transfers)
+                expired = expire_partials(self.store.tmp_dir, self.upload_ttl, active)
+                if expired:
+                    print(f"[SERVIDOR] {expired} upload(s) suspenso(s) expirado(s)")
+            except Exception as e:
+                print(f"[SERVIDOR] Erro ao expirar uploads suspensos: {e}")
+            
+            try:
+                expired = self.inbox.expire()
+                if expired:
+                    print(f"[SERVIDOR] {expired} mensagem(ns) offline expirada(s)")
+            except Exception as e:
+                print(f"[SERVIDOR] Erro ao expirar mensagens offline: {e}")
+    
+    def start_heartbeat(self):
+        """Inicia a thread que avança a roda de temporizadores do heartbeat"""
+        if self.heartbeat_interval <= 0:
+            return
+        heartbeat_thread = threading.Thread(target=self.heartbeat_loop)
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+    
+    def heartbeat_loop(self):
+        """Um tick da roda por vez; só as conexões com prazo vencido são olhadas"""
+        while True:
+            time.sleep(self.timers.tick)
+            try:
+                self.run_in_server(self.heartbeat_tick)
+            except RuntimeError:  # loop de eventos já encerrado
+                return
+    
+    def heartbeat_tick(self):
+        now = time.monotonic()
+        for connection in self.timers.advance(now):
+            try:
+                self.check_idle(connection, now)
+            except Exception as e:
+                print(f"[SERVIDOR] Erro no heartbeat de {connection.username}: {e}")
+    
+    def track_idle(self, connection):
+        """Agenda o primeiro prazo de inatividade de uma nova conexão"""
+        if self.heartbeat_interval > 0:
+            self.timers.schedule(connection, self.heartbeat_interval)
+    
+    def check_idle(self, connection, now: float):
+        """Prazo de uma conexão venceu: reagenda, envia um ping ou derruba a conexão"""
+        if connection.closed:
+            return
+        # Receber dados só atualiza last_seen; o prazo é conferido aqui
+        idle = now - connection.last_seen
+        if idle >= self.idle_timeout:
+            self.reap(connection, idle)
+            return
+        if idle < self.heartbeat_interval:
+            self.timers.schedule(connection, self.heartbeat_interval - idle)
+            return
+        if connection.pinged <= connection.last_seen:
+            # Nenhum ping desde o último dado recebido; não espera espaço na fila
+            connection.pinged = now
+            connection.put(encode_message({'type': 'ping'}, connection.codec), block=False)
+        self.timers.schedule(connection, self.idle_timeout - idle)
+    
+    def reap(self, connection, idle: float):
+        """Derruba uma conexão inativa e libera na hora o nome e a fila do usuário"""
+        username, connection.username = connection.username, None
+        print(f"[SERVIDOR] {username or 'Conexão sem login'} sem resposta há {idle:.0f}s, desconectando")
+        metrics.count('reaped_total')
+        self.disconnect_client(username, connection)
+        connection.close()
     
     def start_server(self):
         """Inicia o servidor e aceita conexões"""
+        self.start_maintenance()
+        self.start_heartbeat()
+        self.start_admin()
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            # Cada worker tem seu socket na mesma porta; o kernel distribui as conexões
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         
         try:
             server_socket.bind((self.host, self.port))
-            server_socket.listen(10)
+            server_socket.listen(self.backlog)
             print(f"[SERVIDOR] Iniciado em {self.host}:{self.port}")
             print("[SERVIDOR] Aguardando conexões...")
             
@@ -55,173 +310,297 @@ class ChatServer:
             print(f"[SERVIDOR] Erro: {e}")
         finally:
             server_socket.close()
+            self.close()
+    
+    def send_to(self, connection: OutboundQueue, message: dict) -> bool:
+        """Enfileira uma mensagem na fila de saída da conexão (não bloqueia o fan-out)"""
+        trace = tracing.current()
+        if trace is None:
+            return connection.put(dispatch.encode_response(message, connection.codec))
+        with trace.span('encode'):
+            frame = dispatch.encode_response(message, connection.codec)
+        return connection.put(frame)
+    
+    def broadcast(self, connections: List[OutboundQueue], message: dict) -> int:
+        """Serializa a mensagem uma única vez (por codec) e compartilha o mesmo frame entre os
+        destinatários. Retorna quantos destinatários a receberam na fila"""
+        frames = {}
+        delivered_count = 0
+        for connection in connections:
+            if connection.put(encode_cached(message, connection.codec, frames)):
+                delivered_count += 1
+        return delivered_count
     
     def handle_client(self, client_socket: socket.socket, client_address):
         """Gerencia a comunicação com um cliente específico"""
         username = None
+        decoder = FrameDecoder()
+        queue = OutboundQueue(client_socket, self.queue_size, self.queue_policy, self.queue_timeout,
+                              batch_delay=self.batch_delay, batch_bytes=self.batch_bytes)
+        self.track_idle(queue)
         
         try:
             while True:
-                # Recebe dados do cliente
-                data = client_socket.recv(4096)
-                if not data:
+                # Recebe dados do cliente direto no buffer do decodificador
+                received = decoder.recv_into(client_socket)
+                if not received:
                     break
+                queue.last_seen = time.monotonic()
+                metrics.count('bytes_received_total', '', received)
                 
-                try:
-                    message = json.loads(data.decode('utf-8'))
-                    response = self.process_message(message, client_socket)
-                    
-                    # Se é uma mensagem de login, registra o cliente
-                    if message.get('type') == 'login' and response.get('status') == 'success':
-                        username = message['username']
-                        with self.client_lock:
-                            self.clients[username] = client_socket
-                        print(f"[SERVIDOR] Usuário {username} conectado")
-                    
-                    # Envia resposta para o cliente
-                    if response:
-                        client_socket.send(json.dumps(response).encode('utf-8'))
-                        
-                except json.JSONDecodeError:
-                    error_response = {
-                        'type': 'error',
-                        'message': 'Formato de mensagem inválido'
-                    }
-                    client_socket.send(json.dumps(error_response).encode('utf-8'))
+                # Um recv pode conter vários frames (ou só parte de um)
+                for frame in decoder.frames():
+                    username = self.handle_frame(frame, queue, username)
                     
         except ConnectionResetError:
             print(f"[SERVIDOR] Cliente {client_address} desconectou abruptamente")
+        except FrameError as e:
+            print(f"[SERVIDOR] Frame inválido de {client_address}: {e}")
         except Exception as e:
             print(f"[SERVIDOR] Erro com cliente {client_address}: {e}")
         finally:
-            # Remove cliente ao desconectar
-            if username:
-                with self.client_lock:
-                    if username in self.clients:
-                        del self.clients[username]
-                print(f"[SERVIDOR] Usuário {username} desconectado")
+            # queue.username é None se o heartbeat já derrubou a conexão
+            self.timers.cancel(queue)
+            self.disconnect_client(queue.username, queue)
+            queue.close()
             client_socket.close()
     
-    def process_message(self, message: dict, sender_socket: socket.socket) -> dict:
-        """Processa diferentes tipos de mensagens"""
-        msg_type = message.get('type')
-        
-        if msg_type == 'login':
-            return self.handle_login(message)
-        elif msg_type == 'private_message':
-            return self.handle_private_message(message)
-        elif msg_type == 'create_group':
-            return self.handle_create_group(message)
-        elif msg_type == 'group_message':
-            return self.handle_group_message(message)
-        elif msg_type == 'send_file':
-            return self.handle_send_file(message)
-        elif msg_type == 'list_users':
-            return self.handle_list_users()
-        elif msg_type == 'list_groups':
-            return self.handle_list_groups(message)
-        elif msg_type == 'add_member':
-            return self.handle_add_member(message)
-        elif msg_type == 'list_group_members':
-            return self.handle_list_group_members(message)
-        else:
-            return {
-                'type': 'error',
-                'message': 'Tipo de mensagem não reconhecido'
-            }
+    def handle_frame(self, frame, connection, username):
+        """Processa um frame recebido e retorna o usuário associado à conexão"""
+        trace = tracing.begin()  # None com o rastreamento desligado
+        message = self.decode_frame(frame, connection, username, trace)
+        if message is None:
+            return username
+        return self.handle_message(message, connection, username, trace)
     
-    def handle_login(self, message: dict) -> dict:
-        """Processa login do usuário"""
-        username = message.get('username', '').strip()
-        
-        if not username:
-            return {
-                'type': 'login_response',
-                'status': 'error',
-                'message': 'Nome de usuário não pode estar vazio'
-            }
+    def decode_frame(self, frame, connection, username, trace) -> Optional[dict]:
+        """Mensagem contida no frame (None se ela é inválida: o cliente já recebeu o erro)"""
+        try:
+            message = decode_message(frame)
+        except ValueError:  # JSON ou payload binário inválido
+            self.send_to(connection, INVALID_FORMAT)
+            tracing.finish(trace, 'invalido', username)
+            return None
+        if trace is not None:
+            trace.add('decode', trace.begin, time.perf_counter_ns())
+        return message
+    
+    def may_block(self, message: dict) -> bool:
+        """Se o handler da mensagem pode esperar por outro processo ou nó (o servidor
+        assíncrono executa essas mensagens fora do loop de eventos)"""
+        return False
+    
+    def handle_message(self, message: dict, connection, username, trace=None):
+        """Executa uma mensagem já decodificada e retorna o usuário associado à conexão"""
+        msg_type = message.get('type')
+        # Rótulo só com os tipos conhecidos (o cliente não cria séries novas nas métricas)
+        label = msg_type if isinstance(msg_type, str) and msg_type in TYPE_CODES else 'desconhecido'
+        start = time.perf_counter_ns()
+        response = self.process_message(message, connection)
+        end = time.perf_counter_ns()
+        metrics.observe('message_seconds', label, end - start)
+        if trace is not None:
+            trace.add('dispatch', start, end)
+        if response and response.get('status') == 'error':
+            metrics.count('errors_total', label)
         
-        with self.client_lock:
-            if username in self.clients:
-                return {
+        # Se é uma mensagem de login, registra o cliente
+        offline_messages = None
+        if msg_type == 'login' and response.get('status') == 'success':
+            # Nome internado: a mesma cópia serve a clients, grupos e caixas de entrada
+            login_name = sys.intern(message['username'])
+            offline_messages = self.register_client(login_name, connection)
+            if offline_messages is None:
+                # Outra conexão registrou o mesmo nome depois da verificação em handle_login
+                response = {
                     'type': 'login_response',
                     'status': 'error',
                     'message': 'Nome de usuário já em uso'
                 }
+            else:
+                username = connection.username = login_name
+                connection.codec = response['codec']
+                if response.get('compression'):
+                    connection.compressor = FrameCompressor()
+                print(f"[SERVIDOR] Usuário {username} conectado")
         
-        return {
+        # Envia resposta para o cliente
+        if response:
+            self.send_to(connection, response)
+        if offline_messages is not None:
+            self.deliver_inbox(username, connection, offline_messages)
+        tracing.finish(trace, label, username)
+        return username
+    
+    def register_client(self, username: str, connection):
+        """Registra a conexão do usuário e retira as mensagens guardadas enquanto ele
+        estava offline. Retorna None se o nome já está em uso"""
+        with self.clients.lock(username):
+            if username in self.clients:
+                return None
+            self.clients[username] = connection
+            # Sob o mesmo lock: nenhuma mensagem cai na caixa depois de ela ser esvaziada
+            self.inbox.register(username)
+            return self.inbox.take(username)
+    
+    def unregister_client(self, username: str, connection) -> bool:
+        """Remove o registro do usuário se `connection` ainda é a conexão atual dele"""
+        return self.clients.pop_if(username, connection)
+    
+    def deliver_inbox(self, username: str, connection: OutboundQueue, batches):
+        """Entrega em lotes as mensagens guardadas enquanto o usuário estava offline"""
+        delivered = 0
+        for batch in batches:
+            if not self.send_to(connection, {'type': 'offline_messages', 'messages': batch}):
+                # Fila cheia ou conexão caiu: o que não foi entregue volta para a caixa
+                for pending in (batch, *batches):
+                    for offline_message in pending:
+                        self.inbox.put(username, offline_message)
+                self.inbox.sync()
+                break
+            delivered += len(batch)
+        if delivered:
+            print(f"[SERVIDOR] {delivered} mensagem(ns) offline entregue(s) a {username}")
+    
+    def disconnect_client(self, username, connection):
+        """Remove o cliente ao desconectar"""
+        if username:
+            if not self.unregister_client(username, connection):
+                # Conexão antiga de um usuário que já entrou de novo: os uploads são da nova
+                print(f"[SERVIDOR] Conexão antiga de {username} encerrada")
+                return
+            
+            # Uploads interrompidos pela desconexão ficam suspensos até o cliente retomá-los
+            with self.transfer_lock:
+                pending = [transfer for transfer in self.transfers.values() if transfer.sender == username]
+                for transfer in pending:
+                    del self.transfers[transfer.transfer_id]
+            for transfer in pending:
+                try:
+                    transfer.suspend()
+                except OSError as e:
+                    print(f"[SERVIDOR] Erro ao suspender upload {transfer.transfer_id}: {e}")
+            print(f"[SERVIDOR] Usuário {username} desconectado")
+    
+    def queue_depths(self) -> Dict[str, int]:
+        """Profundidade da fila de saída de cada usuário conectado"""
+        connections = self.clients.items()
+        return {username: connection.depth() for username, connection in connections}
+    
+    def process_message(self, message: dict, sender_socket: socket.socket) -> dict:
+        """Encaminha a mensagem ao handler do seu tipo, depois de conferir os campos obrigatórios"""
+        try:
+            route = self.routes.get(message.get('type'))
+        except TypeError:  # tipo que nem pode ser chave (lista, dicionário)
+            route = None
+        if route is None:
+            return UNKNOWN_TYPE
+        
+        handler, check, arguments = route
+        if check is not None:
+            error_response = check(message)
+            if error_response is not None:
+                return error_response
+        if arguments == 1:
+            return handler(message)
+        if arguments == 2:
+            return handler(message, sender_socket)
+        return handler()
+    
+    @handles('ping')
+    def handle_ping(self) -> dict:
+        return PONG
+    
+    @handles('pong')
+    def handle_pong(self) -> None:
+        return None  # resposta a um ping do heartbeat (a chegada já conta como atividade)
+    
+    @handles('login', trimmed=('username',), response='login_response',
+             message='Nome de usuário não pode estar vazio')
+    def handle_login(self, message: dict) -> dict:
+        """Processa login do usuário"""
+        username = message['username'].strip()
+        
+        if username in self.clients:
+            return dispatch.error('login_response', 'Nome de usuário já em uso')
+        
+        # Codec das próximas mensagens para o cliente: o primeiro que ele oferece e o servidor conhece
+        response = {
             'type': 'login_response',
             'status': 'success',
-            'message': f'Bem-vindo, {username}!'
+            'message': f'Bem-vindo, {username}!',
+            'codec': negotiate_codec(message.get('codecs'))
         }
+        if self.compression and COMPRESSION_ZLIB in (message.get('compression') or ()):
+            response['compression'] = COMPRESSION_ZLIB
+        return response
     
+    @handles('private_message', 'sender', 'recipient', 'content', response='message_response',
+             message='Dados da mensagem incompletos')
     def handle_private_message(self, message: dict) -> dict:
         """Processa mensagem privada"""
-        sender = message.get('sender')
-        recipient = message.get('recipient')
-        content = message.get('content')
+        sender = message['sender']
+        recipient = message['recipient']
+        content = message['content']
         timestamp = datetime.now().strftime("%H:%M:%S")
         
-        if not all([sender, recipient, content]):
+        notification = {
+            'type': 'private_message_received',
+            'sender': sender,
+            'content': content,
+            'timestamp': timestamp
+        }
+        
+        with self.clients.lock(recipient):
+            recipient_queue = self.clients.get(recipient)
+            if recipient_queue is None:
+                # Destinatário offline: guarda na caixa de entrada (sob o lock, ver handle_frame)
+                if not self.inbox.known(recipient):
+                    return dispatch.error('message_response', 'Usuário destinatário não encontrado')
+                if self.inbox.full(recipient):
+                    return {
+                        'type': 'message_response',
+                        'status': 'error',
+                        'message': f'A caixa de entrada de {recipient} está cheia'
+                    }
+                notification['id'] = self.history.append(private_conversation(sender, recipient), notification)
+                self.inbox.put(recipient, notification)
+        
+        if recipient_queue is None:
+            # Confirma só depois do fsync (fora do lock: não segura a faixa do destinatário)
+            if not self.inbox.sync():
+                return dispatch.error('message_response', 'Erro ao guardar a mensagem offline')
             return {
                 'type': 'message_response',
-                'status': 'error',
-                'message': 'Dados da mensagem incompletos'
+                'status': 'success',
+                'message': f'{recipient} está offline; a mensagem será entregue no próximo login'
             }
         
-        with self.client_lock:
-            if recipient not in self.clients:
-                return {
-                    'type': 'message_response',
-                    'status': 'error',
-                    'message': 'Usuário destinatário não encontrado'
-                }
-            
-            # Envia mensagem para o destinatário
-            recipient_socket = self.clients[recipient]
-            notification = {
-                'type': 'private_message_received',
-                'sender': sender,
-                'content': content,
-                'timestamp': timestamp
-            }
-            
-            try:
-                recipient_socket.send(json.dumps(notification).encode('utf-8'))
-                return {
-                    'type': 'message_response',
-                    'status': 'success',
-                    'message': 'Mensagem enviada com sucesso'
-                }
-            except:
-                return {
-                    'type': 'message_response',
-                    'status': 'error',
-                    'message': 'Erro ao enviar mensagem'
-                }
+        # Grava no histórico; o id permite ao cliente pedir o que veio depois dele
+        notification['id'] = self.history.append(private_conversation(sender, recipient), notification)
+        
+        # Enfileira a mensagem para o destinatário
+        if self.send_to(recipient_queue, notification):
+            return MESSAGE_SENT
+        return dispatch.error('message_response', 'Erro ao enviar mensagem')
     
+    @handles('create_group', 'creator', trimmed=('group_name',), response='group_response',
+             message='Nome do grupo e criador são obrigatórios')
     def handle_create_group(self, message: dict) -> dict:
         """Cria um novo grupo"""
-        group_name = message.get('group_name', '').strip()
-        creator = message.get('creator')
-        
-        if not group_name or not creator:
-            return {
-                'type': 'group_response',
-                'status': 'error',
-                'message': 'Nome do grupo e criador são obrigatórios'
-            }
+        group_name = message['group_name'].strip()
+        creator = message['creator']
         
-        with self.group_lock:
+        with self.groups.lock(group_name):
             if group_name in self.groups:
-                return {
-                    'type': 'group_response',
-                    'status': 'error',
-                    'message': 'Grupo já existe'
-                }
+                return dispatch.error('group_response', 'Grupo já existe')
             
             # Cria grupo com o criador como primeiro membro
-            self.groups[group_name] = {creator}
+            group = Group(group_name, (creator,))
+            self.groups[group.name] = group
+            with self.user_groups.lock(creator):
+                self.user_groups.setdefault(NAMES.intern(creator), set()).add(group.name)
+            self.log_group_operation('create_group', group_name, creator)
             
             return {
                 'type': 'group_response',
@@ -229,38 +608,27 @@ class ChatServer:
                 'message': f'Grupo "{group_name}" criado com sucesso'
             }
     
+    @handles('group_message', 'sender', 'group_name', 'content', response='message_response',
+             message='Dados da mensagem incompletos')
     def handle_group_message(self, message: dict) -> dict:
         """Processa mensagem para grupo"""
-        sender = message.get('sender')
-        group_name = message.get('group_name')
-        content = message.get('content')
+        sender = message['sender']
+        group_name = message['group_name']
+        content = message['content']
         timestamp = datetime.now().strftime("%H:%M:%S")
         
-        if not all([sender, group_name, content]):
+        group_members = self.group_members(group_name)
+        if group_members is None:
+            return dispatch.error('message_response', 'Grupo não encontrado')
+        
+        # Verifica se o usuário é membro do grupo
+        if sender not in group_members:
             return {
                 'type': 'message_response',
                 'status': 'error',
-                'message': 'Dados da mensagem incompletos'
+                'message': f'Você não é membro do grupo {group_name}. Peça para alguém te adicionar.'
             }
         
-        with self.group_lock:
-            if group_name not in self.groups:
-                return {
-                    'type': 'message_response',
-                    'status': 'error',
-                    'message': 'Grupo não encontrado'
-                }
-            
-            # Verifica se o usuário é membro do grupo
-            if sender not in self.groups[group_name]:
-                return {
-                    'type': 'message_response',
-                    'status': 'error',
-                    'message': f'Você não é membro do grupo {group_name}. Peça para alguém te adicionar.'
-                }
-            
-            group_members = self.groups[group_name].copy()
-        
         # Envia mensagem para todos os membros do grupo (exceto o remetente)
         notification = {
             'type': 'group_message_received',
@@ -270,64 +638,80 @@ class ChatServer:
             'timestamp': timestamp
         }
         
-        delivered_count = 0
-        with self.client_lock:
-            for member in group_members:
-                if member != sender and member in self.clients:
-                    try:
-                        member_socket = self.clients[member]
-                        member_socket.send(json.dumps(notification).encode('utf-8'))
-                        delivered_count += 1
-                    except:
-                        continue
+        notification['id'] = self.history.append(group_conversation(group_name), notification)
+        
+        metrics.observe('fanout_recipients', '', len(group_members) - 1)
+        trace = tracing.current()
+        if trace is None:
+            delivered_count, stored_count = self.fan_out(group_members, notification, sender)
+        else:
+            with trace.span('fanout'):
+                delivered_count, stored_count = self.fan_out(group_members, notification, sender)
         
+        response_message = f'Mensagem enviada para {delivered_count} membros do grupo'
+        if stored_count and not self.inbox.sync():
+            return {
+                'type': 'message_response',
+                'status': 'error',
+                'message': response_message + ', mas não foi possível guardar para os membros offline'
+            }
+        if stored_count:
+            response_message += f' ({stored_count} offline a receberão no próximo login)'
         return {
             'type': 'message_response',
             'status': 'success',
-            'message': f'Mensagem enviada para {delivered_count} membros do grupo'
+            'message': response_message
         }
     
+    def fan_out(self, members: Iterable[str], notification: dict, sender: str = None) -> Tuple[int, int]:
+        """Entrega a notificação aos membros conectados (exceto `sender`) e guarda
+        para os offline. Retorna (entregues, guardadas)"""
+        # Apenas enfileira: um destinatário lento não trava os demais
+        connections = []
+        stored_count = 0
+        for member in members:
+            if member == sender:
+                continue
+            with self.clients.lock(member):
+                connection = self.clients.get(member)
+                if connection is None:
+                    # Membro offline recebe a mensagem no próximo login
+                    stored_count += self.inbox.put(member, notification)
+                else:
+                    connections.append(connection)
+        return self.broadcast(connections, notification), stored_count
+    
+    @handles('add_member', 'requester', trimmed=('group_name', 'new_member'), response='member_response',
+             message='Dados incompletos para adicionar membro')
     def handle_add_member(self, message: dict) -> dict:
         """Adiciona membro a um grupo"""
-        group_name = message.get('group_name', '').strip()
-        new_member = message.get('new_member', '').strip()
-        requester = message.get('requester')
+        group_name = message['group_name'].strip()
+        new_member = message['new_member'].strip()
+        requester = message['requester']
         
-        if not all([group_name, new_member, requester]):
-            return {
-                'type': 'member_response',
-                'status': 'error',
-                'message': 'Dados incompletos para adicionar membro'
-            }
+        # Fora do lock do grupo: no cluster a consulta pode ir a outro nó
+        member_queue = self.lookup_connection(new_member)
         
-        with self.group_lock:
-            if group_name not in self.groups:
-                return {
-                    'type': 'member_response',
-                    'status': 'error',
-                    'message': 'Grupo não encontrado'
-                }
+        # Uma única seção crítica, só na faixa do grupo
+        with self.groups.lock(group_name):
+            members = self.groups.get(group_name)
+            if members is None:
+                return dispatch.error('member_response', 'Grupo não encontrado')
             
             # Verifica se o solicitante é membro do grupo
-            if requester not in self.groups[group_name]:
-                return {
-                    'type': 'member_response',
-                    'status': 'error',
-                    'message': 'Você não é membro deste grupo'
-                }
-        
-        # Verifica se o novo membro está conectado
-        with self.client_lock:
-            if new_member not in self.clients:
+            if requester not in members:
+                return dispatch.error('member_response', 'Você não é membro deste grupo')
+            
+            # Verifica se o novo membro está conectado
+            if member_queue is None:
                 return {
                     'type': 'member_response',
                     'status': 'error',
                     'message': f'Usuário {new_member} não está conectado'
                 }
-        
-        with self.group_lock:
+            
             # Verifica se já é membro
-            if new_member in self.groups[group_name]:
+            if new_member in members:
                 return {
                     'type': 'member_response',
                     'status': 'error',
@@ -335,22 +719,21 @@ class ChatServer:
                 }
             
             # Adiciona o membro
-            self.groups[group_name].add(new_member)
+            members.add(new_member)
+            with self.user_groups.lock(new_member):
+                self.user_groups.setdefault(NAMES.intern(new_member), set()).add(members.name)
+            self.log_group_operation('add_member', group_name, new_member)
         
         # Notifica o novo membro
-        with self.client_lock:
-            if new_member in self.clients:
-                try:
-                    notification = {
-                        'type': 'added_to_group',
-                        'group_name': group_name,
-                        'added_by': requester,
-                        'timestamp': datetime.now().strftime("%H:%M:%S")
-                    }
-                    member_socket = self.clients[new_member]
-                    member_socket.send(json.dumps(notification).encode('utf-8'))
-                except:
-                    pass
+        
+        if member_queue is not None:
+            notification = {
+                'type': 'added_to_group',
+                'group_name': group_name,
+                'added_by': requester,
+                'timestamp': datetime.now().strftime("%H:%M:%S")
+            }
+            self.send_to(member_queue, notification)
         
         return {
             'type': 'member_response',
@@ -358,175 +741,666 @@ class ChatServer:
             'message': f'{new_member} foi adicionado ao grupo {group_name}'
         }
     
+    @handles('list_group_members', 'requester', trimmed=('group_name',), response='members_list_response',
+             message='Nome do grupo é obrigatório')
     def handle_list_group_members(self, message: dict) -> dict:
         """Lista membros de um grupo"""
-        group_name = message.get('group_name', '').strip()
-        requester = message.get('requester')
+        group_name = message['group_name'].strip()
+        requester = message['requester']
+        
+        members = self.group_members(group_name)
+        if members is None:
+            return dispatch.error('members_list_response', 'Grupo não encontrado')
+        
+        # Verifica se o solicitante é membro do grupo
+        if requester not in members:
+            return dispatch.error('members_list_response', 'Você não é membro deste grupo')
         
-        if not group_name or not requester:
+        return {
+            'type': 'members_list_response',
+            'status': 'success',
+            'group_name': group_name,
+            'members': list(members)
+        }
+    
+    @handles('file_begin')
+    def handle_file_begin(self, message: dict) -> dict:
+        """Inicia (ou retoma) o recebimento de um arquivo em partes"""
+        transfer_id = message.get('transfer_id')
+        sender = message.get('sender')
+        recipient = message.get('recipient')  # pode ser usuário ou grupo
+        filename = os.path.basename(message.get('filename') or '')
+        size = message.get('size')
+        file_type = message.get('file_type', 'private')  # 'private' ou 'group'
+        
+        if not all([transfer_id, sender, recipient, filename]) or not str(transfer_id).isalnum():
             return {
-                'type': 'members_list_response',
+                'type': 'file_response',
+                'transfer_id': transfer_id,
                 'status': 'error',
-                'message': 'Nome do grupo é obrigatório'
+                'message': 'Dados do arquivo incompletos'
             }
         
-        with self.group_lock:
-            if group_name not in self.groups:
+        if file_type == 'private':
+            # Envio para usuário específico
+            if self.lookup_connection(recipient) is None:
+                return {
+                    'type': 'file_response',
+                    'transfer_id': transfer_id,
+                    'status': 'error',
+                    'message': 'Usuário destinatário não encontrado'
+                }
+            group_name = None
+            
+        else:  # file_type == 'group'
+            # Envio para grupo
+            members = self.group_members(recipient)
+            if members is None:
                 return {
-                    'type': 'members_list_response',
+                    'type': 'file_response',
+                    'transfer_id': transfer_id,
                     'status': 'error',
                     'message': 'Grupo não encontrado'
                 }
             
-            # Verifica se o solicitante é membro do grupo
-            if requester not in self.groups[group_name]:
+            # Verifica se o remetente é membro do grupo
+            if sender not in members:
                 return {
-                    'type': 'members_list_response',
+                    'type': 'file_response',
+                    'transfer_id': transfer_id,
                     'status': 'error',
-                    'message': 'Você não é membro deste grupo'
+                    'message': f'Você não é membro do grupo {recipient}. Peça para alguém te adicionar.'
+                }
+            group_name = recipient
+        
+        with self.transfer_lock:
+            transfer = self.transfers.get(transfer_id)
+            if transfer is not None and transfer.sender != sender:
+                return {
+                    'type': 'file_response',
+                    'transfer_id': transfer_id,
+                    'status': 'error',
+                    'message': 'Transferência já iniciada'
                 }
             
-            members = list(self.groups[group_name])
+            try:
+                part_path = self.store.temp_path(transfer_id)
+                if transfer is None and os.path.exists(os.path.splitext(part_path)[0] + '.json'):
+                    # Upload suspenso por uma desconexão: continua do último checkpoint
+                    transfer = FileTransfer.resume(part_path)
+                    if transfer.sender != sender or transfer.size != size:
+                        transfer.abort()
+                        transfer = None
+                if transfer is None:
+                    # Grava o arquivo no servidor à medida que os chunks chegam
+                    transfer = FileTransfer(transfer_id, sender, recipient, filename, size, part_path, group_name)
+            except (OSError, ValueError, KeyError) as e:
+                return {
+                    'type': 'file_response',
+                    'transfer_id': transfer_id,
+                    'status': 'error',
+                    'message': f'Erro ao processar arquivo: {str(e)}'
+                }
+            self.transfers[transfer_id] = transfer
         
+        # Informa ao cliente a partir de qual byte ele deve enviar
         return {
-            'type': 'members_list_response',
-            'status': 'success',
-            'group_name': group_name,
-            'members': members
+            'type': 'upload_offset',
+            'transfer_id': transfer_id,
+            'offset': transfer.received
         }
     
-    def handle_send_file(self, message: dict) -> dict:
-        """Processa envio de arquivo"""
-        sender = message.get('sender')
-        recipient = message.get('recipient')  # pode ser usuário ou grupo
-        filename = message.get('filename')
-        file_data = message.get('file_data')  # dados em base64
-        file_type = message.get('file_type', 'private')  # 'private' ou 'group'
+    @handles('file_chunk')
+    def handle_file_chunk(self, message: dict) -> Optional[dict]:
+        """Grava um chunk do upload no disco"""
+        transfer_id = message.get('transfer_id')
+        
+        with self.transfer_lock:
+            transfer = self.transfers.get(transfer_id)
+        if transfer is None or transfer.sender != message.get('sender'):
+            # Chunks de uma transferência recusada ou abortada são ignorados
+            return None
         
-        if not all([sender, recipient, filename, file_data]):
+        # No codec binário os bytes vêm crus; no JSON, em base64
+        data = message.get('data')
+        if not isinstance(data, (bytes, str)):
             return {
                 'type': 'file_response',
+                'transfer_id': transfer_id,
                 'status': 'error',
-                'message': 'Dados do arquivo incompletos'
+                'message': 'Chunk sem dados'
             }
-        
         try:
-            # Salva arquivo no servidor
-            file_path = os.path.join(self.files_dir, f"{sender}_{filename}")
-            with open(file_path, 'wb') as f:
-                f.write(base64.b64decode(file_data))
-            
-            timestamp = datetime.now().strftime("%H:%M:%S")
-            
-            if file_type == 'private':
-                # Envio para usuário específico
-                with self.client_lock:
-                    if recipient not in self.clients:
-                        return {
-                            'type': 'file_response',
-                            'status': 'error',
-                            'message': 'Usuário destinatário não encontrado'
-                        }
-                    
-                    notification = {
-                        'type': 'file_received',
-                        'sender': sender,
-                        'filename': filename,
-                        'file_data': file_data,
-                        'timestamp': timestamp
-                    }
-                    
-                    recipient_socket = self.clients[recipient]
-                    recipient_socket.send(json.dumps(notification).encode('utf-8'))
-                    
-            else:  # file_type == 'group'
-                # Envio para grupo
-                with self.group_lock:
-                    if recipient not in self.groups:
-                        return {
-                            'type': 'file_response',
-                            'status': 'error',
-                            'message': 'Grupo não encontrado'
-                        }
-                    
-                    # Verifica se o remetente é membro do grupo
-                    if sender not in self.groups[recipient]:
-                        return {
-                            'type': 'file_response',
-                            'status': 'error',
-                            'message': f'Você não é membro do grupo {recipient}. Peça para alguém te adicionar.'
-                        }
-                    
-                    group_members = self.groups[recipient].copy()
-                
-                notification = {
-                    'type': 'group_file_received',
-                    'sender': sender,
-                    'group_name': recipient,
-                    'filename': filename,
-                    'file_data': file_data,
-                    'timestamp': timestamp
-                }
-                
-                with self.client_lock:
-                    for member in group_members:
-                        if member != sender and member in self.clients:
-                            try:
-                                member_socket = self.clients[member]
-                                member_socket.send(json.dumps(notification).encode('utf-8'))
-                            except:
-                                continue
-            
+            transfer.write(message.get('offset'), data if isinstance(data, bytes) else base64.b64decode(data))
+        except Exception as e:
+            self.abort_transfer(transfer)
             return {
                 'type': 'file_response',
-                'status': 'success',
-                'message': 'Arquivo enviado com sucesso'
+                'transfer_id': transfer_id,
+                'status': 'error',
+                'message': f'Erro ao processar arquivo: {str(e)}'
             }
-            
+        return None
+    
+    @handles('file_end')
+    def handle_file_end(self, message: dict) -> dict:
+        """Conclui um upload, guarda o blob e notifica os destinatários"""
+        transfer_id = message.get('transfer_id')
+        
+        with self.transfer_lock:
+            transfer = self.transfers.get(transfer_id)
+            if transfer is None or transfer.sender != message.get('sender'):
+                return {
+                    'type': 'file_response',
+                    'transfer_id': transfer_id,
+                    'status': 'error',
+                    'message': 'Transferência não encontrada'
+                }
+            del self.transfers[transfer_id]
+        
+        try:
+            blob = transfer.finish()
+            file_id = self.store.add(
+                transfer.part_path, blob, transfer.received,
+                filename=transfer.filename,
+                sender=transfer.sender,
+                recipient=transfer.recipient,
+                group_name=transfer.group_name
+            )
         except Exception as e:
+            # Upload que não entrou no repositório: libera o arquivo parcial
+            transfer.abort()
             return {
                 'type': 'file_response',
+                'transfer_id': transfer_id,
                 'status': 'error',
                 'message': f'Erro ao processar arquivo: {str(e)}'
             }
+        
+        # A notificação leva só a referência do blob; quem quiser o conteúdo pede com fetch_file
+        notification = {
+            'type': 'group_file_received' if transfer.group_name else 'file_received',
+            'file_id': file_id,
+            'blob': blob,
+            'sender': transfer.sender,
+            'filename': transfer.filename,
+            'size': transfer.received,
+            'timestamp': datetime.now().strftime("%H:%M:%S")
+        }
+        if transfer.group_name:
+            notification['group_name'] = transfer.group_name
+            members = self.group_members(transfer.group_name) or set()
+        else:
+            members = {transfer.recipient}
+        self.broadcast(self.member_queues(members, transfer.sender), notification)
+        
+        return {
+            'type': 'file_response',
+            'transfer_id': transfer_id,
+            'status': 'success',
+            'message': 'Arquivo enviado com sucesso'
+        }
+    
+    def abort_transfer(self, transfer: FileTransfer):
+        """Descarta um upload incompleto"""
+        with self.transfer_lock:
+            self.transfers.pop(transfer.transfer_id, None)
+        transfer.abort()
     
+    @handles('fetch_file', 'file_id', response='file_response', message='Arquivo não encontrado')
+    def handle_fetch_file(self, message: dict, connection: OutboundQueue) -> Optional[dict]:
+        """Envia um arquivo do repositório para quem tem acesso a ele"""
+        file_id = message['file_id']
+        # Quem pede é o usuário da conexão (o campo 'requester' vem do cliente e não é confiável)
+        requester = connection.username
+        offset = message.get('offset', 0)
+        
+        entry = self.store.get(file_id)
+        if entry is None:
+            return dispatch.error('file_response', 'Arquivo não encontrado')
+        
+        # Só o remetente e os destinatários podem baixar o arquivo
+        if entry['group_name']:
+            allowed = requester in (self.group_members(entry['group_name']) or ())
+        else:
+            allowed = requester in (entry['sender'], entry['recipient'])
+        if not allowed:
+            return dispatch.error('file_response', 'Você não tem acesso a este arquivo')
+        
+        if not isinstance(offset, int) or not 0 <= offset <= entry['size']:
+            return dispatch.error('file_response', 'Offset inválido')
+        
+        # O arquivo é lido do disco sob demanda pelo escritor da conexão
+        connection.put(FileStream(self.store.blob_path(entry['blob']), file_id, offset,
+                                  compressible=is_compressible(entry['filename'])))
+        return None
+    
+    @handles('list_files')
+    def handle_list_files(self, message: dict, connection) -> dict:
+        """Lista os arquivos recebidos pelo usuário que ainda estão no servidor"""
+        # Quem pede é o usuário da conexão (o campo 'requester' vem do cliente e não é confiável)
+        requester = connection.username if connection is not None else None
+        if requester is None:
+            return dispatch.error('files_list', 'Faça login para listar os arquivos')
+        
+        with self.user_groups.lock(requester):
+            user_groups = set(self.user_groups.get(requester, ()))
+        
+        return {
+            'type': 'files_list',
+            'files': self.files_for(requester, user_groups)
+        }
+    
+    def files_for(self, requester: str, user_groups: Set[str]) -> List[dict]:
+        """Arquivos do repositório enviados ao usuário ou a grupos dele"""
+        files = []
+        for file_id, entry in self.store.files_for(requester, user_groups).items():
+            if entry['sender'] != requester:
+                files.append({
+                    'file_id': file_id,
+                    'blob': entry['blob'],
+                    'sender': entry['sender'],
+                    'filename': entry['filename'],
+                    'size': entry['size'],
+                    'group_name': entry['group_name']
+                })
+        return files
+    
+    @handles('history')
+    def handle_history(self, message: dict, connection) -> dict:
+        """Mensagens de uma conversa: as últimas `limit` ou as posteriores ao id `since`"""
+        # Quem pede é o usuário da conexão (o campo 'requester' vem do cliente e não é confiável)
+        requester = connection.username if connection is not None else None
+        group_name = message.get('group_name')
+        peer = message.get('with')
+        limit = message.get('limit', 50)
+        since = message.get('since')
+        
+        if requester is None:
+            return dispatch.error('history', 'Faça login para consultar o histórico')
+        if not (group_name or peer):
+            return dispatch.error('history', 'Informe o grupo ou o usuário da conversa')
+        if not isinstance(limit, int) or not 1 <= limit <= HISTORY_MAX_LIMIT or \
+                (since is not None and (not isinstance(since, int) or since < 0)):
+            return dispatch.error('history', f'Parâmetros inválidos (limit de 1 a {HISTORY_MAX_LIMIT}, since >= 0)')
+        
+        if group_name:
+            allowed = requester in (self.group_members(group_name) or ())
+            if not allowed:
+                return {
+                    'type': 'history',
+                    'status': 'error',
+                    'message': f'Você não é membro do grupo {group_name}'
+                }
+            conversation = group_conversation(group_name)
+        else:
+            conversation = private_conversation(requester, peer)
+        
+        return {
+            'type': 'history',
+            'status': 'success',
+            'group_name': group_name,
+            'with': peer,
+            'messages': self.history.read(conversation, since, limit)
+        }
+    
+    def group_members(self, group_name: str) -> Optional[FrozenSet[str]]:
+        """Membros de um grupo (None se ele não existe); trava só a faixa do grupo.
+        O conjunto é imutável e compartilhado entre as chamadas até o grupo mudar"""
+        with self.groups.lock(group_name):
+            members = self.groups.get(group_name)
+            return members.snapshot() if members is not None else None
+    
+    def lookup_connection(self, username: str):
+        """Fila de saída do usuário se ele está conectado (None se não está)"""
+        return self.clients.get(username)
+    
+    def member_queues(self, members: Set[str], sender: str) -> List[OutboundQueue]:
+        """Filas de saída dos membros conectados (exceto o remetente)"""
+        queues = (self.clients.get(member) for member in members if member != sender)
+        return [queue for queue in queues if queue is not None]
+    
+    @handles('queue_stats')
+    def handle_queue_stats(self) -> dict:
+        """Estado das filas de saída de cada usuário"""
+        connections = self.clients.items()
+        
+        return {
+            'type': 'queue_stats',
+            'queues': {username: connection.stats() for username, connection in connections}
+        }
+    
+    @handles('list_users')
     def handle_list_users(self) -> dict:
         """Lista usuários conectados"""
-        with self.client_lock:
-            users = list(self.clients.keys())
+        users = self.clients.keys()
         
         return {
             'type': 'users_list',
             'users': users
         }
     
+    @handles('list_groups')
     def handle_list_groups(self, message: dict) -> dict:
         """Lista grupos disponíveis"""
         username = message.get('username')
         
-        with self.group_lock:
-            if username:
-                # Lista apenas grupos do usuário
-                user_groups = [group for group, members in self.groups.items() 
-                              if username in members]
-                return {
-                    'type': 'groups_list',
-                    'groups': user_groups
-                }
-            else:
-                # Lista todos os grupos
-                return {
-                    'type': 'groups_list',
-                    'groups': list(self.groups.keys())
-                }
+        if username:
+            # Lista apenas grupos do usuário (índice reverso: não percorre todos os grupos)
+            with self.user_groups.lock(username):
+                user_groups = list(self.user_groups.get(username, ()))
+            return {
+                'type': 'groups_list',
+                'groups': user_groups
+            }
+        else:
+            # Lista todos os grupos
+            return {
+                'type': 'groups_list',
+                'groups': self.groups.keys()
+            }
+
+class ChatProtocol(asyncio.Protocol):
+    """Conexão de um cliente no servidor assíncrono (um objeto por socket, sem thread)"""
+    
+    __slots__ = ('server', 'transport', 'queue', 'username', 'decoder', 'waiting', 'lost')
+    
+    def __init__(self, server: 'AsyncChatServer'):
+        self.server = server
+        self.transport = None
+        self.queue = None
+        self.username = None
+        # Buffer começa vazio e é liberado entre mensagens: conexões ociosas não ocupam memória
+        self.decoder = FrameDecoder(buffer_size=0)
+        self.waiting = None  # mensagens atrás de uma que está no pool de threads (na ordem)
+        self.lost = False
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        self.queue = self.server.new_transport_queue(transport)
+        self.server.track_idle(self.queue)
+    
+    def data_received(self, data: bytes):
+        self.queue.last_seen = time.monotonic()
+        metrics.count('bytes_received_total', '', len(data))
+        try:
+            self.decoder.feed(data)
+            for frame in self.decoder.frames():
+                self.receive(frame)
+            self.decoder.release()
+        except FrameError as e:
+            print(f"[SERVIDOR] Frame inválido de {self.peername()}: {e}")
+            self.transport.close()
+        except Exception as e:
+            print(f"[SERVIDOR] Erro com cliente {self.peername()}: {e}")
+            self.transport.close()
+    
+    def receive(self, frame):
+        trace = tracing.begin()
+        message = self.server.decode_frame(frame, self.queue, self.username, trace)
+        if message is None:
+            return
+        if self.waiting is not None:
+            # Uma mensagem anterior ainda está no pool: esta é executada depois dela
+            self.waiting.append((message, trace))
+        elif self.server.may_block(message):
+            self.waiting = deque()
+            self.offload(message, trace)
+        else:
+            self.username = self.server.handle_message(message, self.queue, self.username, trace)
+    
+    def offload(self, message: dict, trace):
+        """Executa no pool uma mensagem que pode esperar outro nó ou processo; a
+        leitura da conexão fica pausada até ela terminar"""
+        self.transport.pause_reading()
+        future = self.server.loop.run_in_executor(self.server.executor, self.server.handle_offloaded,
+                                                  message, self.queue, self.username, trace)
+        future.add_done_callback(self.offloaded)
+    
+    def offloaded(self, future):
+        """Fim de uma mensagem executada no pool (no loop): segue com as que esperavam"""
+        if self.lost:
+            # A conexão caiu durante o handler (que pode ter feito o login): desconecta agora
+            self.waiting = None
+            self.server.disconnect_client(self.queue.username, self.queue)
+            return
+        try:
+            self.username = future.result()
+            while self.waiting:
+                message, trace = self.waiting.popleft()
+                if self.server.may_block(message):
+                    self.offload(message, trace)
+                    return
+                tracing.resume(trace)
+                self.username = self.server.handle_message(message, self.queue, self.username, trace)
+        except Exception as e:
+            print(f"[SERVIDOR] Erro com cliente {self.peername()}: {e}")
+            self.transport.close()
+        self.waiting = None
+        if not self.transport.is_closing():
+            self.transport.resume_reading()
+    
+    def connection_lost(self, exc):
+        self.lost = True
+        self.server.timers.cancel(self.queue)
+        if self.waiting is None:
+            self.server.disconnect_client(self.queue.username, self.queue)
+        # Senão uma mensagem ainda está no pool: offloaded() desconecta quando ela terminar
+        self.queue.close()
+        self.username = None
+    
+    def pause_writing(self):
+        self.queue.pause_writing()
+    
+    def resume_writing(self):
+        self.queue.resume_writing()
+    
+    def peername(self):
+        return self.transport.get_extra_info('peername') if self.transport else None
+
+class AsyncChatServer(ChatServer):
+    """Servidor de chat sobre um loop de eventos asyncio.
+    
+    Reaproveita os mesmos handlers de ChatServer (process_message); cada cliente
+    é um ChatProtocol em vez de uma thread dedicada. Os handlers rodam no
+    próprio loop, então os locks nunca ficam em disputa. A exceção são as
+    mensagens que podem esperar outro nó ou processo (may_block, nos modos
+    cluster e multiprocesso) ou o fsync da caixa de entrada de um destinatário
+    offline: essas vão para um pool de threads, e as seguintes da mesma conexão
+    esperam por elas, sem travar as outras conexões.
+    """
+    
+    def __init__(self, host='localhost', port=12345, backlog=1024, **queue_options):
+        super().__init__(host, port, backlog, **queue_options)
+        self.loop = None
+        # Threads criadas sob demanda: sem mensagens que bloqueiam, o pool fica vazio
+        self.executor = ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix='handler')
+    
+    def close(self):
+        self.executor.shutdown(wait=False)
+        super().close()
+    
+    def may_block(self, message: dict) -> bool:
+        # Mensagem para quem está offline espera o fsync da caixa de entrada
+        recipient = message.get('recipient')
+        return message.get('type') == 'private_message' and type(recipient) is str and recipient not in self.clients
+    
+    def handle_offloaded(self, message: dict, connection, username, trace):
+        """Executa uma mensagem em uma thread do pool (ChatProtocol.offload)"""
+        tracing.resume(trace)
+        return self.handle_message(message, connection, username, trace)
+    
+    def start_server(self):
+        """Inicia o loop de eventos e aceita conexões"""
+        raise_file_limit()
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\n[SERVIDOR] Encerrando servidor...")
+        except Exception as e:
+            print(f"[SERVIDOR] Erro: {e}")
+        finally:
+            self.close()
+    
+    def run_in_server(self, callback, *args):
+        """Agenda a chamada no loop de eventos (os handlers e as filas não são thread-safe)"""
+        if self.loop is None:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+    
+    async def serve(self):
+        """Cria o servidor asyncio e atende conexões até ser interrompido"""
+        self.start_maintenance()
+        self.start_admin()
+        loop = self.loop = asyncio.get_running_loop()
+        self.start_heartbeat()  # os ticks rodam no loop (run_in_server)
+        server = await loop.create_server(
+            lambda: ChatProtocol(self),
+            self.host,
+            self.port,
+            backlog=self.backlog,
+            reuse_address=True,
+            reuse_port=self.reuse_port
+        )
+        print(f"[SERVIDOR] Iniciado em {self.host}:{self.port} (modo asyncio, backlog {self.backlog})")
+        print("[SERVIDOR] Aguardando conexões...")
+        
+        async with server:
+            await server.serve_forever()
+    
+    def new_transport_queue(self, transport) -> TransportQueue:
+        """Cria a fila de saída de uma nova conexão asyncio"""
+        return TransportQueue(transport, self.queue_size, self.queue_policy, self.queue_timeout,
+                              loop=asyncio.get_running_loop(), batch_delay=self.batch_delay,
+                              batch_bytes=self.batch_bytes)
+
+class WorkerChatServer(WorkerMixin, ChatServer):
+    """Worker do modo multiprocesso com uma thread por cliente"""
+
+class AsyncWorkerChatServer(WorkerMixin, AsyncChatServer):
+    """Worker do modo multiprocesso com loop de eventos asyncio"""
+
+class ChatHub(HubMixin, ChatServer):
+    """Processo principal do modo multiprocesso: presença, grupos e caixas de entrada"""
+
+class ClusterChatServer(ClusterMixin, ChatServer):
+    """Nó de um cluster com uma thread por cliente"""
+
+class AsyncClusterChatServer(ClusterMixin, AsyncChatServer):
+    """Nó de um cluster com loop de eventos asyncio"""
+
+def raise_file_limit():
+    """Eleva o limite de descritores abertos até o máximo permitido (muitas conexões)"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
 
 def main():
     """Função principal do servidor"""
+    parser = argparse.ArgumentParser(description="Servidor do Chat Distribuído")
+    parser.add_argument('--host', default='localhost', help="endereço de escuta")
+    parser.add_argument('--port', type=int, default=12345, help="porta de escuta")
+    parser.add_argument('--mode', choices=['thread', 'async'], default='thread',
+                        help="thread: uma thread por cliente; async: loop de eventos asyncio")
+    parser.add_argument('--backlog', type=int, default=None,
+                        help="fila de conexões pendentes do listen() (padrão: 10 em thread, 1024 em async)")
+    parser.add_argument('--queue-size', type=int, default=1024,
+                        help="máximo de frames na fila de saída de cada cliente")
+    parser.add_argument('--queue-policy', choices=POLICIES, default=POLICY_BLOCK,
+                        help="ação quando a fila de um cliente enche")
+    parser.add_argument('--queue-timeout', type=float, default=5.0,
+                        help="segundos de espera por espaço na política 'block'")
+    parser.add_argument('--batch-delay', type=float, default=DEFAULT_BATCH_DELAY,
+                        help="segundos que um frame pode esperar para sair junto com outros (0: só agrupa o que já está na fila)")
+    parser.add_argument('--batch-bytes', type=int, default=DEFAULT_BATCH_BYTES,
+                        help="bytes de frames agrupados que são enviados sem esperar")
+    parser.add_argument('--file-retention', type=float, default=None,
+                        help="segundos até um arquivo enviado expirar do servidor (padrão: nunca)")
+    parser.add_argument('--upload-ttl', type=float, default=86400.0,
+                        help="segundos que um upload interrompido aguarda ser retomado")
+    parser.add_argument('--inbox-size', type=int, default=1000,
+                        help="máximo de mensagens guardadas para cada usuário offline")
+    parser.add_argument('--inbox-ttl', type=float, default=604800.0,
+                        help="segundos que uma mensagem offline aguarda entrega")
+    parser.add_argument('--lock-stripes', type=int, default=DEFAULT_STRIPES,
+                        help="faixas (cada uma com seu lock) dos registros de usuários e grupos")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processos aceitando conexões na mesma porta (SO_REUSEPORT); acima de 1 ativa o modo multiprocesso")
+    parser.add_argument('--compression', choices=[COMPRESSION_ZLIB, 'none'], default=COMPRESSION_ZLIB,
+                        help="compressão oferecida aos clientes que a pedem no login")
+    parser.add_argument('--data-dir', default='server_files',
+                        help="diretório de arquivos, grupos, caixas de entrada e histórico")
+    parser.add_argument('--cluster', default=None,
+                        help="nós do cluster: nome=host:porta:porta_cluster,... (todos os nós recebem a mesma lista)")
+    parser.add_argument('--node', default=None,
+                        help="nome deste nó na lista de --cluster")
+    parser.add_argument('--admin-port', type=int, default=None,
+                        help="porta local (127.0.0.1) com as métricas em /metrics; no modo multiprocesso o worker N usa porta + N + 1")
+    parser.add_argument('--heartbeat-interval', type=float, default=30.0,
+                        help="segundos sem receber nada de um cliente até o servidor enviar um ping (0 desliga)")
+    parser.add_argument('--idle-timeout', type=float, default=90.0,
+                        help="segundos sem receber nada (nem o pong) até a conexão ser derrubada")
+    parser.add_argument('--trace', action='store_true',
+                        help="inicia com o rastreamento por requisição ligado (também pode ser ligado em /trace)")
+    parser.add_argument('--trace-buffer', type=int, default=tracing.DEFAULT_TRACE_BUFFER,
+                        help="traces guardados no buffer circular de cada processo")
+    args = parser.parse_args()
+    tracing.TRACER.configure(args.trace, args.trace_buffer)
+    
     print("=== SERVIDOR DE CHAT DISTRIBUÍDO ===")
     print("Trabalho de Sistemas Distribuídos")
     print("Pressione Ctrl+C para parar o servidor\n")
     
-    server = ChatServer()
+    options = {
+        'queue_size': args.queue_size,
+        'queue_policy': args.queue_policy,
+        'queue_timeout': args.queue_timeout,
+        'batch_delay': args.batch_delay,
+        'batch_bytes': args.batch_bytes,
+        'file_retention': args.file_retention,
+        'upload_ttl': args.upload_ttl,
+        'inbox_size': args.inbox_size,
+        'inbox_ttl': args.inbox_ttl,
+        'lock_stripes': args.lock_stripes,
+        'data_dir': args.data_dir,
+        'compression': args.compression != 'none',
+        'admin_port': args.admin_port,
+        'heartbeat_interval': args.heartbeat_interval,
+        'idle_timeout': args.idle_timeout
+    }
+    if args.backlog is not None:
+        options['backlog'] = args.backlog
+    
+    if args.cluster:
+        cluster = parse_cluster(args.cluster)
+        if args.node not in cluster:
+            print(f"[SERVIDOR] Informe com --node um dos nós do cluster: {', '.join(cluster)}")
+            return
+        if args.workers > 1:
+            print("[SERVIDOR] O modo cluster não pode ser combinado com --workers")
+            return
+        host, port, _ = cluster[args.node]
+        server_class = AsyncClusterChatServer if args.mode == 'async' else ClusterChatServer
+        server = server_class(host, port, node=args.node, cluster=cluster, **options)
+        server.start_server()
+        return
+    
+    if args.workers > 1:
+        if not hasattr(os, 'fork') or not hasattr(socket, 'SO_REUSEPORT'):
+            print("[SERVIDOR] Modo multiprocesso indisponível nesta plataforma (requer fork e SO_REUSEPORT)")
+            return
+        worker_class = AsyncWorkerChatServer if args.mode == 'async' else WorkerChatServer
+        run_workers(worker_class, ChatHub, args.host, args.port, args.workers, **options)
+        return
+    
+    server_class = AsyncChatServer if args.mode == 'async' else ChatServer
+    server = server_class(args.host, args.port, **options)
     server.start_server()
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+"""Testes do codec binário (codec.py)"""
+
+import unittest
+
+import codec
+
+class CodecTest(unittest.TestCase):
+    
+    def assertRoundTrip(self, message: dict):
+        self.assertEqual(codec.unpack(codec.pack(message)), message)
+    
+    def test_known_type_and_fields(self):
+        self.assertRoundTrip({'type': 'private_message', 'sender': 'ana', 'recipient': 'bia', 'content': 'oi'})
+    
+    def test_unknown_type_and_fields(self):
+        self.assertRoundTrip({'type': 'tipo_novo', 'campo_novo': 1})
+        self.assertRoundTrip({'type': 5})
+    
+    def test_integers(self):
+        for value in (0, 1, 127, 128, 255, 256, 65535, 65536, 2 ** 32, 2 ** 64 - 1,
+                      -1, -32, -33, -128, -129, -32768, -32769, -2 ** 31 - 1, -2 ** 63):
+            self.assertRoundTrip({'id': value})
+        with self.assertRaises(ValueError):
+            codec.pack({'id': 2 ** 64})
+    
+    def test_strings_of_every_size(self):
+        for size in (0, 31, 32, 255, 256, 65535, 65536):
+            self.assertRoundTrip({'content': 'a' * size})
+        self.assertRoundTrip({'content': 'ação 漢字 🙂'})
+    
+    def test_binary_data(self):
+        for size in (0, 255, 256, 70000):
+            self.assertRoundTrip({'type': 'file_chunk', 'data': bytes(range(256)) * (size // 256) + b'x' * (size % 256)})
+        self.assertEqual(codec.unpack(codec.pack({'data': bytearray(b'abc')})), {'data': b'abc'})
+    
+    def test_nested_values(self):
+        self.assertRoundTrip({
+            'type': 'offline_messages',
+            'messages': [{'type': 'private_message_received', 'id': index, 'content': str(index)} for index in range(20)],
+            'users': [],
+            'groups': {'g': [True, False, None, 1.5]}
+        })
+    
+    def test_tuple_becomes_list(self):
+        self.assertEqual(codec.unpack(codec.pack({'members': ('a', 'b')})), {'members': ['a', 'b']})
+    
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            codec.pack({'members': {'a'}})
+    
+    def test_invalid_payload(self):
+        payload = codec.pack({'type': 'login', 'username': 'ana'})
+        with self.assertRaises(ValueError):
+            codec.unpack(payload[:-1])
+        with self.assertRaises(ValueError):
+            codec.unpack(payload + b'\x00')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+"""Testes da tabela de despacho (dispatch.py)"""
+
+import unittest
+
+import dispatch
+from dispatch import Schema
+
+class SchemaTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.error = {'type': 'error', 'status': 'error', 'message': 'Dados incompletos'}
+        self.schema = Schema(('sender', 'group_name'), ('group_name',), self.error)
+    
+    def test_valid_message(self):
+        self.assertIsNone(self.schema.check({'sender': 'ana', 'group_name': ' g '}))
+    
+    def test_missing_or_empty_fields(self):
+        for message in ({}, {'sender': 'ana'}, {'group_name': 'g'}, {'sender': '', 'group_name': 'g'},
+                        {'sender': 'ana', 'group_name': '   '}):
+            self.assertIs(self.schema.check(message), self.error)
+    
+    def test_fields_must_be_text(self):
+        for value in (None, 1, ['ana'], {'nome': 'ana'}, b'ana'):
+            self.assertIs(self.schema.check({'sender': value, 'group_name': 'g'}), self.error)
+            self.assertIs(self.schema.check({'sender': 'ana', 'group_name': value}), self.error)
+
+class ErrorTest(unittest.TestCase):
+    
+    def test_errors_are_constant_and_preencoded(self):
+        response = dispatch.error('message_response', 'Grupo não encontrado')
+        self.assertIs(dispatch.error('message_response', 'Grupo não encontrado'), response)
+        for codec_name in dispatch.CODECS:
+            self.assertIs(dispatch.encode_response(response, codec_name),
+                          dispatch.encode_response(response, codec_name))
+        self.assertEqual(dispatch.encode_response(dict(response), 'json'),
+                         dispatch.encode_response(response, 'json'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""Testes do repositório de arquivos (filestore.py)"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import filestore
+from filestore import BlobStore
+
+class BlobStoreTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def upload(self, store: BlobStore, content: bytes, **metadata) -> str:
+        temp_path = store.temp_path(os.urandom(4).hex())
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        metadata.setdefault('sender', 'ana')
+        return store.add(temp_path, content.hex().ljust(4, '0'), len(content), **metadata)
+    
+    def test_deduplication_and_gc(self):
+        store = BlobStore(self.directory)
+        first = self.upload(store, b'abc', recipient='bia', group_name=None)
+        second = self.upload(store, b'abc', recipient='caio', group_name=None)
+        self.assertEqual(store.stats(), {'files': 2, 'blobs': 1, 'bytes': 3})
+        store.release(first)
+        self.assertEqual(store.gc(), 0)
+        store.release(second)
+        self.assertEqual(store.gc(), 1)
+    
+    def test_index_survives_restart_and_compaction(self):
+        store = BlobStore(self.directory)
+        file_ids = [self.upload(store, b'%d' % index, recipient='bia', group_name=None)
+                    for index in range(filestore.COMPACT_EVERY + 5)]
+        store.release(file_ids[0])
+        reopened = BlobStore(self.directory)
+        self.assertEqual(reopened.entries(), store.entries())
+        self.assertEqual(len(reopened.entries()), filestore.COMPACT_EVERY + 4)
+    
+    def test_torn_log_line_is_discarded(self):
+        store = BlobStore(self.directory)
+        file_id = self.upload(store, b'x', recipient='bia', group_name=None)
+        with open(store.log_path, 'ab') as f:
+            f.write(b'{"id": "incomple')
+        reopened = BlobStore(self.directory)
+        second = self.upload(reopened, b'y', recipient='bia', group_name=None)
+        self.assertEqual(set(BlobStore(self.directory).entries()), {file_id, second})
+    
+    def test_files_for(self):
+        store = BlobStore(self.directory)
+        private = self.upload(store, b'p', recipient='bia', group_name=None)
+        group = self.upload(store, b'g', recipient='g', group_name='g')
+        self.upload(store, b'o', recipient='caio', group_name=None)
+        self.assertEqual(set(store.files_for('bia', {'g'})), {private, group})
+        self.assertEqual(set(store.files_for('bia', ())), {private})
+        store.release(private)
+        self.assertEqual(set(store.files_for('bia', {'g'})), {group})
+
+if __name__ == '__main__':
+    unittest.main()
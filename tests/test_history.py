@@ -0,0 +1,93 @@
+"""Testes do histórico de mensagens (history.py)"""
+
+import shutil
+import tempfile
+import unittest
+
+import history
+from history import ConversationLog, HistoryStore, INDEX_INTERVAL, private_conversation, group_conversation
+
+class ConversationLogTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def fill(self, log: ConversationLog, count: int):
+        for index in range(count):
+            self.assertEqual(log.append({'content': f'm{index + 1}'}), index + 1)
+    
+    def test_index_lookup(self):
+        log = ConversationLog(self.directory)
+        self.fill(log, INDEX_INTERVAL * 5 + 3)
+        for message_id in (1, INDEX_INTERVAL - 1, INDEX_INTERVAL, INDEX_INTERVAL + 1, INDEX_INTERVAL * 3 + 7):
+            entry_id, offset = log._seek(log.segments[0], message_id)
+            self.assertLessEqual(entry_id, message_id)
+            self.assertLess(message_id - entry_id, INDEX_INTERVAL)
+            self.assertEqual(log._read_segment(log.segments[0], message_id, 1, None)[0]['id'], message_id)
+    
+    def test_read_since_and_latest(self):
+        log = ConversationLog(self.directory)
+        self.fill(log, 200)
+        self.assertEqual([message['id'] for message in log.read(since=150, limit=10)], list(range(151, 161)))
+        self.assertEqual([message['id'] for message in log.read(limit=5)], list(range(196, 201)))
+        self.assertEqual(log.read(since=200), [])
+    
+    def test_reads_across_segments(self):
+        log = ConversationLog(self.directory, segment_size=1024, max_segments=100)
+        self.fill(log, 300)
+        self.assertGreater(len(log.segments), 3)
+        self.assertEqual([message['id'] for message in log.read(since=0, limit=300)], list(range(1, 301)))
+        self.assertEqual([message['content'] for message in log.read(since=99, limit=2)], ['m100', 'm101'])
+    
+    def test_old_segments_are_dropped(self):
+        log = ConversationLog(self.directory, segment_size=1024, max_segments=2)
+        self.fill(log, 300)
+        self.assertEqual(len(log.segments), 2)
+        messages = log.read(since=0, limit=300)
+        self.assertEqual(messages[0]['id'], log.segments[0])
+        self.assertEqual(messages[-1]['id'], 300)
+    
+    def test_recover_after_restart(self):
+        log = ConversationLog(self.directory)
+        self.fill(log, INDEX_INTERVAL + 10)
+        log_path, _ = log._paths(log.segments[-1])
+        with open(log_path, 'ab') as f:
+            f.write(b'{"content": "incomple')
+        
+        log = ConversationLog(self.directory)
+        self.assertEqual(log.next_id, INDEX_INTERVAL + 11)
+        self.assertEqual(log.append({'content': 'depois'}), INDEX_INTERVAL + 11)
+        self.assertEqual(log.read(limit=1)[0]['content'], 'depois')
+
+class HistoryStoreTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_conversations_are_separate(self):
+        store = HistoryStore(self.directory)
+        store.append(private_conversation('ana', 'bia'), {'content': 'oi'})
+        store.append(private_conversation('bia', 'ana'), {'content': 'olá'})
+        store.append(group_conversation('g'), {'content': 'grupo'})
+        self.assertEqual([message['content'] for message in store.read(private_conversation('ana', 'bia'))],
+                         ['oi', 'olá'])
+        self.assertEqual(store.read(group_conversation('g'))[0]['id'], 1)
+        self.assertEqual(store.read(group_conversation('vazio')), [])
+        self.assertNotIn(group_conversation('vazio'), store.logs)
+    
+    def test_least_recently_used_logs_are_dropped(self):
+        store = HistoryStore(self.directory, max_logs=2)
+        for conversation in ('a', 'b', 'a', 'c'):
+            store.append(conversation, {'content': conversation})
+        self.assertEqual(list(store.logs), ['a', 'c'])
+        self.assertEqual(store.append('b', {'content': 'b'}), 2)  # reaberto do disco
+        self.assertEqual(list(store.logs), ['c', 'b'])
+
+if __name__ == '__main__':
+    unittest.main()
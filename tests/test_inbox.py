@@ -0,0 +1,50 @@
+"""Testes das caixas de entrada offline (inbox.py)"""
+
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from inbox import OfflineInbox
+
+class OfflineInboxTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.inbox = OfflineInbox(self.directory)
+        for username in ('ana', 'bia'):
+            self.inbox.register(username)
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_sync_is_one_fsync_per_inbox(self):
+        self.inbox.put('ana', {'content': '1'})
+        self.inbox.put('ana', {'content': '2'})
+        self.inbox.put('bia', {'content': '3'})
+        with mock.patch('inbox.os.fsync') as fsync:
+            self.assertTrue(self.inbox.sync())
+            self.assertEqual(fsync.call_count, 2)
+            self.assertTrue(self.inbox.sync())  # nada pendente: não grava de novo
+            self.assertEqual(fsync.call_count, 2)
+        self.assertEqual(self.inbox.synced, 3)
+    
+    def test_failed_sync_is_retried(self):
+        self.inbox.put('ana', {'content': '1'})
+        with mock.patch('inbox.os.fsync', side_effect=OSError('disco cheio')):
+            self.assertFalse(self.inbox.sync())
+        self.assertEqual(self.inbox.synced, 0)
+        with mock.patch('inbox.os.fsync') as fsync:
+            self.assertTrue(self.inbox.sync())
+            self.assertEqual(fsync.call_count, 1)
+        self.assertEqual(list(self.inbox.take('ana')), [[{'content': '1'}]])
+    
+    def test_reload_counts_messages(self):
+        self.inbox.put('ana', {'content': '1'})
+        self.inbox.sync()
+        inbox = OfflineInbox(self.directory)
+        self.assertEqual(inbox.stats(), {'users': 1, 'messages': 1})
+        self.assertEqual(list(inbox.take('ana')), [[{'content': '1'}]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Testes do log de grupos (journal.py)"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from journal import GroupJournal
+
+class GroupJournalTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def write(self, operations, snapshot_interval: int = 1000):
+        journal = GroupJournal(self.directory, snapshot_interval)
+        journal.load()
+        journal.start()
+        for operation, group, user in operations:
+            journal.append(operation, group=group, user=user)
+        journal.sync()
+        journal.close()
+    
+    def load(self) -> GroupJournal:
+        journal = GroupJournal(self.directory)
+        self.groups = journal.load()
+        return journal
+    
+    def test_replay(self):
+        self.write([('create_group', 'g', 'ana'), ('add_member', 'g', 'bia'), ('create_group', 'h', 'bia')])
+        journal = self.load()
+        self.assertEqual(self.groups, {'g': {'ana', 'bia'}, 'h': {'bia'}})
+        self.assertEqual((journal.seq, journal.replayed), (3, 3))
+        journal.close()
+    
+    def test_truncated_tail(self):
+        self.write([('create_group', 'g', 'ana'), ('add_member', 'g', 'bia')])
+        log_path = os.path.join(self.directory, 'groups.log')
+        with open(log_path, 'ab') as f:
+            f.write(b'{"op": "add_member", "group": "g", "us')  # queda no meio da escrita
+        
+        journal = self.load()
+        self.assertEqual(self.groups, {'g': {'ana', 'bia'}})
+        self.assertEqual(journal.seq, 2)
+        journal.close()
+        with open(log_path, 'rb') as f:
+            self.assertTrue(f.read().endswith(b'\n'))  # o final incompleto foi descartado
+        
+        # Operações novas entram depois da última linha válida
+        self.write([('add_member', 'g', 'caio')])
+        journal = self.load()
+        self.assertEqual(self.groups, {'g': {'ana', 'bia', 'caio'}})
+        self.assertEqual(journal.seq, 3)
+        journal.close()
+    
+    def test_snapshot_and_log(self):
+        self.write([('create_group', 'g', 'ana')] + [('add_member', 'g', f'u{index}') for index in range(9)],
+                   snapshot_interval=4)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'groups.snapshot.json')))
+        journal = self.load()
+        self.assertEqual(self.groups, {'g': {'ana'} | {f'u{index}' for index in range(9)}})
+        self.assertEqual(journal.seq, 10)
+        self.assertLess(journal.replayed, 10)
+        journal.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Testes do enquadramento de mensagens (protocol.py)"""
+
+import json
+import unittest
+
+from protocol import FrameDecoder, FrameError, FrameCompressor, HEADER, COMPRESSED_FLAG, CODEC_BINARY, \
+    encode_frame, encode_message, decode_message
+
+class FrameDecoderTest(unittest.TestCase):
+    
+    def test_frames_split_across_feeds(self):
+        data = encode_message({'type': 'ping'}) + encode_message({'type': 'pong', 'id': 7})
+        decoder = FrameDecoder(buffer_size=8)
+        received = []
+        for position in range(len(data)):
+            decoder.feed(data[position:position + 1])
+            received.extend(decode_message(frame) for frame in decoder.frames())
+        self.assertEqual(received, [{'type': 'ping'}, {'type': 'pong', 'id': 7}])
+    
+    def test_partial_header_yields_nothing(self):
+        decoder = FrameDecoder()
+        decoder.feed(encode_frame(b'{}')[:HEADER.size - 1])
+        self.assertEqual(list(decoder.frames()), [])
+    
+    def test_several_frames_in_one_feed(self):
+        decoder = FrameDecoder()
+        decoder.feed(b''.join(encode_frame(bytes([value]) * value) for value in range(1, 4)))
+        self.assertEqual([bytes(frame) for frame in decoder.frames()], [b'\x01', b'\x02\x02', b'\x03\x03\x03'])
+    
+    def test_frame_larger_than_buffer(self):
+        payload = b'x' * 100000
+        decoder = FrameDecoder(buffer_size=16)
+        frame = encode_frame(payload)
+        decoder.feed(frame[:50000])
+        self.assertEqual(list(decoder.frames()), [])
+        decoder.feed(frame[50000:])
+        self.assertEqual([bytes(frame) for frame in decoder.frames()], [payload])
+    
+    def test_oversized_frame(self):
+        decoder = FrameDecoder(max_frame_size=1024)
+        decoder.feed(HEADER.pack(1025))
+        with self.assertRaises(FrameError):
+            list(decoder.frames())
+    
+    def test_oversized_compressed_frame(self):
+        decoder = FrameDecoder(max_frame_size=1024)
+        compressed = FrameCompressor().compress(encode_frame(b'a' * 4096))
+        (length,) = HEADER.unpack_from(compressed)
+        self.assertTrue(length & COMPRESSED_FLAG)
+        decoder.feed(compressed)
+        with self.assertRaises(FrameError):
+            list(decoder.frames())
+    
+    def test_compressed_frames(self):
+        compressor, decoder = FrameCompressor(), FrameDecoder()
+        messages = [{'type': 'private_message', 'content': 'olá ' * 50, 'id': index} for index in range(3)]
+        for message in messages:
+            decoder.feed(compressor.compress(encode_message(message)))
+        self.assertEqual([decode_message(frame) for frame in decoder.frames()], messages)
+    
+    def test_decode_message_detects_codec(self):
+        message = {'type': 'login', 'username': 'ana'}
+        for frame in (encode_message(message), encode_message(message, CODEC_BINARY)):
+            self.assertEqual(decode_message(memoryview(frame)[HEADER.size:]), message)
+        self.assertEqual(json.loads(encode_message(message)[HEADER.size:]), message)
+
+if __name__ == '__main__':
+    unittest.main()
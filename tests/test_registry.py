@@ -0,0 +1,80 @@
+"""Testes dos registros e grupos (registry.py)"""
+
+import unittest
+
+from registry import StripedDict, Group, NameTable, NAMES, LARGE_GROUP
+
+class GroupTest(unittest.TestCase):
+    
+    def test_small_group_uses_set(self):
+        group = Group('pequeno', [f'p{index}' for index in range(LARGE_GROUP)])
+        self.assertIsNone(group.ids)
+        self.assertEqual(len(group), LARGE_GROUP)
+    
+    def test_transition_to_array(self):
+        names = [f't{index}' for index in range(LARGE_GROUP + 1)]
+        group = Group('grande', names[:-1])
+        self.assertIsNone(group.ids)
+        self.assertTrue(group.add(names[-1]))
+        self.assertIsNone(group.members)
+        self.assertEqual(list(group.ids), sorted(group.ids))
+        self.assertEqual(len(group), LARGE_GROUP + 1)
+        self.assertEqual(set(group), set(names))
+        for name in names:
+            self.assertIn(name, group)
+        self.assertNotIn('t-ausente', group)
+    
+    def test_add_after_transition(self):
+        group = Group('maior', [f'm{index}' for index in range(LARGE_GROUP + 1)])
+        self.assertFalse(group.add('m0'))
+        self.assertTrue(group.add('m-novo'))
+        self.assertIn('m-novo', group)
+        self.assertEqual(len(group), LARGE_GROUP + 2)
+        self.assertEqual(list(group.ids), sorted(group.ids))
+    
+    def test_snapshot_is_shared_until_a_member_joins(self):
+        group = Group('snapshot', [f's{index}' for index in range(LARGE_GROUP + 1)])
+        snapshot = group.snapshot()
+        self.assertEqual(snapshot, set(group))
+        self.assertIs(group.snapshot(), snapshot)
+        self.assertFalse(group.add('s0'))
+        self.assertIs(group.snapshot(), snapshot)
+        self.assertTrue(group.add('s-novo'))
+        self.assertIn('s-novo', group.snapshot())
+        self.assertNotIn('s-novo', snapshot)
+    
+    def test_members_are_interned(self):
+        name = ''.join(['membro', '-', 'internado'])
+        group = Group('internados', [name])
+        self.assertIs(next(iter(group)), NAMES.intern('membro-internado'))
+    
+    def test_lookup_does_not_intern(self):
+        group = Group('consulta', [f'c{index}' for index in range(LARGE_GROUP + 1)])
+        size = len(NAMES)
+        self.assertNotIn('c-nunca-visto', group)
+        self.assertEqual(len(NAMES), size)
+
+class NameTableTest(unittest.TestCase):
+    
+    def test_ids_are_stable(self):
+        table = NameTable()
+        self.assertEqual([table.id(name) for name in ('a', 'b', 'a')], [0, 1, 0])
+        self.assertEqual(table.names, ['a', 'b'])
+        self.assertEqual(len(table), 2)
+
+class StripedDictTest(unittest.TestCase):
+    
+    def test_operations(self):
+        registry = StripedDict(stripes=4)
+        for index in range(20):
+            registry[f'k{index}'] = index
+        self.assertEqual(len(registry), 20)
+        self.assertEqual(registry.get('k3'), 3)
+        self.assertEqual(sorted(registry.keys()), sorted(f'k{index}' for index in range(20)))
+        self.assertEqual(registry.setdefault('k3', 99), 3)
+        self.assertFalse(registry.pop_if('k3', object()))
+        self.assertEqual(registry.pop('k3'), 3)
+        self.assertNotIn('k3', registry)
+
+if __name__ == '__main__':
+    unittest.main()
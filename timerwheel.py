@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Roda de temporizadores do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Hashed timer wheel: os prazos são arredondados para "ticks" e guardados na
+posição (tick % posições) de um vetor circular. Agendar e cancelar custam O(1)
+e cada tick só olha a sua posição, então acompanhar o prazo de 100 mil conexões
+não precisa de um timer (ou de uma thread) por conexão
+"""
+
+import math
+import threading
+import time
+from typing import Dict, Hashable, List, Optional
+
+DEFAULT_TICK = 1.0  # segundos por tick
+DEFAULT_SLOTS = 512  # posições da roda (prazos maiores dão mais de uma volta)
+
+class TimerWheel:
+    """Prazos por chave: schedule(chave, atraso) substitui o prazo anterior da
+    chave e advance() devolve as chaves vencidas"""
+    
+    def __init__(self, tick: float = DEFAULT_TICK, slots: int = DEFAULT_SLOTS, now: Optional[float] = None):
+        self.tick = tick
+        self.slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]  # chave -> tick do prazo
+        self.timers: Dict[Hashable, int] = {}  # chave -> posição na roda
+        self.origin = time.monotonic() if now is None else now
+        self.current = 0  # último tick processado
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.timers)
+    
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.timers
+    
+    def schedule(self, key: Hashable, delay: float):
+        """(Re)agenda o prazo da chave para daqui a `delay` segundos (no mínimo um tick)"""
+        with self._lock:
+            slot = self.timers.get(key)
+            if slot is not None:
+                del self.slots[slot][key]
+            deadline = self.current + max(1, math.ceil(delay / self.tick))
+            slot = deadline % len(self.slots)
+            self.slots[slot][key] = deadline
+            self.timers[key] = slot
+    
+    def cancel(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._cancel(key)
+    
+    def _cancel(self, key: Hashable) -> bool:
+        slot = self.timers.pop(key, None)
+        if slot is None:
+            return False
+        del self.slots[slot][key]
+        return True
+    
+    def advance(self, now: Optional[float] = None) -> List[Hashable]:
+        """Processa os ticks até `now` e devolve as chaves vencidas (já removidas)"""
+        target = int(((time.monotonic() if now is None else now) - self.origin) / self.tick)
+        expired = []
+        with self._lock:
+            while self.current < target:
+                self.current += 1
+                slot = self.slots[self.current % len(self.slots)]
+                # Quem está na posição mas vence em outra volta continua lá
+                due = [key for key, deadline in slot.items() if deadline <= self.current]
+                for key in due:
+                    del slot[key]
+                    del self.timers[key]
+                expired.extend(due)
+        return expired
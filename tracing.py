@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Rastreamento do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Traces por requisição (id + tempo de cada etapa: decodificação, handler, espera
+por lock, fan-out, codificação) guardados em um buffer circular, e um profiler
+por amostragem que pode ser ligado e desligado com o servidor rodando
+"""
+
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import List, Optional
+
+DEFAULT_TRACE_BUFFER = 4096  # traces guardados (os mais antigos saem primeiro)
+DEFAULT_PROFILE_INTERVAL = 0.01  # segundos entre amostras do profiler
+MAX_STACK_DEPTH = 64
+
+class Span:
+    """Mede um trecho de código dentro de um trace (with trace.span('nome'))"""
+    
+    __slots__ = ('trace', 'name', 'start')
+    
+    def __init__(self, trace: 'Trace', name: str):
+        self.trace = trace
+        self.name = name
+    
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.trace.add(self.name, self.start, time.perf_counter_ns())
+
+class Trace:
+    """Uma requisição: id, tipo, usuário e as etapas (nome, início, fim em ns)"""
+    
+    __slots__ = ('id', 'type', 'user', 'time', 'begin', 'end', 'spans')
+    
+    def __init__(self, trace_id: int):
+        self.id = trace_id
+        self.type = None
+        self.user = None
+        self.time = time.time()
+        self.begin = time.perf_counter_ns()
+        self.end = None
+        self.spans = []
+    
+    def add(self, name: str, start: int, end: int):
+        self.spans.append((name, start, end))
+    
+    def span(self, name: str) -> Span:
+        return Span(self, name)
+    
+    def duration(self) -> int:
+        return (self.end or time.perf_counter_ns()) - self.begin
+    
+    def as_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'pid': os.getpid(),
+            'type': self.type,
+            'user': self.user,
+            'time': time.strftime('%H:%M:%S', time.localtime(self.time)) + f'.{int(self.time * 1000) % 1000:03d}',
+            'total_us': round(self.duration() / 1000, 1),
+            'spans': [{'name': name, 'start_us': round((start - self.begin) / 1000, 1),
+                       'us': round((end - start) / 1000, 1)}
+                      for name, start, end in sorted(self.spans, key=lambda span: span[1])]
+        }
+
+class Tracer:
+    """Traces do processo. Desligado, cada requisição custa só a verificação de `enabled`"""
+    
+    def __init__(self, size: int = DEFAULT_TRACE_BUFFER):
+        self.enabled = False
+        self.buffer = deque(maxlen=size)  # append/popleft atômicos sob o GIL
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+    
+    def configure(self, enabled: bool, size: Optional[int] = None):
+        if size is not None and size != self.buffer.maxlen:
+            self.buffer = deque(self.buffer, maxlen=max(1, size))
+        self.enabled = enabled
+    
+    def begin(self) -> Optional[Trace]:
+        """Abre o trace de uma requisição na thread atual (None se desligado)"""
+        if not self.enabled:
+            return None
+        trace = self._local.trace = Trace(next(self._ids))
+        return trace
+    
+    def finish(self, trace: Optional[Trace], msg_type: str, username: Optional[str]):
+        if trace is None:
+            return
+        trace.end = time.perf_counter_ns()
+        trace.type = msg_type
+        trace.user = username
+        self._local.trace = None
+        self.buffer.append(trace)
+    
+    def current(self) -> Optional[Trace]:
+        """Trace aberto na thread atual, se houver"""
+        return getattr(self._local, 'trace', None) if self.enabled else None
+    
+    def resume(self, trace: Optional[Trace]):
+        """Torna `trace` o trace atual desta thread (requisição que continua depois
+        ou em outra thread, como as executadas no pool do servidor assíncrono)"""
+        if trace is not None:
+            self._local.trace = trace
+    
+    def lock_wait(self, name: str, start: int, end: int):
+        """Espera por um lock ocupado (chamado por metrics.TimedLock)"""
+        trace = self.current()
+        if trace is not None:
+            trace.add('lock:' + name, start, end)
+    
+    def dump(self, limit: int = 100, min_us: float = 0, msg_type: Optional[str] = None) -> List[dict]:
+        """Traces mais recentes primeiro, opcionalmente só os lentos ou de um tipo"""
+        result = []
+        for trace in reversed(list(self.buffer)):
+            if len(result) >= limit:
+                break
+            if trace.duration() < min_us * 1000 or (msg_type and trace.type != msg_type):
+                continue
+            result.append(trace.as_dict())
+        return result
+    
+    def status(self) -> dict:
+        return {'enabled': self.enabled, 'buffer': self.buffer.maxlen, 'recorded': len(self.buffer)}
+    
+    def reset(self):
+        """Descarta os traces herdados (no processo filho após um fork)"""
+        self.buffer.clear()
+        self._local = threading.local()
+
+class SamplingProfiler:
+    """Profiler por amostragem: a cada intervalo lê a pilha de todas as threads
+    (sys._current_frames) e conta as pilhas no formato "collapsed" dos flame graphs"""
+    
+    def __init__(self):
+        self.stacks = Counter()
+        self.samples = 0
+        self.interval = DEFAULT_PROFILE_INTERVAL
+        self.started = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+    
+    def start(self, interval: float = DEFAULT_PROFILE_INTERVAL) -> bool:
+        """Começa uma nova coleta; False se já há uma em andamento"""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.interval = max(0.001, interval)
+            self.started = time.monotonic()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='profiler')
+            self._thread.daemon = True
+            self._thread.start()
+            return True
+    
+    def stop(self) -> str:
+        """Encerra a coleta e devolve as pilhas (linhas "pilha;de;chamadas contagem")"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        return self.collapsed()
+    
+    def collapsed(self) -> str:
+        lines = [f'{stack} {count}' for stack, count in self.stacks.most_common()]
+        return '\n'.join(lines) + '\n' if lines else ''
+    
+    def status(self) -> dict:
+        elapsed = time.monotonic() - self.started if self.started is not None else 0
+        return {'running': self.running, 'interval': self.interval, 'samples': self.samples,
+                'seconds': round(elapsed, 1) if self.running else None}
+    
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread_label(thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    self.stacks[collapse(names.get(ident, 'thread'), frame)] += 1
+            self.samples += 1
+
+def thread_label(name: str) -> str:
+    """Nome da thread sem a numeração (as threads dos clientes somam juntas)"""
+    return re.sub(r'-\d+', '', name)
+
+def collapse(root: str, frame) -> str:
+    """Pilha de uma thread, da raiz até o frame atual, separada por ';'"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    names.append(root)
+    return ';'.join(reversed(names))
+
+# Instâncias do processo (configuradas pela linha de comando e pela porta de administração)
+TRACER = Tracer()
+PROFILER = SamplingProfiler()
+begin = TRACER.begin
+finish = TRACER.finish
+current = TRACER.current
+resume = TRACER.resume
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=TRACER.reset)
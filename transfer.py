@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Transferência de arquivos em partes do Chat Distribuído - Trabalho de Sistemas Distribuídos
+Um upload é gravado no disco à medida que os chunks chegam (memória constante) e
+pode ser retomado: o servidor registra periodicamente quantos bytes já recebeu
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from protocol import HEADER, encode_message
+from outbound import FileRegion
+
+# Tamanho de cada chunk lido do arquivo pelo cliente
+CHUNK_SIZE = 64 * 1024
+
+# A cada quantos bytes recebidos o progresso do upload é gravado no disco
+CHECKPOINT_INTERVAL = 1024 * 1024
+
+# Tamanho de cada trecho binário de um download (um sendfile por trecho)
+SEGMENT_SIZE = 1024 * 1024
+
+# Extensões de arquivos já comprimidos: a compressão da conexão não os comprime de novo
+COMPRESSED_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp3', '.aac', '.ogg', '.opus', '.m4a', '.mp4', '.mkv', '.mov', '.webm', '.avi',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.apk', '.jar'
+}
+
+def is_compressible(filename: str) -> bool:
+    """Se vale comprimir o conteúdo do arquivo (pela extensão)"""
+    return os.path.splitext(filename or '')[1].lower() not in COMPRESSED_EXTENSIONS
+
+class TransferError(Exception):
+    """Chunk fora de ordem ou transferência inconsistente"""
+
+class FileTransfer:
+    """Upload em andamento: arquivo parcial no disco e hash calculado incrementalmente.
+    
+    Ao lado do arquivo parcial (.part) fica um .json com os metadados e o último
+    offset confirmado (checkpoint). Um upload retomado continua desse offset.
+    """
+    
+    def __init__(self, transfer_id: str, sender: str, recipient: str, filename: str, size: int,
+                 part_path: str, group_name: str = None, received: int = 0):
+        self.transfer_id = transfer_id
+        self.sender = sender
+        self.recipient = recipient
+        self.filename = filename
+        self.size = size
+        self.part_path = part_path
+        self.meta_path = os.path.splitext(part_path)[0] + '.json'
+        self.group_name = group_name
+        self.received = received
+        self._hash = hashlib.sha256()
+        
+        if received:
+            # Retomada: descarta o que passou do checkpoint e recalcula o hash do prefixo
+            self._file = open(self.part_path, 'r+b')
+            self._file.truncate(received)
+            for chunk in iter(lambda: self._file.read(CHUNK_SIZE), b''):
+                self._hash.update(chunk)
+        else:
+            self._file = open(self.part_path, 'wb')
+        self.checkpoint()
+    
+    @classmethod
+    def resume(cls, part_path: str) -> 'FileTransfer':
+        """Reabre um upload suspenso a partir do seu último checkpoint"""
+        with open(os.path.splitext(part_path)[0] + '.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(meta['transfer_id'], meta['sender'], meta['recipient'], meta['filename'],
+                   meta['size'], part_path, meta['group_name'], meta['received'])
+    
+    def write(self, offset: int, data: bytes):
+        """Grava um chunk; os chunks precisam chegar em ordem"""
+        if offset != self.received:
+            raise TransferError(f'Chunk no offset {offset}, esperado {self.received}')
+        if self.size is not None and self.received + len(data) > self.size:
+            raise TransferError('Arquivo maior que o tamanho anunciado')
+        self._file.write(data)
+        self._hash.update(data)
+        self.received += len(data)
+        
+        if self.received - self._checkpointed >= CHECKPOINT_INTERVAL:
+            self.checkpoint()
+    
+    def checkpoint(self):
+        """Garante os bytes recebidos no disco e grava o offset confirmado"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        
+        meta = {
+            'transfer_id': self.transfer_id,
+            'sender': self.sender,
+            'recipient': self.recipient,
+            'filename': self.filename,
+            'size': self.size,
+            'group_name': self.group_name,
+            'received': self.received,
+            'updated': time.time()
+        }
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+        self._checkpointed = self.received
+    
+    def suspend(self):
+        """Interrompe o upload mantendo o progresso para uma retomada"""
+        self.checkpoint()
+        self._file.close()
+    
+    def finish(self) -> str:
+        """Fecha o arquivo parcial e retorna o hash (SHA-256) do conteúdo"""
+        self._file.close()
+        self._remove(self.meta_path)
+        if self.size is not None and self.received != self.size:
+            self._remove(self.part_path)
+            raise TransferError(f'Recebidos {self.received} de {self.size} bytes')
+        return self._hash.hexdigest()
+    
+    def abort(self):
+        """Descarta o arquivo parcial"""
+        self._file.close()
+        self._remove(self.part_path)
+        self._remove(self.meta_path)
+    
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def expire_partials(directory: str, ttl: float, active=()) -> int:
+    """Apaga uploads suspensos há mais de `ttl` segundos. Retorna quantos foram apagados.
+    Um .part sem o .json (upload concluído que não chegou ao repositório) também expira"""
+    limit = time.time() - ttl
+    expired = 0
+    names = set(os.listdir(directory))
+    for name in names:
+        transfer_id, extension = os.path.splitext(name)
+        if transfer_id in active:
+            continue
+        if extension == '.part' and transfer_id + '.json' not in names:
+            part_path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(part_path) < limit:
+                    os.remove(part_path)
+                    expired += 1
+            except OSError:
+                pass
+            continue
+        if extension != '.json':
+            continue
+        
+        meta_path = os.path.join(directory, name)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                updated = json.load(f)['updated']
+        except (OSError, ValueError, KeyError):
+            updated = os.path.getmtime(meta_path)
+        if updated >= limit:
+            continue
+        
+        for path in (meta_path, os.path.join(directory, transfer_id + '.part')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        expired += 1
+    return expired
+
+class FileStream:
+    """Envio preguiçoso de um arquivo armazenado para um cliente.
+    
+    Fica na fila de saída como um único item. Cada trecho do arquivo vai como um
+    frame JSON file_data seguido de um frame binário com os bytes, que o escritor
+    da conexão envia do disco direto para o socket (sendfile): o conteúdo do
+    arquivo não passa pelo heap do Python nem é codificado em base64.
+    Se a conexão comprime e o arquivo é comprimível, o trecho é lido e comprimido.
+    """
+    
+    def __init__(self, path: str, file_id: str, offset: int = 0, compressible: bool = False):
+        self.path = path
+        self.file_id = file_id
+        self.offset = offset
+        self.compressible = compressible
+    
+    def __len__(self):
+        # Peso do item na contagem de bytes da fila
+        return CHUNK_SIZE
+    
+    def frames(self):
+        """Gera os frames de cada trecho (file_data + FileRegion) e, ao final, o frame file_complete"""
+        offset = self.offset
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            yield encode_message({
+                'type': 'file_response',
+                'status': 'error',
+                'message': 'Arquivo não encontrado no servidor'
+            })
+            return
+        
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            while offset < size:
+                count = min(SEGMENT_SIZE, size - offset)
+                yield encode_message({
+                    'type': 'file_data',
+                    'file_id': self.file_id,
+                    'offset': offset,
+                    'size': count
+                })
+                # Frame binário: o cabeçalho vai no FileRegion e o payload sai do arquivo
+                yield FileRegion(f, offset, count, HEADER.pack(count), self.compressible)
+                offset += count
+        
+        yield encode_message({
+            'type': 'file_complete',
+            'file_id': self.file_id,
+            'size': offset
+        })
@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""
+Modo multiprocesso do Chat Distribuído - Trabalho de Sistemas Distribuídos
+N processos worker aceitam conexões na mesma porta (SO_REUSEPORT) e um processo
+principal (hub) guarda a presença, os grupos e as caixas de entrada. Hub e workers
+conversam por um barramento local sobre sockets Unix (um socketpair por worker)
+"""
+
+import os
+import sys
+import signal
+import socket
+import itertools
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+from protocol import FrameDecoder, HEADER_SIZE, CODEC_JSON, encode_frame, encode_message, decode_message, \
+    encode_cached, recode_frame
+
+# Operações do barramento seguidas de um frame bruto (o frame já codificado para o cliente)
+RAW_OPS = {'route', 'deliver', 'store'}
+
+# Pedidos de clientes executados no hub (alteram o estado compartilhado dos grupos)
+HUB_REQUESTS = {'create_group', 'add_member'}
+
+# Pedidos que esperam uma resposta do hub (no servidor assíncrono vão para o pool de threads)
+HUB_CALLS = HUB_REQUESTS | {'login'}
+
+# Segundos de espera pela resposta do hub
+CALL_TIMEOUT = 10.0
+
+class BusLink:
+    """Uma ponta do barramento: frames JSON, alguns seguidos de um frame bruto (RAW_OPS)"""
+    
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.decoder = FrameDecoder()
+        self.ready = False  # hub: o worker já recebeu o estado inicial
+        self.closed = False
+    
+    def send(self, message: dict, raw: bytes = None) -> bool:
+        """Envia uma mensagem (e o frame bruto). Retorna False se a outra ponta fechou"""
+        data = encode_message(message)
+        if raw is not None:
+            data += encode_frame(raw)
+        with self.lock:
+            if self.closed:
+                return False
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.closed = True
+                return False
+        return True
+    
+    def messages(self):
+        """Gera (mensagem, frame bruto ou None) até a outra ponta fechar"""
+        pending = None
+        try:
+            while self.decoder.recv_into(self.sock):
+                for frame in self.decoder.frames():
+                    if pending is not None:
+                        yield pending, bytes(frame)
+                        pending = None
+                        continue
+                    message = decode_message(frame)
+                    if message.get('op') in RAW_OPS:
+                        pending = message
+                    else:
+                        yield message, None
+        except OSError:
+            pass
+        self.closed = True
+    
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+class BusClient:
+    """Ponta do barramento no worker.
+    
+    Uma thread lê o barramento: respostas acordam quem fez call() e atualizações
+    de grupos são aplicadas na hora (chegam antes da resposta que as causou).
+    Presença e entregas vão para uma segunda thread, porque podem esperar locks
+    de faixa que um handler segura enquanto aguarda uma resposta do hub.
+    """
+    
+    def __init__(self, sock: socket.socket, worker_id: int):
+        self.link = BusLink(sock)
+        self.worker_id = worker_id
+        self.server = None
+        self.closing = False
+        self._ids = itertools.count(1)
+        self._replies: Dict[int, dict] = {}
+        self._cond = threading.Condition()
+        self._pushes = deque()
+    
+    def start(self, server):
+        """Inicia as threads de leitura e de despacho do barramento"""
+        self.server = server
+        for target in (self._read, self._dispatch):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+    
+    def send(self, op: str, raw: bytes = None, **fields) -> bool:
+        """Envia uma mensagem ao hub sem esperar resposta"""
+        return self.link.send(dict(fields, op=op), raw)
+    
+    def call(self, op: str, **fields) -> Optional[dict]:
+        """Envia um pedido ao hub e espera a resposta (None se o hub não respondeu)"""
+        request_id = next(self._ids)
+        if not self.send(op, rid=request_id, **fields):
+            return None
+        with self._cond:
+            self._cond.wait_for(lambda: request_id in self._replies or self.link.closed, CALL_TIMEOUT)
+            return self._replies.pop(request_id, None)
+    
+    def route(self, users: List[str], frame: bytes):
+        """Entrega um frame a usuários conectados em outros workers (o hub sabe onde estão)"""
+        self.send('route', frame, users=users)
+    
+    def close(self):
+        self.closing = True
+        self.link.close()
+    
+    def _read(self):
+        for message, raw in self.link.messages():
+            op = message['op']
+            if op == 'reply':
+                with self._cond:
+                    self._replies[message['rid']] = message
+                    self._cond.notify_all()
+            elif op == 'group':
+                self.server.apply_group(message['group'], message['members'])
+            else:
+                with self._cond:
+                    self._pushes.append((message, raw))
+                    self._cond.notify_all()
+        
+        with self._cond:
+            self._cond.notify_all()
+        if not self.closing:
+            # Hub encerrado: sem ele não há presença nem grupos, o worker também termina
+            print(f"[SERVIDOR] Worker {self.worker_id}: barramento fechado, encerrando")
+            os.kill(os.getpid(), signal.SIGINT)
+    
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pushes)
+                message, raw = self._pushes.popleft()
+            try:
+                self.server.handle_bus_push(message, raw)
+            except Exception as e:
+                print(f"[SERVIDOR] Worker {self.worker_id}: erro ao processar {message.get('op')}: {e}")
+
+class RemoteQueue:
+    """Fila de um usuário conectado em outro worker: os frames seguem pelo barramento"""
+    
+    codec = CODEC_JSON  # entre processos sempre JSON; o worker do usuário recodifica se preciso
+    
+    __slots__ = ('bus', 'username', 'worker')
+    
+    def __init__(self, bus: BusClient, username: str, worker: int):
+        self.bus = bus
+        self.username = username
+        self.worker = worker
+    
+    def __len__(self):
+        return 0
+    
+    def put(self, frame: bytes) -> bool:
+        self.bus.route([self.username], frame)
+        return True
+    
+    def depth(self) -> int:
+        return 0
+    
+    def stats(self) -> dict:
+        return {'worker': self.worker}
+
+class RemoteInbox:
+    """Caixas de entrada vistas de um worker: ficam no hub, que decide entre guardar e entregar"""
+    
+    def __init__(self, bus: BusClient):
+        self.bus = bus
+    
+    def known(self, username: str) -> bool:
+        reply = self.bus.call('inbox_known', user=username)
+        return bool(reply and reply['result'])
+    
+    def full(self, username: str) -> bool:
+        reply = self.bus.call('inbox_full', user=username)
+        return reply is None or reply['result']
+    
+    def put(self, username: str, message: dict) -> bool:
+        # O hub entrega direto se o usuário entrou em outro worker nesse meio tempo
+        return self.bus.send('inbox_put', user=username, message=message)
+    
+    def sync(self) -> bool:
+        # O hub atende cada worker em ordem: quando responde, os put() anteriores já passaram pelo fsync
+        reply = self.bus.call('inbox_sync')
+        return bool(reply and reply['result'])
+    
+    def expire(self) -> int:
+        return 0  # a expiração roda no hub
+
+class WorkerMixin:
+    """Worker do modo multiprocesso (combinado com ChatServer ou AsyncChatServer).
+    
+    Mantém réplicas da presença (usuários de outros workers aparecem em `clients`
+    como RemoteQueue) e dos grupos; o hub é a fonte da verdade. Login, saída,
+    criação de grupo e adição de membro passam pelo hub; mensagens para usuários de
+    outros workers seguem pelo barramento como frames prontos.
+    """
+    
+    reuse_port = True
+    shared_files = True
+    
+    def __init__(self, *args, bus: BusClient, **options):
+        self.bus = bus
+        self.worker_id = bus.worker_id
+        self.admin_offset = self.worker_id + 1  # o hub usa a própria --admin-port
+        super().__init__(*args, **options)
+    
+    def load_groups(self):
+        # Grupos e presença chegam do hub (o log de grupos é só dele)
+        self.journal = None
+        self.bus.start(self)
+        if self.bus.call('hello') is None:
+            raise RuntimeError('Hub não respondeu')
+    
+    def open_inbox(self, inbox_size: int, inbox_ttl: float):
+        return RemoteInbox(self.bus)
+    
+    def close(self):
+        self.close_admin()
+        self.bus.close()
+    
+    def start_maintenance(self):
+        pass  # a manutenção roda no hub
+    
+    def local_connections(self):
+        return [(username, connection) for username, connection in self.clients.items()
+                if not isinstance(connection, RemoteQueue)]
+    
+    def register_client(self, username: str, connection):
+        # O hub garante o nome em todos os workers e devolve as mensagens offline.
+        # O lock da faixa segura entregas para o usuário até ele estar registrado aqui
+        with self.clients.lock(username):
+            reply = self.bus.call('claim', user=username)
+            if not reply or reply['status'] != 'success':
+                return None
+            self.clients[username] = connection
+        return iter(reply['batches'])
+    
+    def unregister_client(self, username: str, connection) -> bool:
+        with self.clients.lock(username):
+            if not super().unregister_client(username, connection):
+                return False
+            self.bus.send('release', user=username)
+            return True
+    
+    def may_block(self, message: dict) -> bool:
+        msg_type = message.get('type')
+        if msg_type in HUB_CALLS:
+            return True
+        # Mensagem para quem está offline consulta a caixa de entrada, que fica no hub
+        recipient = message.get('recipient')
+        return msg_type == 'private_message' and type(recipient) is str and recipient not in self.clients
+    
+    def handle_create_group(self, message: dict) -> dict:
+        return self.forward_request(message, 'group_response')
+    
+    def handle_add_member(self, message: dict) -> dict:
+        return self.forward_request(message, 'member_response')
+    
+    def forward_request(self, message: dict, response_type: str) -> dict:
+        """Executa o pedido no hub; a réplica local dos grupos é atualizada antes da resposta"""
+        reply = self.bus.call('request', message=message)
+        if reply is None:
+            return {
+                'type': response_type,
+                'status': 'error',
+                'message': 'Servidor indisponível, tente novamente'
+            }
+        return reply['response']
+    
+    def broadcast(self, connections, message: dict) -> int:
+        # Usuários de outros workers vão num único frame pelo barramento
+        frames = {}
+        delivered_count = 0
+        remote = []
+        for connection in connections:
+            if isinstance(connection, RemoteQueue):
+                remote.append(connection.username)
+            elif connection.put(encode_cached(message, connection.codec, frames)):
+                delivered_count += 1
+        if remote:
+            self.bus.route(remote, encode_cached(message, CODEC_JSON, frames))
+            delivered_count += len(remote)
+        return delivered_count
+    
+    def handle_bus_push(self, message: dict, raw: Optional[bytes]):
+        """Presença e entregas enviadas pelo hub (thread de despacho do barramento)"""
+        op = message['op']
+        if op == 'presence':
+            self.apply_presence(message['user'], message['worker'])
+        elif op == 'deliver':
+            for username in message['users']:
+                self.run_in_server(self.deliver_local, username, raw)
+    
+    def apply_presence(self, username: str, worker: Optional[int]):
+        """Atualiza a réplica: usuário entrou em outro worker (ou saiu, com worker None)"""
+        with self.clients.lock(username):
+            current = self.clients.get(username)
+            if worker is None:
+                if isinstance(current, RemoteQueue):
+                    self.clients.pop_if(username, current)
+            elif worker != self.worker_id and (current is None or isinstance(current, RemoteQueue)):
+                username = sys.intern(username)
+                self.clients[username] = RemoteQueue(self.bus, username, worker)
+    
+    def deliver_local(self, username: str, frame: bytes):
+        """Entrega um frame vindo do barramento; se o usuário já saiu, o hub o guarda"""
+        with self.clients.lock(username):
+            connection = self.clients.get(username)
+            if connection is not None and connection.put(recode_frame(frame, connection.codec)):
+                return
+        self.bus.send('store', frame, users=[username])
+
+class WorkerQueue:
+    """Conexão de um usuário vista pelo hub: o worker onde ele está conectado"""
+    
+    codec = CODEC_JSON
+    
+    __slots__ = ('hub', 'worker', 'username')
+    
+    def __init__(self, hub: 'HubMixin', worker: int, username: str):
+        self.hub = hub
+        self.worker = worker
+        self.username = username
+    
+    def __len__(self):
+        return 0
+    
+    def put(self, frame: bytes) -> bool:
+        return self.hub.links[self.worker].send({'op': 'deliver', 'users': [self.username]}, frame)
+    
+    def depth(self) -> int:
+        return 0
+    
+    def stats(self) -> dict:
+        return {'worker': self.worker}
+
+class HubMixin:
+    """Processo principal do modo multiprocesso (combinado com ChatServer).
+    
+    Não aceita clientes: atende os workers pelo barramento. Em `clients` cada
+    usuário aponta para o worker onde está (WorkerQueue); os handlers de grupo e
+    as caixas de entrada são os mesmos do servidor de um processo só. Toda mudança
+    de presença é publicada sob o lock da faixa do usuário, então cada worker vê as
+    mudanças de um mesmo usuário na ordem em que aconteceram.
+    """
+    
+    shared_files = True
+    
+    def local_connections(self):
+        return []  # os clientes estão nos workers
+    
+    def serve_workers(self, sockets: List[socket.socket]):
+        """Atende os workers até todos encerrarem"""
+        self.links = [BusLink(sock) for sock in sockets]
+        self.start_maintenance()
+        self.start_admin()
+        threads = []
+        for worker, link in enumerate(self.links):
+            thread = threading.Thread(target=self.handle_worker, args=(worker, link))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    
+    def handle_worker(self, worker: int, link: BusLink):
+        for message, raw in link.messages():
+            try:
+                reply = self.handle_bus_message(worker, link, message, raw)
+            except Exception as e:
+                print(f"[SERVIDOR] Erro no barramento com o worker {worker}: {e}")
+                reply = {}
+            if 'rid' in message:
+                link.send(dict(reply or {}, op='reply', rid=message['rid']))
+        
+        # Worker encerrado: os usuários dele ficam offline
+        print(f"[SERVIDOR] Worker {worker} encerrado")
+        for username, queue in self.clients.items():
+            if queue.worker == worker:
+                self.release(worker, username)
+    
+    def handle_bus_message(self, worker: int, link: BusLink, message: dict, raw: Optional[bytes]) -> Optional[dict]:
+        op = message['op']
+        if op == 'hello':
+            self.send_state(link)
+        elif op == 'claim':
+            username = sys.intern(message['user'])
+            batches = self.register_client(username, WorkerQueue(self, worker, username))
+            if batches is None:
+                return {'status': 'error'}
+            return {'status': 'success', 'batches': list(batches)}
+        elif op == 'release':
+            self.release(worker, message['user'])
+        elif op == 'request':
+            request = message['message']
+            if request.get('type') not in HUB_REQUESTS:
+                return {'response': {'type': 'error', 'message': 'Tipo de mensagem não reconhecido'}}
+            return {'response': self.process_message(request, None)}
+        elif op == 'route':
+            self.route(message['users'], raw)
+        elif op == 'store':
+            stored = decode_message(memoryview(raw)[HEADER_SIZE:])
+            for username in message['users']:
+                self.inbox.put(username, stored)
+        elif op == 'inbox_put':
+            self.inbox_put(message['user'], message['message'])
+        elif op == 'inbox_known':
+            return {'result': self.inbox.known(message['user'])}
+        elif op == 'inbox_full':
+            return {'result': self.inbox.full(message['user'])}
+        elif op == 'inbox_sync':
+            return {'result': self.inbox.sync()}
+        return None
+    
+    def send_state(self, link: BusLink):
+        """Envia grupos e presença a um worker que acabou de iniciar"""
+        link.ready = True  # daqui em diante o worker recebe as publicações
+        for group_name, members in self.groups.items():
+            with self.groups.lock(group_name):
+                link.send({'op': 'group', 'group': group_name, 'members': sorted(members)})
+        for username in self.clients.keys():
+            with self.clients.lock(username):
+                queue = self.clients.get(username)
+                if queue is not None:
+                    link.send({'op': 'presence', 'user': username, 'worker': queue.worker})
+    
+    def publish(self, message: dict, skip: Optional[int] = None):
+        for worker, link in enumerate(self.links):
+            if link.ready and worker != skip:
+                link.send(message)
+    
+    def register_client(self, username: str, connection: WorkerQueue):
+        with self.clients.lock(username):
+            batches = super().register_client(username, connection)
+            if batches is not None:
+                self.publish({'op': 'presence', 'user': username, 'worker': connection.worker},
+                             skip=connection.worker)
+            return batches
+    
+    def release(self, worker: int, username: str):
+        """Usuário saiu do worker (ignora se ele já entrou de novo em outro)"""
+        with self.clients.lock(username):
+            queue = self.clients.get(username)
+            if queue is None or queue.worker != worker:
+                return
+            self.clients.pop_if(username, queue)
+            self.publish({'op': 'presence', 'user': username, 'worker': None}, skip=worker)
+    
+    def log_group_operation(self, operation: str, group_name: str, username: str):
+        super().log_group_operation(operation, group_name, username)
+        # Inclusive para o worker que pediu: a atualização chega a ele antes da resposta
+        self.publish({'op': 'group', 'group': group_name, 'members': [username]})
+    
+    def route(self, users: List[str], frame: bytes):
+        """Repassa o frame ao worker de cada usuário; quem saiu recebe na caixa de entrada"""
+        by_worker: Dict[int, List[str]] = {}
+        offline = []
+        for username in users:
+            queue = self.clients.get(username)
+            if queue is None:
+                offline.append(username)
+            else:
+                by_worker.setdefault(queue.worker, []).append(username)
+        for worker, worker_users in by_worker.items():
+            self.links[worker].send({'op': 'deliver', 'users': worker_users}, frame)
+        if offline:
+            stored = decode_message(memoryview(frame)[HEADER_SIZE:])
+            for username in offline:
+                self.inbox.put(username, stored)
+    
+    def inbox_put(self, username: str, message: dict):
+        """Guarda a mensagem ou, se o usuário entrou nesse meio tempo, entrega ao worker dele"""
+        with self.clients.lock(username):
+            queue = self.clients.get(username)
+            if queue is None:
+                self.inbox.put(username, message)
+                return
+        queue.put(encode_message(message))
+
+def run_workers(worker_class, hub_class, host: str, port: int, workers: int, **options):
+    """Cria os workers (fork) e atende o barramento no processo principal"""
+    pairs = [socket.socketpair() for _ in range(workers)]
+    pids = []
+    for worker, (hub_end, worker_end) in enumerate(pairs):
+        pid = os.fork()
+        if pid == 0:
+            # Worker: fica só com a sua ponta do barramento
+            for other_hub_end, other_worker_end in pairs:
+                other_hub_end.close()
+                if other_worker_end is not worker_end:
+                    other_worker_end.close()
+            status = 0
+            try:
+                server = worker_class(host, port, bus=BusClient(worker_end, worker), **options)
+                print(f"[SERVIDOR] Worker {worker} iniciado (pid {os.getpid()})")
+                server.start_server()
+            except BaseException as e:
+                print(f"[SERVIDOR] Worker {worker} falhou: {e}")
+                status = 1
+            finally:
+                os._exit(status)
+        pids.append(pid)
+        worker_end.close()
+    
+    # O hub só cria threads depois dos forks
+    hub = hub_class(host, port, **options)
+    print(f"[SERVIDOR] Hub iniciado com {workers} worker(s) em {host}:{port}")
+    try:
+        hub.serve_workers([hub_end for hub_end, _ in pairs])
+    except KeyboardInterrupt:
+        print("\n[SERVIDOR] Encerrando servidor...")
+        # Fechar o barramento encerra os workers que não receberam o Ctrl+C
+        for link in hub.links:
+            link.close()
+    finally:
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except (OSError, KeyboardInterrupt):
+                pass
+        hub.close()